@@ -0,0 +1,51 @@
+"""
+Dependency closures for released packages
+"""
+from __future__ import absolute_import
+
+import shutil
+import logging
+import tempfile
+
+from common import communicate
+
+from launch import pkgrep
+from launch import lockfile
+
+
+def register_closure(package, version):
+    """
+    Resolve a registered version exactly as flaunch would launch it and
+    store the outcome with Atom. Launching can then install everything
+    from a single lookup rather than discovering the graph level by level.
+    Nothing is installed, only the launch.json of each package is read.
+    :param package: The name of the package
+    :param version: The version that was just registered
+    :return: bool
+    """
+    logging.info('Computing dependency closure: {}/{}'.format(package, version))
+    metadata = tempfile.mkdtemp(prefix='flaunch_closure_')
+    try:
+        resolved = pkgrep.resolve_application(
+            '{}/{}'.format(package, version), set(), metadata=metadata
+        )
+        closure = lockfile.Lockfile.from_resolution(
+            package, [], False, [], resolved
+        )
+    except lockfile.LockfileError as e:
+        logging.warning('Skipping dependency closure: {}'.format(str(e)))
+        return False
+    except SystemExit:
+        # -- Resolving failed (already reported). The release itself stands
+        logging.warning('Could not resolve the dependency closure of: {}/{}'
+                        .format(package, version))
+        return False
+    finally:
+        shutil.rmtree(metadata, ignore_errors=True)
+
+    if communicate.register_closure(package, version, closure.data):
+        logging.info('Registered dependency closure ({} packages)'.format(
+            len(closure.entries)
+        ))
+        return True
+    return False
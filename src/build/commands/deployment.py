@@ -139,7 +139,7 @@ class ReleaseCommand(_BuildCommand):
         use_force = manager.arguments.force
         use_beta = manager.arguments.beta
 
-        communicate.register_package(
+        result = communicate.register_package(
             self.data.package,
             self.data.version,
             method='post',
@@ -148,3 +148,7 @@ class ReleaseCommand(_BuildCommand):
             pre_release=self.data.beta or use_beta
         )
 
+        if result and not getattr(manager.arguments, 'skip_closure', False):
+            from build.closure import register_closure
+            register_closure(self.data.package, self.data.version)
+
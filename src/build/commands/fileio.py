@@ -257,6 +257,61 @@ class ZipCommand(_BuildCommand):
             action='store_true'
         )
 
+        parser.add_argument(
+            '-u', '--update',
+            action='store_true',
+            help='If the archive already exists, bring it up to date with the '
+                 'files. Unchanged files are copied over without compressing '
+                 'them again and files that are gone are dropped'
+        )
+
+        parser.add_argument(
+            '--base',
+            help='Like --update, but the unchanged files come from another '
+                 'archive (e.g. the previous build)'
+        )
+
+        parser.add_argument(
+            '-m', '--manifest',
+            action='store_true',
+            help='Embed a manifest of every file (size, mode, mtime and '
+                 'sha256) that installs are verified against'
+        )
+
+        parser.add_argument(
+            '-j', '--jobs',
+            type=int,
+            default=1,
+            help='Compress this many files at a time (0 for one per core)'
+        )
+
+        parser.add_argument(
+            '-l', '--level',
+            type=int,
+            choices=range(10),
+            help='Deflate level, 1 (fastest) to 9 (smallest). 0 stores everything'
+        )
+
+        parser.add_argument(
+            '-s', '--store',
+            action='append',
+            help='File patterns to store without compressing (unix pattern matching ok)'
+        )
+
+        parser.add_argument(
+            '--auto-store',
+            action='store_true',
+            help='Store files that are compressed already (by extension, or '
+                 'when a sample of them does not compress)'
+        )
+
+        parser.add_argument(
+            '--reproducible',
+            action='store_true',
+            help='Build the same archive from the same files every time (sorted, '
+                 'with normalized timestamps and permissions)'
+        )
+
         parser.add_argument(
             '-n', '--noisey',
             action='store_true',
@@ -320,13 +375,31 @@ class ZipCommand(_BuildCommand):
             if not name.endswith('.zip'):
                 name += '.zip'
 
+            if self.data.append and (self.data.update or self.data.base):
+                raise RuntimeError(
+                    ':ZIP cannot --append with --update or --base: {}'.format(name)
+                )
+
+            base = self.data.base
+            if base is None and self.data.update:
+                base = name
+
             compression.zip_files(
                 name=name,
                 files=ready_files,
                 root=root,
                 mode='a' if self.data.append else 'w',
                 ignore=self.data.exclude or [],
-                noisey=self.data.noisey
+                noisey=self.data.noisey,
+                manifest=self.data.manifest,
+                jobs=self.data.jobs,
+                policy=compression.CompressionPolicy(
+                    level=self.data.level,
+                    store=self.data.store,
+                    auto=self.data.auto_store,
+                    reproducible=self.data.reproducible
+                ),
+                base=base
             )
 
 
@@ -384,6 +457,40 @@ class TarCommand(_BuildCommand):
             action='store_true'
         )
 
+        parser.add_argument(
+            '-m', '--manifest',
+            action='store_true',
+            help='Embed a manifest of every file (size, mode, mtime and '
+                 'sha256) that installs are verified against'
+        )
+
+        parser.add_argument(
+            '-j', '--jobs',
+            type=int,
+            default=1,
+            help='Gzip with this many threads (0 for one per core)'
+        )
+
+        parser.add_argument(
+            '-l', '--level',
+            type=int,
+            choices=range(10),
+            help='Gzip level (1-9) or xz preset (0-9)'
+        )
+
+        parser.add_argument(
+            '--xz',
+            action='store_true',
+            help='Compress with xz (.tar.xz) when the archive name has no extension'
+        )
+
+        parser.add_argument(
+            '--reproducible',
+            action='store_true',
+            help='Build the same archive from the same files every time (sorted, '
+                 'with normalized timestamps and permissions)'
+        )
+
         parser.add_argument(
             '-n', '--noisey',
             action='store_true',
@@ -446,8 +553,8 @@ class TarCommand(_BuildCommand):
                 logging.info('Tar root: {}'.format(root))
 
             name = self.data.archive
-            if not any(name.endswith(g) for g in ('.tar', '.tar.gz', '.tgz')):
-                name += '.tar.gz'
+            if not compression.is_tar(name):
+                name += '.tar.xz' if self.data.xz else '.tar.gz'
 
             compression.tar_files(
                 name=name,
@@ -455,5 +562,9 @@ class TarCommand(_BuildCommand):
                 root=root,
                 mode='a' if self.data.append else 'w',
                 ignore=self.data.exclude or [],
-                noisey=self.data.noisey
+                noisey=self.data.noisey,
+                manifest=self.data.manifest,
+                jobs=self.data.jobs,
+                level=self.data.level,
+                reproducible=self.data.reproducible
             )
@@ -6,6 +6,8 @@ import logging
 from common import log
 from common import communicate
 
+from .closure import register_closure
+
 class Composer(object):
     """
     Basic object for building composed packages
@@ -22,6 +24,7 @@ class Composer(object):
         self._args     = args.arg
         self._env      = args.env
         self._pre      = args.pre_release
+        self._closure  = not args.skip_closure
 
 
     def _build_launch_json(self):
@@ -75,3 +78,5 @@ class Composer(object):
 
         if result:
             logging.info("Registered!")
+            if self._closure:
+                register_closure(self._package, self._version)
@@ -19,6 +19,7 @@ from common import utils
 from common import constants
 from common import communicate
 
+from .closure import register_closure
 from .parse import BuildCommandParser
 from .buildfile import BuildFile
 from .abstract_manager import _AbstractManager
@@ -76,6 +77,10 @@ class DeployManager(_AbstractManager):
             deploy_commands = deploy_descrpitor['release']
             self.build_commands(None, deploy_commands)
 
+        # -- Only once the release is complete
+        if result and not self.arguments.skip_closure:
+            register_closure(self.package, self.version)
+
         return result
 
 
@@ -34,11 +34,17 @@ def prop_set(prop, build_file):
 def file_exists(file, build_file):
     return os.path.exists(file)
 
+def files_equal(file, other, build_file):
+    import filecmp
+    return (os.path.isfile(file) and os.path.isfile(other)
+            and filecmp.cmp(file, other, shallow=False))
+
 local_commands = {
     'env_check' : env_check,
     'env_set' : env_set,
     'prop_set' : prop_set,
-    'file_exists' : file_exists
+    'file_exists' : file_exists,
+    'files_equal' : files_equal
 }
 
 # -------------------------------------------------------------------
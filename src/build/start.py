@@ -335,6 +335,7 @@ def build_parser():
     register.add_argument('-b', '--beta', action='store_true', help='This is a pre-release, not production current')
     register.add_argument('-f', '--force', action='store_true', help='Force the version even if it already exists on Atom')
     register.add_argument('-s', '--skip-validation', action='store_true', help='Skip global file validation (careful)')
+    register.add_argument('--skip-closure', action='store_true', help='Do not register the dependency closure of this version')
     register.add_argument('-c', '--custom', nargs=2, metavar=('YAML', 'SOURCE'), help='Custom yaml file and source directory location')
     register.set_defaults(func=_register, _flaunch_parser=register)
 
@@ -359,6 +360,7 @@ def build_parser():
     composer.add_argument('-a', '--arg', action='append', help='The default arguments to pass to the launched process')
     composer.add_argument('-e', '--env', action='append', help='The environment variables to set when running this launcher (VAR_NAME=value)')
     composer.add_argument('-f', '--force-update', action='store_true', help='Force update if the version exists')
+    composer.add_argument('--skip-closure', action='store_true', help='Do not register the dependency closure of this launcher')
     composer.set_defaults(func=_compose, _flaunch_parser=composer)
 
     # -- Test toolkit
@@ -0,0 +1,298 @@
+"""
+Housekeeping for the local package store.
+
+The store index (see: storeindex) holds the size of every install and
+the last time it was launched. Collection evicts the least recently used
+installs until the store fits within a budget.
+
+Launches hold a shared lock on each install they use (``<version>.inuse``)
+until the application exits. Collection only removes an install it can
+lock exclusively, so nothing that's running has the rug pulled out from
+under it. This is apart from the ``<version>.lock`` that installs are
+done under, so reinstalling a version never waits on the applications
+running from it.
+"""
+from __future__ import absolute_import
+
+import os
+import re
+import time
+import shutil
+import logging
+import contextlib
+
+from . import utils
+from . import filelock
+from . import objectstore
+from .storeindex import StoreIndex, StoreIndexError
+from .constants import FLAUNCH_STORE_MAX_SIZE, FLAUNCH_STORE_MAX_AGE, FLAUNCH_PINNED
+
+# Staging directories from installs older than this were abandoned
+STALE_STAGING = 24 * 60 * 60
+
+# Held (shared) next to an install by everything running from it
+IN_USE_SUFFIX = '.inuse'
+
+# Seconds between collections when launching. Installs that can't be
+# evicted (running ones) can keep the store over budget for a while and
+# there's no use in walking it on every launch until then.
+COLLECT_INTERVAL = 60 * 60
+
+_SIZE_UNITS = { '' : 1, 'K' : 1024, 'M' : 1024 ** 2, 'G' : 1024 ** 3, 'T' : 1024 ** 4 }
+_AGE_UNITS = { 's' : 1, 'm' : 60, 'h' : 60 * 60, 'd' : 24 * 60 * 60, 'w' : 7 * 24 * 60 * 60 }
+
+
+def parse_size(value):
+    """
+    :param value: str like "200G", "512M" or "1024" (bytes)
+    :return: int - bytes
+    """
+    match = re.match(r'^\s*(\d+(?:\.\d+)?)\s*([KMGT]?)i?B?\s*$', str(value), re.I)
+    if not match:
+        raise ValueError('Invalid size: {}'.format(value))
+    return int(float(match.group(1)) * _SIZE_UNITS[match.group(2).upper()])
+
+
+def parse_age(value):
+    """
+    :param value: str like "30d", "12h" or "2w" (no unit is days)
+    :return: float - seconds
+    """
+    match = re.match(r'^\s*(\d+(?:\.\d+)?)\s*([smhdw]?)\s*$', str(value), re.I)
+    if not match:
+        raise ValueError('Invalid age: {}'.format(value))
+    return float(match.group(1)) * _AGE_UNITS[match.group(2).lower() or 'd']
+
+
+def touch(paths):
+    """
+    Note that installs were just used
+    :param paths: list[str] of install locations
+    :return: None
+    """
+    try:
+        StoreIndex().touch(paths)
+    except StoreIndexError as e:
+        logging.debug('Could not mark installs as used: {}'.format(str(e)))
+
+
+@contextlib.contextmanager
+def in_use(paths):
+    """
+    Mark installs as used and keep them out of reach of collection for
+    the life of the with block
+    :param paths: list[str] of install locations
+    """
+    locks = []
+    touch(paths)
+    try:
+        for path in paths:
+            lock = filelock.FileLock(path + IN_USE_SUFFIX, shared=True)
+            if lock.acquire(blocking=False):
+                locks.append(lock)
+        yield
+    finally:
+        for lock in locks:
+            lock.release()
+
+
+def pinned_packages():
+    """
+    :return: list[str] - package or package/version entries from FLAUNCH_PINNED
+    """
+    return [p.strip() for p in os.environ.get(FLAUNCH_PINNED, '').split(',') if p.strip()]
+
+
+def _is_pinned(install, pinned):
+    """
+    :param install: dict from the index
+    :param pinned: list[str] of package or package/version entries
+    :return: bool
+    """
+    for pin in pinned:
+        package, _, version = pin.partition('/')
+        if package.lower() != install['package'].lower():
+            continue
+        if not version or version == install['version']:
+            return True
+    return False
+
+
+def _remove(index, install):
+    """
+    Evict an install unless it's in use
+    :param index: StoreIndex
+    :param install: dict from the index
+    :return: bool - was it removed?
+    """
+    path = install['path']
+    if not os.path.lexists(path):
+        # -- Removed behind our back, the index just didn't know
+        with index.removing(path):
+            return True
+
+    in_use = filelock.FileLock(path + IN_USE_SUFFIX)
+    if not in_use.acquire(blocking=False):
+        return False
+
+    # -- Nor while it's being installed
+    lock = filelock.FileLock(path + '.lock')
+    if not lock.acquire(blocking=False):
+        in_use.release()
+        return False
+
+    try:
+        # -- Launched while we were busy with other installs
+        current = index.lookup(install['package'], install['version'])
+        if current is not None and current['used'] > install['used']:
+            return False
+
+        # -- Move it out of the way first so nobody sees half of it
+        trash = '{}.{}.gc.tmp'.format(path, os.getpid())
+        try:
+            with index.removing(path):
+                os.rename(path, trash)
+        except (OSError, StoreIndexError) as e:
+            logging.debug('Could not remove: {} - {}'.format(path, str(e)))
+            return False
+    finally:
+        lock.release()
+        in_use.release()
+
+    if os.path.islink(trash):
+        os.unlink(trash)
+    else:
+        shutil.rmtree(trash, ignore_errors=True)
+    return True
+
+
+def _clean_staging():
+    """
+    Remove staging directories left behind by installs that never finished
+    :return: None
+    """
+    root = utils.local_path(None, None, base_only=True)
+    cutoff = time.time() - STALE_STAGING
+    for package in os.listdir(root):
+        package_path = os.path.join(root, package)
+        if not os.path.isdir(package_path):
+            continue
+        for name in os.listdir(package_path):
+            path = os.path.join(package_path, name)
+            if not name.endswith('.tmp'):
+                continue
+            try:
+                if os.lstat(path).st_mtime > cutoff:
+                    continue
+                if os.path.isdir(path) and not os.path.islink(path):
+                    shutil.rmtree(path, ignore_errors=True)
+                else:
+                    os.remove(path)
+            except OSError:
+                pass
+
+
+def collect(max_size=None, max_age=None, pinned=None, dry_run=False):
+    """
+    Evict the least recently used installs until the store fits the budget.
+    Installs that are in use or pinned are never evicted.
+    :param max_size: int - bytes the store may use (None for no limit)
+    :param max_age: float - seconds an install may go unused (None for no limit)
+    :param pinned: list[str] of package or package/version entries to keep
+    :param dry_run: Only report what would be evicted
+    :return: list[dict] - the installs that were (or would be) evicted
+    """
+    if pinned is None:
+        pinned = pinned_packages()
+
+    if not dry_run:
+        _clean_staging()
+
+    index = StoreIndex()
+    store = index.installs()
+    total = sum(i['size'] for i in store)
+    cutoff = None if max_age is None else time.time() - max_age
+
+    evicted = []
+    for install in store:
+        too_old = cutoff is not None and install['used'] < cutoff
+        too_big = max_size is not None and total > max_size
+        if not (too_old or too_big):
+            break # Everything after this is newer
+
+        if _is_pinned(install, pinned):
+            logging.debug('Pinned: {}'.format(install['path']))
+            continue
+
+        if dry_run or _remove(index, install):
+            total -= install['size']
+            evicted.append(install)
+        else:
+            logging.debug('In use: {}'.format(install['path']))
+
+    if not dry_run:
+        objectstore.prune()
+
+    return evicted
+
+
+def budget():
+    """
+    :return: tuple(int|None, float|None) - store limits from the environment
+    """
+    max_size = os.environ.get(FLAUNCH_STORE_MAX_SIZE)
+    max_age = os.environ.get(FLAUNCH_STORE_MAX_AGE)
+    return (
+        parse_size(max_size) if max_size else None,
+        parse_age(max_age) if max_age else None
+    )
+
+
+def collect_if_over_budget():
+    """
+    Collect when the environment sets a budget for the store and it's
+    been exceeded by installs we could evict. Only one process collects at
+    a time (and at most once every COLLECT_INTERVAL), the others just
+    carry on.
+    :return: None
+    """
+    try:
+        max_size, max_age = budget()
+    except ValueError as e:
+        logging.warning(str(e))
+        return
+
+    if max_size is None and max_age is None:
+        return
+
+    root = utils.local_path(None, None, base_only=True)
+    stamp = os.path.join(root, '.gc.stamp')
+    try:
+        if time.time() - os.path.getmtime(stamp) < COLLECT_INTERVAL:
+            return
+    except OSError:
+        pass # Never collected
+
+    lock = filelock.FileLock(os.path.join(root, '.gc.lock'))
+    if not lock.acquire(blocking=False):
+        return
+
+    try:
+        store = StoreIndex().installs()
+        pinned = pinned_packages()
+        evictable = [i for i in store if not _is_pinned(i, pinned)]
+        over_size = max_size is not None and bool(evictable) and \
+            sum(i['size'] for i in store) > max_size
+        over_age = max_age is not None and \
+            any(i['used'] < time.time() - max_age for i in evictable)
+        if not (over_size or over_age):
+            return
+
+        with open(stamp, 'w'):
+            pass
+        for install in collect(max_size, max_age, pinned):
+            logging.info('Evicted: {}/{}'.format(install['package'], install['version']))
+    except (StoreIndexError, IOError, OSError) as e:
+        logging.debug('Not collecting: {}'.format(str(e)))
+    finally:
+        lock.release()
@@ -11,18 +11,57 @@ import getpass
 import logging
 import base64
 import sys
+import hashlib
+import threading
+from contextlib import contextmanager
 
 try:
     import requests
+    from requests.adapters import HTTPAdapter
 except ImportError as e:
     print ("Python package 'requests' is required!")
     raise
 
 from . import log
 from . import utils
+from . import metacache
+from .manifest import HashingFile, hash_file
+from .constants import FLAUNCH_HTTP_POOL_SIZE, FLAUNCH_HEARTBEAT_TTL
+
+if utils.PY3:
+    import queue
+else:
+    import Queue as queue
 
 FLUX_FACILITY = os.environ.get('FLUX_FACILITY', 'Madrid')
 
+# Default number of keep-alive connections per host
+DEFAULT_POOL_SIZE = 16
+
+# Default seconds to trust a heartbeat for
+DEFAULT_HEARTBEAT_TTL = 300
+
+# Bytes read at a time when downloading packages
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+
+# Times we pick an interrupted download back up before giving up
+DOWNLOAD_RETRIES = 3
+
+# Seconds to wait on a connection/read before calling it interrupted
+DOWNLOAD_TIMEOUT = (10, 60)
+
+# Smallest and largest blocks of a ranged read (see: RemoteFile)
+RANGE_BLOCK_MIN = 64 * 1024
+RANGE_BLOCK_MAX = 16 * 1024 * 1024
+
+
+class RepositoryUnavailable(SystemExit):
+    """
+    No Atom instance could be reached. Uncaught, this exits just as
+    before but lets callers with a fallback (e.g. cached data) continue
+    """
+    pass
+
 
 class ConnectionManager(object):
     """
@@ -31,19 +70,35 @@ class ConnectionManager(object):
     """
 
     LAST_KNOWN = 'last_known_instance'
+    LAST_HEARTBEAT = 'last_heartbeat'
+
+    # Packages may be fetched from multiple threads at once
+    _lock = threading.RLock()
+
+    # Shared requests.Session, see get_session()
+    _session = None
 
     def __new__(cls, *args, **kwargs):
         # Singleton pattern
-        if not hasattr(cls, '_instance'):
-            cls._instance = object.__new__(cls, *args, **kwargs)
+        with cls._lock:
+            if not hasattr(cls, '_instance'):
+                cls._instance = object.__new__(cls, *args, **kwargs)
         return cls._instance
 
 
     def __init__(self):
-        if not hasattr(self, '_settings'):
-            self._settings = self._build_settings()
-        if not hasattr(self, '_endpoint'):
-            self._endpoint = self._start_connection()
+        with self._lock:
+            if not hasattr(self, '_settings'):
+                self._settings = self._build_settings()
+            if getattr(self, '_unavailable', False):
+                # Already tried and failed, don't probe everything again
+                raise RepositoryUnavailable(1)
+            if not hasattr(self, '_endpoint'):
+                try:
+                    self._endpoint = self._start_connection()
+                except RepositoryUnavailable:
+                    self._unavailable = True
+                    raise
 
 
     @property
@@ -51,6 +106,47 @@ class ConnectionManager(object):
         return self._endpoint
 
 
+    @property
+    def session(self):
+        return self.get_session()
+
+
+    @classmethod
+    def get_session(cls):
+        """
+        The pooled session that all http traffic goes through. Keeping
+        the connections alive spares us a handshake per request.
+
+        This doesn't require a connection to Atom so it's safe to use
+        for other services too.
+        :return: requests.Session
+        """
+        with cls._lock:
+            if cls._session is None:
+                try:
+                    pool_size = int(os.environ.get(
+                        FLAUNCH_HTTP_POOL_SIZE, DEFAULT_POOL_SIZE
+                    ))
+                except ValueError:
+                    pool_size = DEFAULT_POOL_SIZE
+
+                # Make sure every worker can hold onto a connection
+                pool_size = max(pool_size, utils.worker_count())
+
+                session = requests.Session()
+                adapter = HTTPAdapter(
+                    pool_connections=pool_size, pool_maxsize=pool_size
+                )
+                session.mount('http://', adapter)
+                session.mount('https://', adapter)
+                session.headers.update({
+                    'Accept-Encoding' : 'gzip, deflate',
+                    'Connection' : 'keep-alive'
+                })
+                cls._session = session
+        return cls._session
+
+
     def _settings_file(self):
         storage_path = utils.local_path(None, None, base_only=True)
         return os.path.abspath(os.path.join(os.path.dirname(storage_path), 'flaunch_prefs2.json'))
@@ -79,7 +175,7 @@ class ConnectionManager(object):
         self._settings[setting] = value
         filepath = self._settings_file()
         try:
-            with open(filepath, 'w') as f:
+            with utils.atomic_write(filepath) as f:
                 json.dump(self._settings, f)
         except Exception as e:
             logging.debug('Could not save settings for connection manager: {}'\
@@ -106,13 +202,14 @@ class ConnectionManager(object):
         return endpoints
 
 
-    def _test_connection(self, endpoint):
+    def _test_connection(self, endpoint, session=None):
         """
         Connection test
         :param endpoint: str of the url to lookup
+        :param session: requests.Session to use (default is our pooled session)
         """
         try:
-            result = requests.head(
+            result = (session or self.get_session()).head(
                 endpoint + '/rest/latest/core/heartbeat', timeout = 2
             )
             result.raise_for_status()
@@ -121,31 +218,105 @@ class ConnectionManager(object):
             return False
 
 
+    def _heartbeat_ttl(self):
+        """
+        :return: float - seconds we trust a successful heartbeat for
+        """
+        try:
+            return float(os.environ.get(
+                FLAUNCH_HEARTBEAT_TTL, DEFAULT_HEARTBEAT_TTL
+            ))
+        except ValueError:
+            return DEFAULT_HEARTBEAT_TTL
+
+
+    def _recently_alive(self, endpoint):
+        """
+        Check if we've had a heartbeat from this endpoint recently enough
+        that we don't need to ask again
+        :param endpoint: str of the url
+        :return: bool
+        """
+        last = self._settings.get(self.LAST_HEARTBEAT, {}).get(endpoint)
+        if last is None:
+            return False
+        return 0 <= (time.time() - last) < self._heartbeat_ttl()
+
+
+    def _alive(self, endpoint):
+        """
+        Test an endpoint, trusting a recent heartbeat
+        :param endpoint: str of the url
+        :return: bool
+        """
+        if self._recently_alive(endpoint):
+            logging.debug('Recent heartbeat from: {}'.format(endpoint))
+            return True
+
+        if self._test_connection(endpoint):
+            heartbeats = self._settings.get(self.LAST_HEARTBEAT, {})
+            heartbeats[endpoint] = time.time()
+            self._save_setting(self.LAST_HEARTBEAT, heartbeats)
+            return True
+        return False
+
+
+    def _race_endpoints(self, endpoints):
+        """
+        Test all endpoints at once, the first to respond wins
+        :param endpoints: list[str] of urls
+        :return: str|None
+        """
+        endpoints = [e.strip() for e in endpoints if e.strip()]
+        results = queue.Queue()
+
+        # -- We're holding the lock while connecting, so the probes can't be
+        # the ones to create the session
+        session = self.get_session()
+
+        def _probe(endpoint):
+            results.put((endpoint, self._test_connection(endpoint, session)))
+
+        for endpoint in endpoints:
+            # Daemon threads so the stragglers don't hold us up
+            probe = threading.Thread(target=_probe, args=(endpoint,))
+            probe.daemon = True
+            probe.start()
+
+        for _ in endpoints:
+            endpoint, alive = results.get()
+            if alive:
+                return endpoint
+        return None
+
+
     def _start_connection(self):
         """
         Time to find our atom instance!
         """
 
         if os.environ.get("FLAUNCH_CUSTOM_INDEX"):
-            if self._test_connection(os.environ["FLAUNCH_CUSTOM_INDEX"]):
+            if self._alive(os.environ["FLAUNCH_CUSTOM_INDEX"]):
                 return os.environ["FLAUNCH_CUSTOM_INDEX"]
 
         elif self._settings.get(self.LAST_KNOWN, None):
             # -- Test this one
-            if self._test_connection(self._settings[self.LAST_KNOWN]):
+            if self._alive(self._settings[self.LAST_KNOWN]):
                 return self._settings[self.LAST_KNOWN]
 
-        for endpoint in self._endpoints():
-            endpoint = endpoint.strip()
-            if self._test_connection(endpoint):
-                # We've found a viable connection
-                self._save_setting(self.LAST_KNOWN, endpoint)
-                return endpoint
+        endpoint = self._race_endpoints(self._endpoints())
+        if endpoint:
+            # We've found a viable connection
+            heartbeats = self._settings.get(self.LAST_HEARTBEAT, {})
+            heartbeats[endpoint] = time.time()
+            self._settings[self.LAST_HEARTBEAT] = heartbeats
+            self._save_setting(self.LAST_KNOWN, endpoint)
+            return endpoint
 
         # -- If we've made it here, none of the endpoints have
         # panned out. That's no good. Need to fail
         logging.critical('Cannot connect to a repository!')
-        sys.exit(1)
+        raise RepositoryUnavailable(1)
 
 
     def get_credentials(self, first_time):
@@ -220,36 +391,338 @@ def default_headers():
     }
 
 
-def _get(endpoint, **params):
+def http_session():
+    """
+    :return: requests.Session - The shared, pooled session
+    """
+    return ConnectionManager.get_session()
+
+
+def _get(endpoint, headers=None, **params):
     """
     Run a basic request
+    :param headers: dict of additional headers for this request
     """
     manager = ConnectionManager()
 
-    return requests.get(
+    request_headers = default_headers()
+    request_headers.update(headers or {})
+
+    return manager.session.get(
         manager.url + '/rest/latest' + endpoint,
         params=params,
-        headers = default_headers()
+        headers = request_headers
     )
 
 
-def download_file(url, dest):
+_INFO_CACHE = None
+
+def info_cache():
     """
-    Download a file
+    :return: metacache.PackageInfoCache for our facility
+    """
+    global _INFO_CACHE
+    if _INFO_CACHE is None:
+        _INFO_CACHE = metacache.PackageInfoCache(FLUX_FACILITY)
+    return _INFO_CACHE
+
+
+def _repo_url(url):
+    """
+    :return: str - The url to download a repository file from
     """
     # HACK from an old bug
-    url = url.replace(
-        "http://backend/servermedia", ConnectionManager().url + "/repo"
-    );
+    if url.startswith("http://backend/servermedia"):
+        url = url.replace(
+            "http://backend/servermedia", ConnectionManager().url + "/repo"
+        )
+    return url
+
+
+class _HashingReader(HashingFile):
+    """
+    Hashes everything read off of the network
+    """
+    def read(self, size=-1):
+        try:
+            return HashingFile.read(self, size)
+        except Exception as e:
+            # -- Whatever the transport raised, the download is incomplete
+            raise DownloadError('Download interrupted: {}'.format(str(e)))
+
+
+class DownloadError(IOError):
+    """ A download could not be completed or didn't match its checksum """
+    pass
+
+
+def _validator(headers):
+    """
+    :return: str|None - What a resumed download sends as If-Range, so it
+    only continues when the file hasn't changed (a strong ETag, or the
+    Last-Modified date)
+    """
+    etag = headers.get('ETag')
+    if etag and not etag.startswith('W/'):
+        return etag
+    return headers.get('Last-Modified')
+
+
+def _discard_partial(partial):
+    """
+    Remove a partial download and what we know about it
+    :return: None
+    """
+    for path in (partial, partial + '.validator'):
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def _download_partial(url, partial):
+    """
+    Download (the remainder of) a file, continuing from whatever is
+    already in the partial file
+    :param url: The url of the file
+    :param partial: The path to the partial file
+    :return: str - sha256 hex digest of the full file
+    """
+    digest = hashlib.sha256()
+    offset = os.path.getsize(partial) if os.path.isfile(partial) else 0
+
+    validator = None
+    if offset:
+        try:
+            with open(partial + '.validator', 'r') as f:
+                validator = f.read().strip()
+        except (IOError, OSError):
+            pass
+        if not validator:
+            # -- No telling if the file changed since, start over
+            logging.debug('Discarding partial download: {}'.format(partial))
+            _discard_partial(partial)
+            offset = 0
+
+    # -- Byte ranges have to line up with the file itself
+    headers = {'Accept-Encoding' : 'identity'}
+    if offset:
+        headers['Range'] = 'bytes={}-'.format(offset)
+        headers['If-Range'] = validator
+
+    with http_session().get(url, stream=True, headers=headers,
+                            timeout=DOWNLOAD_TIMEOUT) as r:
+        if offset and r.status_code == 416:
+            # -- What we have doesn't fit the file anymore, start over
+            logging.debug('Discarding partial download: {}'.format(partial))
+            _discard_partial(partial)
+            return _download_partial(url, partial)
 
-    logging.info("Download: " + url)
-    with requests.get(url, stream=True) as r:
         r.raise_for_status()
-        with open(dest, 'wb') as f:
-            for chunk in r.iter_content(chunk_size=8192): 
+
+        mode = 'wb'
+        if offset and r.status_code == 206:
+            logging.info('Resuming download at byte: {}'.format(offset))
+            hash_file(partial, digest)
+            mode = 'ab'
+        else:
+            # -- From the top (the file may have changed since the partial
+            # download, in which case If-Range gets us all of it)
+            _discard_partial(partial)
+            validator = _validator(r.headers)
+            if validator:
+                with open(partial + '.validator', 'w') as f:
+                    f.write(validator)
+
+        with open(partial, mode) as f:
+            for chunk in r.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
                 if chunk: # filter out keep-alive new chunks
+                    digest.update(chunk)
                     f.write(chunk)
-                    # f.flush()
+
+    return digest.hexdigest()
+
+
+def download_file(url, dest, sha256=None):
+    """
+    Download a file. The data goes to "<dest>.partial" until it's complete
+    so an interrupted download picks up where it left off, whether that's
+    in this call or a later one.
+    :param url: The url of the file
+    :param dest: The path to write the file to
+    :param sha256: The hex digest the file should have. On a mismatch, the
+    data is discarded and DownloadError is raised
+    :return: str - sha256 hex digest of the file
+    """
+    url = _repo_url(url)
+    partial = dest + '.partial'
+
+    logging.info("Download: " + url)
+    attempt = 0
+    while True:
+        try:
+            digest = _download_partial(url, partial)
+            break
+        except (requests.ConnectionError, requests.Timeout,
+                requests.exceptions.ChunkedEncodingError) as e:
+            attempt += 1
+            if attempt >= DOWNLOAD_RETRIES:
+                raise DownloadError('Download failed: {} - {}'.format(url, str(e)))
+            logging.warning('Download interrupted, resuming: {}'.format(url))
+            logging.debug(str(e))
+
+    if sha256 and digest != sha256.lower():
+        _discard_partial(partial)
+        raise DownloadError('Checksum mismatch: {} (expected: {}, got: {})'.format(
+            url, sha256, digest
+        ))
+
+    if os.path.exists(dest):
+        os.remove(dest)
+    os.rename(partial, dest)
+    _discard_partial(partial)
+    return digest
+
+
+class RemoteFile(object):
+    """
+    Read-only, seekable file on the other end of http Range requests.
+    Handy for pulling parts of an archive (e.g. a few members of a zip)
+    without downloading all of it.
+
+    Reads go out in blocks that start at RANGE_BLOCK_MIN and double (up to
+    RANGE_BLOCK_MAX) for as long as the reads are sequential.
+    """
+    def __init__(self, url):
+        """
+        :param url: The url of the file
+        :raises DownloadError: When the server can't answer ranged reads
+        """
+        self._url = _repo_url(url)
+        self._pos = 0
+        self._buffer = b''
+        self._buffer_start = 0
+        self._block = RANGE_BLOCK_MIN
+        self._transferred = 0
+
+        try:
+            r = http_session().head(
+                self._url, headers={'Accept-Encoding' : 'identity'},
+                timeout=DOWNLOAD_TIMEOUT, allow_redirects=True
+            )
+            r.raise_for_status()
+        except requests.RequestException as e:
+            raise DownloadError('Cannot read: {} - {}'.format(self._url, str(e)))
+
+        if r.headers.get('Accept-Ranges') != 'bytes' or 'Content-Length' not in r.headers:
+            raise DownloadError('Ranged reads not supported: {}'.format(self._url))
+        self._size = int(r.headers['Content-Length'])
+
+
+    @property
+    def size(self):
+        """ :return: int - size of the file """
+        return self._size
+
+
+    @property
+    def transferred(self):
+        """ :return: int - bytes pulled over the network so far """
+        return self._transferred
+
+
+    def _fetch(self, start, end):
+        """
+        :return: bytes from start up to (not including) end
+        """
+        headers = {
+            'Accept-Encoding' : 'identity',
+            'Range' : 'bytes={}-{}'.format(start, end - 1)
+        }
+        for attempt in range(DOWNLOAD_RETRIES):
+            try:
+                r = http_session().get(self._url, headers=headers, timeout=DOWNLOAD_TIMEOUT)
+                if r.status_code != 206:
+                    raise DownloadError('Ranged read refused: {} ({})'.format(
+                        self._url, r.status_code
+                    ))
+                data = r.content
+                if len(data) != end - start:
+                    raise DownloadError('Short ranged read: {}'.format(self._url))
+                self._transferred += len(data)
+                return data
+            except (requests.ConnectionError, requests.Timeout,
+                    requests.exceptions.ChunkedEncodingError) as e:
+                logging.debug('Ranged read failed, retrying: {}'.format(str(e)))
+                error = e
+        raise DownloadError('Download failed: {} - {}'.format(self._url, str(error)))
+
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            size = self._size - self._pos
+        size = max(0, min(size, self._size - self._pos))
+        if not size:
+            return b''
+
+        offset = self._pos - self._buffer_start
+        if offset < 0 or offset + size > len(self._buffer):
+            if self._pos == self._buffer_start + len(self._buffer):
+                self._block = min(self._block * 2, RANGE_BLOCK_MAX)
+            else:
+                self._block = RANGE_BLOCK_MIN
+
+            self._buffer_start = self._pos
+            self._buffer = self._fetch(
+                self._pos, min(self._size, self._pos + max(size, self._block))
+            )
+            offset = 0
+
+        self._pos += size
+        return self._buffer[offset:offset + size]
+
+
+    def seek(self, offset, whence=0):
+        if whence == 1:
+            offset += self._pos
+        elif whence == 2:
+            offset += self._size
+        self._pos = max(0, offset)
+        return self._pos
+
+
+    def tell(self):
+        return self._pos
+
+
+    def seekable(self):
+        return True
+
+
+    def close(self):
+        self._buffer = b''
+
+
+@contextmanager
+def open_stream(url):
+    """
+    Open a file for reading straight off of the network. The reader
+    hashes what passes through it (see: hexdigest())
+    :param url: The url of the file
+    :return: file-like object with read() and hexdigest()
+    :raises: DownloadError - when the server can't be reached or stalls
+    (DOWNLOAD_TIMEOUT)
+    """
+    url = _repo_url(url)
+
+    logging.info("Stream: " + url)
+    try:
+        response = http_session().get(url, stream=True, timeout=DOWNLOAD_TIMEOUT)
+        response.raise_for_status()
+    except requests.RequestException as e:
+        raise DownloadError('Could not download: {} - {}'.format(url, str(e)))
+
+    with response as r:
+        r.raw.decode_content = True
+        yield _HashingReader(r.raw)
 
 
 def get_flaunch_info():
@@ -277,56 +750,224 @@ def get_flaunch_info():
     return data
 
 
+def _package_info_error(package, data):
+    """
+    Report a package that Atom could not give us
+    :param package: The name of the package we asked for
+    :param data: dict response from Atom that holds the error
+    :return: None
+    """
+    logging.error('Cannot locate package: \"{}\" for your facility: {}'.format(
+        package,
+        FLUX_FACILITY
+    ))
+    logging.debug('Reason:')
+    with log.log_indent():
+        logging.debug(data['error'])
+
+    if not metacache.is_offline():
+        find_similar_pacakges(package) # Will try to find what the user meant
+
+
 def get_package_info(package, version=None):
     """
-    Request the package descriptor
+    Request the package descriptor. Recent answers come from our
+    metadata cache and stale ones are revalidated with their ETag.
     :return: dict|None 
     """
     vs = ' (' + str(version) + ')'
     logging.debug("Getting: " + package + "{}".format(vs if version else ''))
 
+    cache = info_cache()
+    entry = cache.get(package, version)
+
+    if metacache.is_offline():
+        if entry is None:
+            _package_info_error(package, {'error' : 'Not in the metadata cache (offline)'})
+            return None
+        return entry['data']
+
+    if cache.is_fresh(entry):
+        logging.debug('Using cached information for: ' + package)
+        return entry['data']
+
     extras = {}
     if version:
         extras['version'] = version
 
-    result = _get(
-        '/core/package/{}/{}'.format(package, FLUX_FACILITY),
-        **extras
-    )
+    headers = {}
+    if entry and entry.get('etag'):
+        headers['If-None-Match'] = entry['etag']
 
-    data = result.json()
-    if 'error' in data:
-        logging.error('Cannot locate package: \"{}\" for your facility: {}'.format(
-            package,
-            FLUX_FACILITY
+    try:
+        result = _get(
+            '/core/package/{}/{}'.format(package, FLUX_FACILITY),
+            headers=headers,
+            **extras
+        )
+        if result.status_code >= 500:
+            result.raise_for_status()
+    except (requests.RequestException, RepositoryUnavailable) as e:
+        if entry is None:
+            raise
+        logging.warning('Atom unavailable, using cached information for: {}'.format(
+            package
         ))
-        logging.debug('Reason:')
-        with log.log_indent():
-            logging.debug(data['error'])
+        return entry['data']
 
-        find_similar_pacakges(package) # Will try to find what the user meant
+    if result.status_code == 304 and entry is not None:
+        cache.put(
+            package, version, entry['data'],
+            etag=entry.get('etag'), ttl=metacache.max_age(result.headers)
+        )
+        return entry['data']
+
+    data = result.json()
+    if 'error' in data:
+        _package_info_error(package, data)
         return None
 
+    cache.put(
+        package, version, data,
+        etag=result.headers.get('ETag'), ttl=metacache.max_age(result.headers)
+    )
     return data
 
 
-def register_package(package, version, method='get', launch_data=None, force=False, pre_release=False):
+def _batch_package_info(packages, etags=None):
     """
-    Registering a package requires a propper login with Atom
+    Ask Atom for many package descriptors in a single request. Packages we
+    have an ETag for send it along, Atom answers those that haven't
+    changed with {"not_modified": true} (and may give others an "etag").
+    :param packages: list[tuple(str, str)] of (package, version) pairs
+    :param etags: list[str|None] - cached ETag of each package
+    :return: tuple(list[dict], float|None)|None - The descriptors and the
+    max-age Atom gave them. None when the batch endpoint is unavailable
     """
     manager = ConnectionManager()
+    if getattr(manager, '_batch_unsupported', False):
+        return None
+
+    etags = etags or [None] * len(packages)
+    request = []
+    for (package, version), etag in zip(packages, etags):
+        item = {'package' : package, 'version' : version}
+        if etag:
+            item['etag'] = etag
+        request.append(item)
+
+    result = manager.session.post(
+        manager.url + '/rest/latest/core/package/batch/{}'.format(FLUX_FACILITY),
+        json={ 'packages' : request },
+        headers=default_headers(),
+        timeout=DOWNLOAD_TIMEOUT
+    )
+
+    if result.status_code in (404, 405, 501):
+        # -- Older Atom instance, don't bother asking again
+        logging.debug('Batch package lookup not supported by: {}'.format(
+            manager.url
+        ))
+        manager._batch_unsupported = True
+        return None
+
+    try:
+        result.raise_for_status()
+        data = result.json()
+    except Exception as e:
+        logging.debug('Batch package lookup failed: {}'.format(str(e)))
+        return None
+
+    if not isinstance(data, list) or len(data) != len(packages):
+        logging.debug('Unexpected batch package lookup response')
+        return None
+
+    return data, metacache.max_age(result.headers)
 
-    if not hasattr(manager, 'client'):
 
-        manager.client = requests.session()
+def get_packages_info(packages):
+    """
+    Request the package descriptors for multiple packages at once. Stale
+    cache entries are revalidated with their ETag. If the Atom instance
+    cannot handle a batch request, we fall back to a single request per
+    package - in parallel over the pooled session.
+    :param packages: list[tuple(str, str)] of (package, version) pairs. The
+    version may be None for the highest.
+    :return: list[dict|None] in the same order as packages
+    """
+    packages = list(packages)
+    output = [None] * len(packages)
+
+    # -- Anything we know about recently doesn't need asking for
+    cache = info_cache()
+    missing = []
+    entries = {}
+    for i, (package, version) in enumerate(packages):
+        entry = cache.get(package, version)
+        if cache.is_fresh(entry):
+            output[i] = entry['data']
+        else:
+            missing.append(i)
+            entries[i] = entry
+
+    if not missing:
+        return output
+
+    to_fetch = [packages[i] for i in missing]
+    logging.debug('Getting: {}'.format(', '.join(
+        p + (' (' + str(v) + ')' if v else '') for p, v in to_fetch
+    )))
+
+    batch = None
+    if not metacache.is_offline():
+        etags = [(entries[i] or {}).get('etag') for i in missing]
+        try:
+            batch = _batch_package_info(to_fetch, etags)
+        except (requests.RequestException, RepositoryUnavailable):
+            batch = None # Single lookups can fall back on the cache
+
+    if batch is not None:
+        data, ttl = batch
+        for i, (package, version), info in zip(missing, to_fetch, data):
+            entry = entries[i]
+            if isinstance(info, dict) and info.get('not_modified') and entry is not None:
+                cache.put(package, version, entry['data'], etag=entry.get('etag'), ttl=ttl)
+                info = entry['data']
+            elif not info or 'error' in info or info.get('not_modified'):
+                _package_info_error(
+                    package, info if info and 'error' in info else {'error' : 'Not found'}
+                )
+                info = None
+            else:
+                cache.put(package, version, info, etag=info.get('etag'), ttl=ttl)
+            output[i] = info
+        return output
+
+    infos = utils.thread_map(
+        lambda pv: get_package_info(pv[0], version=pv[1]), to_fetch
+    )
+
+    for i, info in zip(missing, infos):
+        output[i] = info
+    return output
+
+
+def _login(manager):
+    """
+    Log into Atom (once per process) for the calls that require it
+    :param manager: ConnectionManager
+    :return: bool - False if the user gave up
+    """
+    if not hasattr(manager, '_login_response'):
+
         login_url = manager.url + '/accounts/login/'
 
         first_time = True
         try:
             while True:
                 username, password, manual = manager.get_credentials(first_time)
-                res_one = manager.client.get(login_url) # Set Cookie
-                csrftoken = manager.client.cookies['csrftoken']
+                res_one = manager.session.get(login_url) # Set Cookie
+                csrftoken = manager.session.cookies['csrftoken']
                 first_time = False
 
                 login_data = dict(
@@ -335,9 +976,9 @@ def register_package(package, version, method='get', launch_data=None, force=Fal
                     csrfmiddlewaretoken=csrftoken,
                     next='/rest/latest/core/heartbeat'
                 )
-                manager._login_response = manager.client.post(login_url,
-                                                              data=login_data,
-                                                              cookies=res_one.cookies)
+                manager._login_response = manager.session.post(login_url,
+                                                               data=login_data,
+                                                               cookies=res_one.cookies)
 
                 if manager._login_response.status_code not in [200, 302]:
                     logging.info('Invalid credientials! Try again')
@@ -348,7 +989,18 @@ def register_package(package, version, method='get', launch_data=None, force=Fal
 
         except KeyboardInterrupt as e:
             logging.info("Breaking out of package registration.")
-            return None
+            return False
+
+    return True
+
+
+def register_package(package, version, method='get', launch_data=None, force=False, pre_release=False):
+    """
+    Registering a package requires a propper login with Atom
+    """
+    manager = ConnectionManager()
+    if not _login(manager):
+        return None
 
     kwargs = {}
     if method == 'get':
@@ -370,7 +1022,7 @@ def register_package(package, version, method='get', launch_data=None, force=Fal
         if launch_data is not None:
             kwargs['json']['launch_data'] = launch_data
 
-    result = getattr(manager.client, method)(
+    result = getattr(manager.session, method)(
         manager.url + '/rest/latest/core/package/register',
         headers=default_headers(),
         cookies=manager._login_response.cookies,
@@ -392,6 +1044,60 @@ def register_package(package, version, method='get', launch_data=None, force=Fal
         return data
 
 
+def register_closure(package, version, closure):
+    """
+    Store the dependency closure of a registered version with Atom. Atom
+    hands this back as the "closure" of the package information so a
+    launch can skip walking the requirement graph.
+    :param package: The name of the package
+    :param version: The version the closure belongs to
+    :param closure: dict in the lockfile format
+    :return: bool
+    """
+    manager = ConnectionManager()
+    if not _login(manager):
+        return False
+
+    result = manager.session.post(
+        manager.url + '/rest/latest/core/package/closure',
+        json={
+            'package' : package,
+            'version' : version,
+            'closure' : closure
+        },
+        headers=default_headers(),
+        cookies=manager._login_response.cookies
+    )
+
+    if result.status_code in (404, 405, 501):
+        logging.warning('Atom does not support dependency closures')
+        return False
+
+    if result.status_code != 200:
+        logging.error('Could not register closure: {}/{}'.format(package, version))
+        return False
+
+    data = result.json()
+    if 'error' in data:
+        logging.error(data['error'])
+        return False
+    return True
+
+
+def get_package_closure(package, version=None):
+    """
+    Get the dependency closure registered with a package. This comes along
+    with the package information so it's cached just the same.
+    :param package: The name of the package
+    :param version: The version requested (None for highest)
+    :return: dict|None - None if the package has no closure
+    """
+    info = get_package_info(package, version=version)
+    if info is None:
+        return None
+    return info.get('closure')
+
+
 def get_packges(**params):
     """
     Simple function to gather all packages. This doesn't have
@@ -6,10 +6,23 @@ Also Tar files!
 
 import os
 import sys
+import stat
+import zlib
 import time
+import struct
+import shutil
 import zipfile
 import logging
 import fnmatch
+import tempfile
+import threading
+import contextlib
+import collections
+import multiprocessing
+
+from multiprocessing.pool import ThreadPool
+
+from .constants import SOURCE_DATE_EPOCH
 
 # -- Math from ziptools
 
@@ -20,12 +33,77 @@ SYMLINK_MAGIC = (SYMLINK_TYPE << 28) | (SYMLINK_PERM << 16)
 
 assert SYMLINK_MAGIC == 0xA1ED0000, 'Bit math is askew'    
 
-def _zip_symlink(filepath, zippath, zfile):
+# Bytes copied at a time when extracting a member
+EXTRACT_BUFFER_SIZE = 1024 * 1024
+
+# Members compressed ahead of the archive are kept in memory up to this
+# size, and spooled to disk beyond it
+SPOOL_SIZE = 8 * 1024 * 1024
+
+# Payloads that are compressed already, deflating them again gains nothing
+COMPRESSED_EXTENSIONS = (
+    '.zip', '.gz', '.tgz', '.bz2', '.xz', '.zst', '.7z', '.rar', '.jar', '.whl',
+    '.png', '.jpg', '.jpeg', '.gif', '.webp', '.exr', '.heic',
+    '.mp4', '.mov', '.mkv', '.webm', '.mp3', '.aac', '.ogg', '.flac'
+)
+
+# Files are stored when the first PROBE_SIZE bytes don't deflate to less
+# than PROBE_RATIO of their size. Files smaller than PROBE_MIN_SIZE are
+# always deflated.
+PROBE_SIZE = 64 * 1024
+PROBE_MIN_SIZE = 4 * 1024
+PROBE_RATIO = 0.9
+
+# Bytes that go into each gzip member of a tar gzipped across threads
+GZIP_BLOCK_SIZE = 1024 * 1024
+
+# Timestamp of every member of a reproducible archive, unless the
+# SOURCE_DATE_EPOCH says otherwise (1980-01-01, the earliest zip allows)
+REPRODUCIBLE_EPOCH = 315532800
+
+_NO_LOCK = threading.RLock() # Stands in for ZipFile._lock on older pythons
+
+
+def reproducible_time():
+    """
+    :return: int - The timestamp given to every member of a reproducible
+    archive
+    """
+    try:
+        return max(int(os.environ.get(SOURCE_DATE_EPOCH, '')), REPRODUCIBLE_EPOCH)
+    except ValueError:
+        return REPRODUCIBLE_EPOCH
+
+
+def _normal_mode(mode):
+    """
+    :return: int - The permissions a reproducible archive records for
+    a file, executable or not
+    """
+    return 0o755 if mode & 0o111 else 0o644
+
+
+def _add_to_manifest(manifest, arcname, fpath, digest, reproducible=False):
+    """
+    Record a file in a manifest, as the archive has it
+    :return: None
+    """
+    if reproducible:
+        manifest.add_file(
+            arcname, fpath, digest,
+            mtime=reproducible_time(), mode=_normal_mode(os.stat(fpath).st_mode)
+        )
+    else:
+        manifest.add_file(arcname, fpath, digest)
+
+
+def _zip_symlink(filepath, zippath, zfile, reproducible=False):
     """
     Create: add a symlink (to a file or dir) to the archive.
     :param filepath: The (possibly-prefixed and absolute) path to the link file.
     :param zippath: The (relative or absolute) path to record in the zip itself.
     :param zfile: The ZipFile object used to format the created zip file. 
+    :param reproducible: Record it the same no matter when or where
     """
     assert os.path.islink(filepath)
     linkpath = os.readlink(filepath)
@@ -37,6 +115,10 @@ def _zip_symlink(filepath, zippath, zfile):
     origtime = linkstat.st_mtime
     ziptime  = time.localtime(origtime)[0:6]
 
+    if reproducible:
+        createsystem = 3
+        ziptime = time.gmtime(reproducible_time())[0:6]
+
     # zip mandates '/' separators in the zfile
     if not zippath:
         zippath = filepath
@@ -142,7 +224,477 @@ class ZFile(object):
         self._zfile.close()
 
 
-def zip_files(name, files, root=None, mode='w', ignore=[], noisey=False):
+def _set_level(zinfo, level):
+    """
+    Have ZipFile.open() deflate an entry at a level (python 3.7+, older
+    pythons use zlib's default). The entry is where it looks for it, as
+    compress_level from python 3.13 on.
+    :return: None
+    """
+    if level == zlib.Z_DEFAULT_COMPRESSION:
+        return
+    if hasattr(zinfo, 'compress_level'):
+        zinfo.compress_level = level
+    elif hasattr(zinfo, '_compresslevel'):
+        zinfo._compresslevel = level
+
+
+def _zip_write(zfile, fpath, archive_root, manifest=None, policy=None):
+    """
+    Add a file to an archive, hashing it for the manifest as it goes
+    :param zfile: The open ZipFile
+    :param fpath: The file on disk
+    :param archive_root: The path of the file within the archive
+    :param manifest: Manifest to record the file in (None for no manifest)
+    :param policy: CompressionPolicy for the file (None to deflate it)
+    :return: None
+    """
+    from .manifest import HashingFile, hash_file
+    policy = policy or CompressionPolicy()
+    zinfo = _zip_info(fpath, archive_root, policy.reproducible)
+    zinfo.compress_type = policy.compress_type(fpath)
+
+    digest = None
+    if sys.version_info < (3, 6):
+        # -- Members can't be written as a stream, read it twice
+        if policy.reproducible:
+            with open(fpath, 'rb') as f:
+                zfile.writestr(zinfo, f.read())
+        else:
+            zfile.write(fpath, archive_root, zinfo.compress_type)
+        if manifest is not None:
+            digest = hash_file(fpath)
+
+    else:
+        _set_level(zinfo, policy.level)
+        with open(fpath, 'rb') as source, zfile.open(zinfo, 'w') as dest:
+            reader = source if manifest is None else HashingFile(source)
+            shutil.copyfileobj(reader, dest, EXTRACT_BUFFER_SIZE)
+        if manifest is not None:
+            digest = reader.hexdigest()
+
+    if manifest is not None:
+        _add_to_manifest(manifest, archive_root, fpath, digest, policy.reproducible)
+
+
+def _zip_manifest(zfile, mode):
+    """
+    :return: Manifest - to fill while adding files to an archive (when
+    appending, this starts with what the archive already has)
+    """
+    from .manifest import Manifest, MANIFEST_NAME
+    manifest = Manifest()
+    if mode == 'a' and MANIFEST_NAME in zfile.namelist():
+        existing = Manifest.from_string(zfile.read(MANIFEST_NAME))
+        if existing is not None:
+            manifest.update(existing)
+    return manifest
+
+
+class CompressionPolicy(object):
+    """
+    How each file of an archive is compressed. Files that are compressed
+    already (images, video, archives, ...) are stored as they are, so we
+    don't spend time deflating them for nothing and then inflating them
+    again on every install.
+    """
+    def __init__(self, level=None, store=None, auto=False, reproducible=False):
+        """
+        :param level: int deflate level, 1 (fastest) to 9 (smallest).
+        0 stores everything, None is zlib's default
+        :param store: list[str] of unix patterns for files to store as-is
+        :param auto: Also store files by extension (COMPRESSED_EXTENSIONS)
+        and those that a sample of doesn't compress
+        :param reproducible: Build the same archive from the same files no
+        matter when, where or by whom (sorted members with normalized
+        timestamps and permissions)
+        """
+        self.level = zlib.Z_DEFAULT_COMPRESSION if level is None else level
+        self.store = store or []
+        self.auto = auto
+        self.reproducible = reproducible
+
+
+    def _incompressible(self, fpath):
+        """
+        :return: bool - does a sample from the start of the file deflate?
+        """
+        with open(fpath, 'rb') as f:
+            sample = f.read(PROBE_SIZE)
+        if len(sample) < PROBE_MIN_SIZE:
+            return False
+        return len(zlib.compress(sample, 1)) > len(sample) * PROBE_RATIO
+
+
+    def compress_type(self, fpath):
+        """
+        :param fpath: The file on disk
+        :return: int - zipfile.ZIP_STORED or zipfile.ZIP_DEFLATED
+        """
+        name = os.path.basename(fpath)
+        if self.level == 0 or any(fnmatch.fnmatch(name, p) for p in self.store):
+            return zipfile.ZIP_STORED
+
+        if self.auto:
+            if name.lower().endswith(COMPRESSED_EXTENSIONS):
+                return zipfile.ZIP_STORED
+            if self._incompressible(fpath):
+                return zipfile.ZIP_STORED
+
+        return zipfile.ZIP_DEFLATED
+
+
+def _zip_info(fpath, arcname, reproducible=False):
+    """
+    :param fpath: The file on disk
+    :param arcname: The path of the file within the archive
+    :param reproducible: Normalize the timestamp and permissions
+    :return: ZipInfo - for a file, as ZipFile.write() would make it
+    """
+    info = os.stat(fpath)
+    if reproducible:
+        zinfo = zipfile.ZipInfo(arcname.lstrip('/'), time.gmtime(reproducible_time())[0:6])
+        zinfo.create_system = 3
+        zinfo.external_attr = (stat.S_IFREG | _normal_mode(info.st_mode)) << 16
+    else:
+        zinfo = zipfile.ZipInfo(arcname.lstrip('/'), time.localtime(info.st_mtime)[0:6])
+        zinfo.external_attr = (info.st_mode & 0xFFFF) << 16
+    zinfo.file_size = info.st_size
+    return zinfo
+
+
+def _deflate(fpath, arcname, digest=False, policy=None):
+    """
+    Compress a file apart from any archive (see: _append_compressed())
+    :param fpath: The file on disk
+    :param arcname: The path of the file within the archive
+    :param digest: Also take the sha256 of the file
+    :param policy: CompressionPolicy for the file (None to deflate it)
+    :return: tuple(ZipInfo, file, str|None) - the entry, its compressed data
+    (spooled to disk when large) and the sha256
+    """
+    from .manifest import HashingFile
+    policy = policy or CompressionPolicy()
+    zinfo = _zip_info(fpath, arcname, policy.reproducible)
+    zinfo.compress_type = policy.compress_type(fpath)
+
+    compressor = None
+    if zinfo.compress_type == zipfile.ZIP_DEFLATED:
+        compressor = zlib.compressobj(policy.level, zlib.DEFLATED, -15)
+
+    data = tempfile.SpooledTemporaryFile(SPOOL_SIZE)
+    crc = 0
+    size = 0
+    with open(fpath, 'rb') as f:
+        reader = HashingFile(f) if digest else f
+        for chunk in iter(lambda: reader.read(EXTRACT_BUFFER_SIZE), b''):
+            crc = zlib.crc32(chunk, crc)
+            size += len(chunk)
+            data.write(compressor.compress(chunk) if compressor else chunk)
+    if compressor:
+        data.write(compressor.flush())
+
+    zinfo.CRC = crc & 0xffffffff
+    zinfo.file_size = size
+    zinfo.compress_size = data.tell()
+    data.seek(0)
+    return zinfo, data, reader.hexdigest() if digest else None
+
+
+def _append_compressed(zfile, zinfo, data):
+    """
+    Add an entry whose data is already compressed to an archive, as is.
+    ZipFile has no public way of doing so, this follows what
+    ZipFile.write() does with what it compressed. Only --jobs and --base
+    builds go this way, everything else uses ZipFile.write().
+    :param zfile: The open ZipFile
+    :param zinfo: ZipInfo with the CRC, sizes and compression filled in
+    :param data: file with the compressed data
+    :return: None
+    """
+    with getattr(zfile, '_lock', None) or _NO_LOCK:
+        start_dir = getattr(zfile, 'start_dir', None)
+        if start_dir is not None:
+            zfile.fp.seek(start_dir)
+        zinfo.header_offset = zfile.fp.tell()
+        zfile._writecheck(zinfo)
+        zfile._didModify = True
+
+        zfile.fp.write(zinfo.FileHeader())
+        shutil.copyfileobj(data, zfile.fp, EXTRACT_BUFFER_SIZE)
+
+        zfile.filelist.append(zinfo)
+        zfile.NameToInfo[zinfo.filename] = zinfo
+        if start_dir is not None:
+            zfile.start_dir = zfile.fp.tell()
+
+
+def _zip_entries(files, root, ignore):
+    """
+    Walk what's going into an archive
+    :param files: list[str] of paths to files
+    :param root: The root directory of our archive
+    :param ignore: Unix patterns of the files to leave out
+    :return: list[tuple(str, str, str)] - (kind, path on disk, path in the
+    archive) where kind is 'file', 'link' or 'dir' (empty directories)
+    """
+    root = root.replace("\\", "/")
+    entries = []
+
+    def _clean(p):
+        return p.replace('\\', '/')#.lstrip('/')
+
+    def _zip_action(base, files):
+        """
+        Recurse and do the action required
+        """
+        for file in files:
+            if any(fnmatch.fnmatch(file, p) for p in ignore):
+                continue
+
+            fpath = _clean(os.path.join(base, file))
+            if any(fnmatch.fnmatch(fpath, p) for p in ignore):
+                continue
+
+            archive_root = _clean(fpath.replace(root, '', 1))
+
+            # Weird windows issue but save unc paths :|
+            if archive_root.startswith('/') and not archive_root.startswith('//'):
+                archive_root = archive_root[1:]
+
+            if os.path.isdir(fpath):
+
+                if os.path.islink(fpath):
+                    # This is a symlink directory
+                    archive_root = _clean(fpath.replace(root, '', 1))
+                    entries.append(('link', fpath, archive_root))
+                    continue
+
+                files = os.listdir(fpath)
+                if not files:
+                    entries.append(('dir', fpath, archive_root))
+                else:
+                    _zip_action(fpath, files)
+
+            elif os.path.islink(fpath):
+                entries.append(('link', fpath, archive_root))
+            else:
+                entries.append(('file', fpath, archive_root))
+
+    for file_name in files:
+        file_name = file_name.replace("\\", "/")
+
+        if any(fnmatch.fnmatch(file_name, p) for p in ignore):
+            continue
+
+        if any(fnmatch.fnmatch(os.path.basename(file_name), p) for p in ignore):
+            continue
+
+        if os.path.isdir(file_name):
+            if os.path.islink(file_name):
+                # This is a symlink directory
+                entries.append(('link', file_name, _clean(file_name.replace(root, '', 1))))
+            else:
+                _zip_action(file_name, os.listdir(file_name))
+        elif os.path.exists(file_name):
+            _zip_action(os.path.dirname(file_name), [os.path.basename(file_name)])
+        else:
+            raise RuntimeError('File not found: {}',format(file_name))
+
+    return entries
+
+
+class _Slice(object):
+    """
+    Read only so many bytes of a file, from where it's at
+    """
+    def __init__(self, fp, size):
+        self._fp = fp
+        self._left = size
+
+
+    def read(self, size=-1):
+        if size < 0 or size > self._left:
+            size = self._left
+        data = self._fp.read(size)
+        self._left -= len(data)
+        return data
+
+
+class _ZipBase(object):
+    """
+    An earlier build of an archive. Members that haven't changed since
+    are copied from it as they are (still compressed) rather than
+    compressed all over again.
+    """
+    def __init__(self, path):
+        from .manifest import Manifest, MANIFEST_NAME
+        self._zfile = zipfile.ZipFile(path, 'r')
+        self._infos = dict((i.filename, i) for i in self._zfile.infolist())
+
+        self._manifest = None
+        if MANIFEST_NAME in self._infos:
+            self._manifest = Manifest.from_string(self._zfile.read(MANIFEST_NAME))
+
+
+    def close(self):
+        self._zfile.close()
+
+
+    def sha256(self, arcname):
+        """
+        :return: str|None - The hash the manifest of the base has for a member
+        """
+        if self._manifest is None:
+            return None
+        return self._manifest.files.get(arcname.lstrip('/'), {}).get('sha256')
+
+
+    def unchanged(self, entry, policy, manifest=False):
+        """
+        Check if a file is the same as the base has it, by size and crc32.
+        The time a zip records is only good to two seconds, it can't tell
+        us a file hasn't changed.
+        :param entry: ('file', path on disk, path in the archive)
+        :param policy: CompressionPolicy of the archive
+        :param manifest: We need the sha256 of the file too
+        :return: bool
+        """
+        kind, fpath, arcname = entry
+        zinfo = self._infos.get(arcname.lstrip('/'))
+        if zinfo is None or zinfo.flag_bits & 0x1 or _info_is_symlink(zinfo):
+            return False # Not there, encrypted or not a file
+        if manifest and self.sha256(arcname) is None:
+            return False
+
+        info = os.stat(fpath)
+        if info.st_size != zinfo.file_size:
+            return False
+        if zinfo.compress_type != policy.compress_type(fpath):
+            return False
+        return _same_crc(fpath, zinfo)
+
+
+    def copy(self, zfile, fpath, arcname, reproducible=False):
+        """
+        Add the member of the base for a file to an archive, as it is
+        :param zfile: The open ZipFile we're writing
+        :param fpath: The file on disk
+        :param arcname: The path of the file within the archive
+        :param reproducible: Normalize the timestamp and permissions
+        :return: None
+        """
+        base = self._infos[arcname.lstrip('/')]
+        fp = self._zfile.fp
+        fp.seek(base.header_offset)
+        header = struct.unpack(zipfile.structFileHeader, fp.read(zipfile.sizeFileHeader))
+        if header[0] != zipfile.stringFileHeader:
+            raise zipfile.BadZipfile('Bad local header: {}'.format(base.filename))
+
+        # -- The local header has its own name and extra field lengths
+        fp.seek(base.header_offset + zipfile.sizeFileHeader + header[10] + header[11])
+
+        zinfo = _zip_info(fpath, arcname, reproducible)
+        zinfo.compress_type = base.compress_type
+        zinfo.CRC = base.CRC
+        zinfo.compress_size = base.compress_size
+        zinfo.file_size = base.file_size
+        _append_compressed(zfile, zinfo, _Slice(fp, base.compress_size))
+
+
+def _zip_entry(zfile, entry, manifest=None, noisey=False, policy=None, base=None):
+    """
+    Add an entry from _zip_entries() to an archive
+    :param base: _ZipBase that 'copy' entries come from
+    :return: None
+    """
+    kind, fpath, archive_root = entry
+    reproducible = policy is not None and policy.reproducible
+    if kind == 'dir':
+        if noisey:
+            logging.info("Zipping: {}".format(fpath))
+        zinfo = zipfile.ZipInfo(archive_root + '/')
+        if reproducible:
+            zinfo.date_time = time.gmtime(reproducible_time())[0:6]
+            zinfo.create_system = 3
+            zinfo.external_attr = ((stat.S_IFDIR | 0o755) << 16) | 0x10
+        zfile.writestr(zinfo, '')
+
+    elif kind == 'link':
+        if noisey:
+            logging.info("Zipping (symlink): {}".format(fpath))
+        _zip_symlink(fpath, archive_root, zfile, reproducible)
+        if manifest is not None:
+            manifest.add_link(archive_root, fpath)
+
+    elif kind == 'copy':
+        if noisey:
+            logging.info("Unchanged: {}".format(fpath))
+        base.copy(zfile, fpath, archive_root, reproducible)
+        if manifest is not None:
+            _add_to_manifest(
+                manifest, archive_root, fpath, base.sha256(archive_root), reproducible
+            )
+
+    else:
+        if noisey:
+            logging.info("Zipping: {}".format(fpath))
+        _zip_write(zfile, fpath, archive_root, manifest, policy)
+
+
+def _zip_parallel(zfile, entries, jobs, manifest=None, noisey=False, policy=None, base=None):
+    """
+    Add entries from _zip_entries() to an archive, deflating the files
+    across a pool of threads. The archive itself is only written from
+    this thread, in the order of the entries.
+    :return: None
+    """
+    pool = ThreadPool(jobs)
+    pending = collections.deque()
+
+    def _write_next():
+        entry, result = pending.popleft()
+        if result is None:
+            _zip_entry(zfile, entry, manifest, noisey, policy, base)
+            return
+
+        zinfo, data, digest = result.get()
+        try:
+            if noisey:
+                logging.info("Zipping: {}".format(entry[1]))
+            _append_compressed(zfile, zinfo, data)
+        finally:
+            data.close()
+        if manifest is not None:
+            _add_to_manifest(
+                manifest, entry[2], entry[1], digest, policy is not None and policy.reproducible
+            )
+
+    try:
+        for entry in entries:
+            result = None
+            if entry[0] == 'file':
+                result = pool.apply_async(
+                    _deflate, (entry[1], entry[2], manifest is not None, policy)
+                )
+            pending.append((entry, result))
+
+            # -- Keep the workers busy without holding everything at once
+            if len(pending) >= jobs * 4:
+                _write_next()
+
+        while pending:
+            _write_next()
+        pool.close()
+    except BaseException:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+
+
+def zip_files(name, files, root=None, mode='w', ignore=[], noisey=False, manifest=False,
+              jobs=1, policy=None, base=None):
     """
     Zip up a given set of files. This will handle symlinks and empty directories as
     well to make things a bit easier.
@@ -154,157 +706,510 @@ def zip_files(name, files, root=None, mode='w', ignore=[], noisey=False):
     :param root: The root directory of our archive to base the files
     off of
     :param mode: The mode to open our zip file with ('w' or 'a')
+    :param manifest: Embed a manifest of the files (see: common.manifest)
+    :param jobs: int number of threads compressing files (0 for one per core)
+    :param policy: CompressionPolicy for the files (None to deflate them all)
+    :param base: An earlier build of this archive (it can be the archive
+    itself). Files it already has are copied from it without compressing
+    them again, and anything it has that isn't in files is left out.
     """
+    from . import utils
+
     if not name.endswith('.zip'):
         name += '.zip'
 
     if root is None:
         root = ''
 
-    root = root.replace("\\", "/")
+    policy = policy or CompressionPolicy()
+    entries = _zip_entries(files, root, ignore)
+    if policy.reproducible:
+        entries.sort(key=lambda e: e[2])
 
-    def _clean(p):
-        return p.replace('\\', '/')#.lstrip('/')
+    if not jobs:
+        jobs = multiprocessing.cpu_count()
 
-    with ZFile(name, mode) as zfile:
-        for file_name in files:
-            file_name = file_name.replace("\\", "/")
+    zip_base = None
+    if base is not None and mode == 'w':
+        try:
+            zip_base = _ZipBase(base)
+        except (IOError, OSError, zipfile.BadZipfile) as e:
+            logging.debug('Not updating from: {} - {}'.format(base, str(e)))
 
-            if any(fnmatch.fnmatch(file_name, p) for p in ignore):
-                continue
+    def _write(zfile):
+        file_manifest = _zip_manifest(zfile, mode) if manifest else None
 
-            if any(fnmatch.fnmatch(os.path.basename(file_name), p) for p in ignore):
-                continue
+        if jobs > 1:
+            _zip_parallel(zfile, entries, jobs, file_manifest, noisey, policy, zip_base)
+        else:
+            for entry in entries:
+                _zip_entry(zfile, entry, file_manifest, noisey, policy, zip_base)
+
+        if file_manifest is not None:
+            from .manifest import MANIFEST_NAME
+            zinfo = zipfile.ZipInfo(MANIFEST_NAME, time.localtime()[0:6])
+            if policy.reproducible:
+                zinfo.date_time = time.gmtime(reproducible_time())[0:6]
+                zinfo.create_system = 3
+            zinfo.external_attr = 0o644 << 16
+            zinfo.compress_type = zipfile.ZIP_DEFLATED
+            zfile.writestr(zinfo, file_manifest.to_string())
+
+    if zip_base is None:
+        with ZFile(name, mode) as zfile:
+            _write(zfile)
+        return
+
+    try:
+        files_only = [e for e in entries if e[0] == 'file']
+        unchanged = utils.thread_map(
+            lambda e: zip_base.unchanged(e, policy, manifest), files_only, jobs
+        )
+        copies = set(e[2] for e, same in zip(files_only, unchanged) if same)
+        entries = [('copy',) + e[1:] if e[2] in copies else e for e in entries]
+        logging.info('Updating: {} ({} of {} files unchanged)'.format(
+            name, len(copies), len(files_only)
+        ))
+
+        # -- The base may be the archive itself, so we write another
+        # and swap it in once we're done
+        with utils.atomic_write(name, 'wb') as f:
+            with ZFile(f, 'w') as zfile:
+                _write(zfile)
+            zip_base.close() # Before it's replaced (Windows)
+    finally:
+        zip_base.close()
+
+
+def _unix_mode(zinfo):
+    """
+    :return: int|None - The permissions of an entry (when it has them)
+    """
+    if zinfo.create_system == 3:
+        return (zinfo.external_attr >> 16) or None
+    return None
 
-            def _zip_action(base, files):
-                """
-                Recurse and do the action required
-                """
-                for file in files:
-                    if any(fnmatch.fnmatch(file, p) for p in ignore):
-                        continue
 
-                    fpath = _clean(os.path.join(base, file))
-                    if any(fnmatch.fnmatch(fpath, p) for p in ignore):
-                        continue
+def _member_path(zinfo, output):
+    """
+    :return: str - Where an entry extracts to (drives, '.' and '..' dropped
+    so nothing lands outside of output)
+    """
+    name = os.path.splitdrive(zinfo.filename)[1].replace('\\', '/')
+    parts = [p for p in name.split('/') if p not in ('', '.', '..')]
+    return os.path.join(output, *parts)
 
-                    archive_root = _clean(fpath.replace(root, '', 1))
 
-                    # Weird windows issue but save unc paths :|
-                    if archive_root.startswith('/') and not archive_root.startswith('//'):
-                        archive_root = archive_root[1:]
-
-                    if os.path.isdir(fpath):
-
-                        if os.path.islink(fpath):
-                            # This is a symlink directory
-                            if noisey:
-                                logging.info("Zipping (symlink dir): {}".format(fpath))
-                            archive_root = _clean(fpath.replace(root, '', 1))
-                            _zip_symlink(fpath, archive_root, zfile)
-                            continue
-
-                        files = os.listdir(fpath)
-                        if not files:
-                            if noisey:
-                                logging.info("Zipping: {}".format(fpath))
-                            zinfo = zipfile.ZipInfo(archive_root + '/')
-                            zfile.writestr(zinfo, '')
-                        else:
-                            _zip_action(fpath, files)
+def _write_member(zfile, zinfo, path, hashes=None):
+    """
+    Write the contents of an entry to path (permissions included)
+    :param hashes: dict to add the sha256 of the entry to (None to skip it)
+    :return: None
+    """
+    from .manifest import HashingFile, _entry_name
+    with zfile.open(zinfo) as source, open(path, 'wb') as dest:
+        if hashes is None:
+            shutil.copyfileobj(source, dest, EXTRACT_BUFFER_SIZE)
+        else:
+            reader = HashingFile(source)
+            shutil.copyfileobj(reader, dest, EXTRACT_BUFFER_SIZE)
+            hashes[_entry_name(zinfo.filename)] = reader.hexdigest()
 
-                    else:
-                        if os.path.islink(fpath):
-                            if noisey:
-                                logging.info("Zipping (symlink): {}".format(fpath))
-                            _zip_symlink(fpath, archive_root, zfile)
-                        else:
-                            if noisey:
-                                logging.info("Zipping: {}".format(fpath))
-                            zfile.write(fpath, archive_root)
+    unix_attributes = _unix_mode(zinfo)
+    if unix_attributes:
+        os.chmod(path, unix_attributes)
 
-            if os.path.isdir(file_name):
-                if os.path.islink(file_name):
-                    # This is a symlink directory
-                    if noisey:
-                        logging.info("Zipping (symlink dir): {}".format(file_name))
-                    archive_root = _clean(file_name.replace(root, '', 1))
-                    _zip_symlink(file_name, archive_root, zfile)
-                else:
-                    _zip_action(file_name, os.listdir(file_name))
-            elif os.path.exists(file_name):
-                _zip_action(os.path.dirname(file_name), [os.path.basename(file_name)])
-            else:
-                raise RuntimeError('File not found: {}',format(file_name))
+
+def _extract_entry(zfile, zinfo, output, hashes=None):
+    """
+    Extract a single entry of an archive (symlinks and permissions included)
+    :param hashes: dict to add the sha256 of the entry to (None to skip it)
+    :return: None
+    """
+    if _info_is_symlink(zinfo):
+        _extract_symlink(zinfo, output, zfile, False)
+        return
+
+    path = _member_path(zinfo, output)
+    dir_ = path if zinfo.filename.endswith('/') else os.path.dirname(path)
+    if not os.path.isdir(dir_):
+        os.makedirs(dir_)
+
+    if not zinfo.filename.endswith('/'):
+        _write_member(zfile, zinfo, path, hashes)
 
 
-def unzip_files(archive, files=[], ignore=[], output=None, noisey=False):
+def _same_crc(path, zinfo):
     """
-    Extract data from an archive.
+    :return: bool - Does a file have the crc32 an entry records?
+    """
+    from .manifest import Crc32, hash_file
+    crc = Crc32()
+    hash_file(path, crc)
+    return crc.value == zinfo.CRC
+
+
+def unchanged_entries(zfile, previous):
+    """
+    Find the entries of an archive that a previous extraction (e.g. the
+    last version of a package) already has
+    :param zfile: The open ZipFile
+    :param previous: The directory of the previous extraction
+    :return: set(str) of entry names
+    """
+    from . import utils
+    from .manifest import Manifest, MANIFEST_NAME
+
+    # -- When both sides have a manifest, files the previous extraction
+    # hasn't touched are compared by hash without reading them
+    ours = theirs = None
+    if MANIFEST_NAME in zfile.namelist():
+        ours = Manifest.from_string(zfile.read(MANIFEST_NAME))
+        theirs = Manifest.load(previous)
+
+    def _unchanged(zinfo):
+        if zinfo.filename.endswith('/') or _info_is_symlink(zinfo):
+            return False
+        local = _member_path(zinfo, previous)
+        try:
+            info = os.lstat(local)
+            if os.path.islink(local) or info.st_size != zinfo.file_size:
+                return False
+
+            if ours is not None and theirs is not None:
+                new = ours.files.get(zinfo.filename, {})
+                old = theirs.files.get(zinfo.filename, {})
+                if new.get('sha256') and int(info.st_mtime) == old.get('mtime'):
+                    return new['sha256'] == old.get('sha256')
+
+            return _same_crc(local, zinfo)
+        except (IOError, OSError):
+            return False
+
+    infos = zfile.infolist()
+    return set(
+        i.filename for i, same in zip(infos, utils.thread_map(_unchanged, infos)) if same
+    )
+
+
+def unzip_delta(zfile, previous, unchanged, output, hashes=None):
+    """
+    Extract an archive, taking the unchanged entries from a previous
+    extraction rather than the archive itself. Those are hard linked
+    where we can (and copied otherwise).
+    :param zfile: The open ZipFile
+    :param previous: The directory of the previous extraction
+    :param unchanged: set(str) of entry names from unchanged_entries()
+    :param output: Destination of our archive
+    :param hashes: dict to add the sha256 of the entries we extract to
+    :return: None
+    """
+    for zinfo in zfile.infolist():
+        if zinfo.filename not in unchanged:
+            _extract_entry(zfile, zinfo, output, hashes)
+            continue
+
+        source = _member_path(zinfo, previous)
+        dest = _member_path(zinfo, output)
+        if not os.path.isdir(os.path.dirname(dest)):
+            os.makedirs(os.path.dirname(dest))
+
+        mode = _unix_mode(zinfo)
+        if mode and (os.stat(source).st_mode & 0o7777) != (mode & 0o7777):
+            # -- Links share permissions, this one needs its own
+            shutil.copyfile(source, dest)
+            os.chmod(dest, mode)
+            continue
+
+        try:
+            os.link(source, dest)
+        except (AttributeError, OSError):
+            shutil.copy2(source, dest)
+
+
+def _wanted(name, files, ignore):
+    """
+    :param name: The name of an entry
+    :param files: Unix patterns of the entries we want (empty for all)
+    :param ignore: Unix patterns of the entries to skip
+    :return: bool
+    """
+    if files:
+        return any(fnmatch.fnmatch(name, p) for p in files)
+    return not any(fnmatch.fnmatch(name, p) for p in ignore)
+
+
+def unzip_files(archive, files=[], ignore=[], output=None, noisey=False, workers=None,
+                hashes=None):
+    """
+    Extract data from an archive. Entries are inflated across a pool of
+    threads (zlib lets go of the GIL), each with its own handle on the
+    archive.
     :param archive: Path to a zipped archive that can be opened
     :param files: List of files (unix pattern matched) to extract | None for all
-    :param exclude: When extracing, exclude these files
+    :param ignore: When extracing, exclude these files
     :param output: Destination of our archive
+    :param workers: int number of threads (default: utils.worker_count())
+    :param hashes: dict to add the sha256 of every file we extract to
+    (entry name -> sha256), taken as they're written
     :return: None
     """
+    from . import utils
+    output = output or os.getcwd()
+
     with ZFile(archive, 'r') as zfile:
+        infolist = zfile.infolist()
+
+    # -- An appended archive can hold a name more than once, the last one
+    # wins (as it would extracting in order) and only one thread writes it
+    latest = dict((i.filename, i) for i in infolist)
+    entries = [
+        i for i in infolist
+        if latest[i.filename] is i and _wanted(i.filename, files, ignore)
+    ]
+
+    links = [i for i in entries if _info_is_symlink(i)]
+    members = [
+        i for i in entries if not _info_is_symlink(i) and not i.filename.endswith('/')
+    ]
+
+    # -- Every directory up front, so the workers don't have to check
+    directories = set()
+    for zinfo in entries:
+        path = _member_path(zinfo, output)
+        directories.add(path if zinfo.filename.endswith('/') else os.path.dirname(path))
+    for directory in sorted(directories):
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def _extract(chunk):
+        with ZFile(archive, 'r') as zfile:
+            for zinfo in chunk:
+                if noisey:
+                    logging.info("Extract: {}".format(zinfo.filename))
+                _write_member(zfile, zinfo, _member_path(zinfo, output), hashes)
+
+    if members:
+        # -- Largest first and dealt out in turn, so the work evens out
+        workers = min(workers or utils.worker_count(), len(members))
+        members.sort(key=lambda i: i.file_size, reverse=True)
+        utils.thread_map(_extract, [members[i::workers] for i in range(workers)], workers)
+
+    # -- Links last, their targets are in place by now
+    if links:
+        with ZFile(archive, 'r') as zfile:
+            for zinfo in links:
+                if noisey:
+                    logging.info("Extract: {}".format(zinfo.filename))
+                _extract_symlink(zinfo, output, zfile, False)
 
-        def _extract(zinfo, fn):
-            if noisey:
-                logging.info("Extract: {}".format(fn))
 
-            if '/' in zinfo.filename:
-                dir_ = os.path.join(output, os.path.dirname(zinfo.filename))
-                if not os.path.exists(dir_):
-                    os.makedirs(dir_)
-            else:
-                dir_ = '.'
-            if _info_is_symlink(zinfo):
-                extracted_path = _extract_symlink(zinfo, output, zfile, False)
-            else:
-                extracted_path = zfile.extract(zinfo, output)
-                if zinfo.create_system == 3:
-                    unix_attributes = zinfo.external_attr >> 16
-                    if unix_attributes:
-                        os.chmod(extracted_path, unix_attributes)
+# -------------------------------------------------------------------------
+# -- Tar Files
 
-        for zip_info in zfile.infolist():
+import tarfile
 
-            file_name = zip_info.filename
 
-            # Check if this is a file we want
-            if files:
-                for ok_pattern in files:
-                    if fnmatch.fnmatch(file_name, ok_pattern):
-                        _extract(zip_info, file_name)
-            elif ignore:
-                # Check if we want to ignore this file
-                for ignore_pattern in ignore:
-                    if fnmatch.fnmatch(file_name, ignore_pattern):
-                        break
-                else:
-                    # None of the ignore patterns matched
-                    _extract(zip_info, file_name)
-            else:
-                _extract(zip_info, file_name)
+def _tar_normalize(tarinfo):
+    """
+    tarfile filter recording a member the same no matter when, where or
+    by whom the archive is built
+    :return: TarInfo
+    """
+    tarinfo.mtime = reproducible_time()
+    tarinfo.uid = tarinfo.gid = 0
+    tarinfo.uname = tarinfo.gname = ''
+    if tarinfo.isdir():
+        tarinfo.mode = 0o755
+    elif not tarinfo.issym():
+        tarinfo.mode = _normal_mode(tarinfo.mode)
+    return tarinfo
 
 
-# -------------------------------------------------------------------------
-# -- Tar Files
+def _tar_add(tar, fpath, arcname, manifest=None, reproducible=False):
+    """
+    Add a file (or link) to a tar, hashing it for the manifest as it goes
+    :param tar: The open TarFile
+    :param fpath: The file on disk
+    :param arcname: The path of the file within the archive
+    :param manifest: Manifest to record the file in (None for no manifest)
+    :param reproducible: Normalize the timestamp, owner and permissions
+    :return: None
+    """
+    normalize = _tar_normalize if reproducible else None
+    if manifest is None:
+        tar.add(fpath, arcname=arcname, filter=normalize)
+        return
+
+    if os.path.islink(fpath):
+        tar.add(fpath, arcname=arcname, filter=normalize)
+        manifest.add_link(arcname, fpath)
+        return
+
+    from .manifest import HashingFile
+    tarinfo = tar.gettarinfo(fpath, arcname=arcname)
+    if reproducible:
+        tarinfo = _tar_normalize(tarinfo)
+    with open(fpath, 'rb') as f:
+        reader = HashingFile(f)
+        tar.addfile(tarinfo, reader)
+    _add_to_manifest(manifest, arcname, fpath, reader.hexdigest(), reproducible)
+
+
+def _tar_write_manifest(tar, manifest, reproducible=False):
+    """
+    Add the manifest member to a tar
+    :return: None
+    """
+    import io
+    from .manifest import MANIFEST_NAME
+    data = manifest.to_string().encode('utf-8')
+    tarinfo = tarfile.TarInfo(MANIFEST_NAME)
+    tarinfo.size = len(data)
+    tarinfo.mtime = reproducible_time() if reproducible else time.time()
+    tarinfo.mode = 0o644
+    tar.addfile(tarinfo, io.BytesIO(data))
 
-import tarfile
+
+def _gzip_block(data, level):
+    """
+    :return: bytes - data as a gzip member of its own
+    """
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    return compressor.compress(data) + compressor.flush()
 
 
-def tar_files(name, files, root=None, mode='w', ignore=[], noisey=False):
+class ParallelGzipWriter(object):
     """
-    Build a tar of a given set of files.
+    File-like object that gzips what's written to it across a pool of
+    threads, pigz style. The data is cut into blocks that are compressed
+    into gzip members of their own and written out in order. Any gzip
+    reader (including tarfile and gunzip) takes a run of members as one.
+    """
+    def __init__(self, fileobj, jobs, level=None, block_size=None):
+        """
+        :param fileobj: Where the compressed data goes
+        :param jobs: int number of threads compressing
+        :param level: int gzip level (default: 6)
+        :param block_size: int bytes compressed at a time (default: GZIP_BLOCK_SIZE)
+        """
+        self._fileobj = fileobj
+        self._jobs = jobs
+        self._level = 6 if level is None else level
+        self._block_size = block_size or GZIP_BLOCK_SIZE
+        self._pool = ThreadPool(jobs)
+        self._pending = collections.deque()
+        self._buffer = bytearray()
+        self._closed = False
+
+
+    def _submit(self, block):
+        self._pending.append(self._pool.apply_async(_gzip_block, (block, self._level)))
+
+        # -- Keep the workers busy without holding everything at once
+        while len(self._pending) > self._jobs * 2:
+            self._fileobj.write(self._pending.popleft().get())
+
+
+    def write(self, data):
+        self._buffer += data
+        while len(self._buffer) >= self._block_size:
+            self._submit(bytes(self._buffer[:self._block_size]))
+            del self._buffer[:self._block_size]
+        return len(data)
+
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        try:
+            if self._buffer or not self._pending:
+                self._submit(bytes(self._buffer))
+            while self._pending:
+                self._fileobj.write(self._pending.popleft().get())
+            self._pool.close()
+        except BaseException:
+            self._pool.terminate()
+            raise
+        finally:
+            self._pool.join()
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, type, value, traceback):
+        self.close()
+
+
+def _tar_compression(name):
+    """
+    :return: str - tarfile compression for an archive name ('gz', 'xz' or '')
+    """
+    name = name.lower()
+    if name.endswith(('.tar.gz', '.tgz')):
+        return 'gz'
+    if name.endswith(('.tar.xz', '.txz')):
+        return 'xz'
+    return ''
+
+
+@contextlib.contextmanager
+def _open_tar(name, mode, level=None, jobs=1, reproducible=False):
+    """
+    Open a tar for writing, compressed as the name calls for
+    :param name: The name of the archive
+    :param mode: 'w' or 'a'
+    :param level: gzip level or xz preset (None for the default)
+    :param jobs: int number of threads gzipping (0 for one per core)
+    :param reproducible: Keep the time and name of the archive out of
+    the gzip header
+    """
+    compression = _tar_compression(name)
+    if not jobs:
+        jobs = multiprocessing.cpu_count()
+
+    kwargs = {}
+    if reproducible:
+        kwargs['format'] = tarfile.PAX_FORMAT
+
+    if compression == 'gz' and (jobs > 1 or reproducible) and mode == 'w':
+        with open(name, 'wb') as f, ParallelGzipWriter(f, jobs, level) as gz:
+            with tarfile.open(fileobj=gz, mode='w|', **kwargs) as tar:
+                yield tar
+        return
+
+    if level is not None and compression == 'gz':
+        kwargs['compresslevel'] = level
+    elif level is not None and compression == 'xz':
+        kwargs['preset'] = level
+
+    with tarfile.open(name, mode + (':' + compression if compression else ''), **kwargs) as tar:
+        yield tar
+
+
+def tar_files(name, files, root=None, mode='w', ignore=[], noisey=False, manifest=False,
+              jobs=1, level=None, reproducible=False):
+    """
+    Build a tar of a given set of files. Archives ending in .tar.gz/.tgz
+    are gzipped and .tar.xz/.txz ones compressed with xz.
 
     :param name: The name of this archive
     :param files: list[str] of paths to files
     :param root: The root directory of our archive to base the files
     off of
     :param mode: The mode to open our zip file with ('w' or 'a')
+    :param manifest: Embed a manifest of the files (see: common.manifest)
+    :param jobs: int number of threads gzipping (0 for one per core)
+    :param level: gzip level (1-9) or xz preset (0-9), None for the default
+    :param reproducible: Build the same archive from the same files no
+    matter when, where or by whom (sorted members with normalized
+    timestamps, owners and permissions)
     """
+    listdir = (lambda p: sorted(os.listdir(p))) if reproducible else os.listdir
+
 
     if root is None:
         root = ''
@@ -314,11 +1219,22 @@ def tar_files(name, files, root=None, mode='w', ignore=[], noisey=False):
     def _clean(p):
         return p.replace('\\', '/')#.lstrip('/')
 
-    comp_mode = ''
-    if name.endswith('.tar.gz') or name.endswith('.tgz'):
-        comp_mode = ':gz'
-
-    with tarfile.open(name, mode + comp_mode) as tar:
+    file_manifest = None
+    if manifest:
+        from .manifest import Manifest, MANIFEST_NAME
+        file_manifest = Manifest()
+        if mode == 'a' and os.path.isfile(name):
+            with tarfile.open(name, 'r:*') as existing:
+                try:
+                    member = existing.extractfile(MANIFEST_NAME)
+                except KeyError:
+                    member = None
+                if member is not None:
+                    found = Manifest.from_string(member.read())
+                    if found is not None:
+                        file_manifest.update(found)
+
+    with _open_tar(name, mode, level, jobs, reproducible) as tar:
 
         def _tar_action(base, files):
             """
@@ -333,12 +1249,15 @@ def tar_files(name, files, root=None, mode='w', ignore=[], noisey=False):
                     continue
 
                 if os.path.isdir(fpath):
-                    files = os.listdir(fpath)
+                    files = listdir(fpath)
                     if not files:
                         if noisey:
                             logging.info("Tar Directory: {}".format(fpath))
                         directory_path = _clean(fpath.replace(root, '', 1))
-                        tar.add(fpath, arcname=directory_path, recursive=False)
+                        tar.add(
+                            fpath, arcname=directory_path, recursive=False,
+                            filter=_tar_normalize if reproducible else None
+                        )
                     else:
                         _tar_action(fpath, files)
 
@@ -348,10 +1267,10 @@ def tar_files(name, files, root=None, mode='w', ignore=[], noisey=False):
                         logging.info("Tar: {}".format(fpath))
 
                     file_path = _clean(fpath.replace(root, '', 1))
-                    tar.add(fpath, arcname=file_path)
+                    _tar_add(tar, fpath, file_path, file_manifest, reproducible)
 
 
-        for file_name in files:
+        for file_name in (sorted(files) if reproducible else files):
             file_name = file_name.replace("\\", "/")
 
             if any(fnmatch.fnmatch(file_name, p) for p in ignore):
@@ -361,12 +1280,58 @@ def tar_files(name, files, root=None, mode='w', ignore=[], noisey=False):
                 continue
 
             if os.path.isdir(file_name):
-                _tar_action(file_name, os.listdir(file_name))
+                _tar_action(file_name, listdir(file_name))
             elif os.path.exists(file_name):
                 _tar_action(os.path.dirname(file_name), [os.path.basename(file_name)])
             else:
                 raise RuntimeError('File not found: {}',format(file_name))
 
+        if file_manifest is not None:
+            _tar_write_manifest(tar, file_manifest, reproducible)
+
+
+def _tar_check(tarinfo, output):
+    """
+    Make sure a tar member stays within output once it's extracted. This
+    is what the 'data' extraction filter does, for versions of python
+    that don't have it.
+    :raises tarfile.TarError: When it doesn't
+    """
+    root = os.path.realpath(output)
+
+    def _inside(path):
+        path = os.path.realpath(path)
+        return path == root or path.startswith(os.path.join(root, ''))
+
+    path = os.path.join(root, tarinfo.name)
+    bad = os.path.isabs(tarinfo.name) or not _inside(path)
+    if tarinfo.issym():
+        bad = bad or os.path.isabs(tarinfo.linkname) or not _inside(
+            os.path.join(os.path.dirname(path), tarinfo.linkname)
+        )
+    elif tarinfo.islnk():
+        bad = bad or not _inside(os.path.join(root, tarinfo.linkname))
+    elif not (tarinfo.isfile() or tarinfo.isdir()):
+        bad = True # Devices and fifos have no place in a package
+
+    if bad:
+        raise tarfile.TarError(
+            'Refusing to extract outside of {}: {}'.format(output, tarinfo.name)
+        )
+
+
+def _tar_extract(tar, tarinfo, output):
+    """
+    Extract a member of a tar archive. Absolute paths, '..' and links
+    that point outside of output are refused.
+    :raises tarfile.TarError: For members that would land outside of output
+    """
+    if hasattr(tarfile, 'data_filter'):
+        tar.extract(tarinfo, path=output, filter='data')
+    else:
+        _tar_check(tarinfo, output)
+        tar.extract(tarinfo, path=output)
+
 
 def untar_files(archive, files=[], ignore=[], output=None, noisey=False):
     """
@@ -390,7 +1355,7 @@ def untar_files(archive, files=[], ignore=[], output=None, noisey=False):
             else:
                 dir_ = '.'
 
-            tar.extract(tarinfo, path=output)
+            _tar_extract(tar, tarinfo, output)
 
         for tar_info in tar:
 
@@ -408,3 +1373,89 @@ def untar_files(archive, files=[], ignore=[], output=None, noisey=False):
                     _extract(tar_info, file_name)
             else:
                 _extract(tar_info, file_name)
+
+
+# Archives that we can read front to back without seeking
+TAR_EXTENSIONS = ('.tar', '.tar.gz', '.tgz', '.tar.xz', '.txz')
+
+
+def is_tar(name):
+    """
+    :param name: The name of an archive
+    :return: bool - Is this a tar archive?
+    """
+    return name.lower().endswith(TAR_EXTENSIONS)
+
+
+class _Prefixed(object):
+    """
+    Stream with data we've already read from it put back in front
+    """
+    def __init__(self, raw, prefix):
+        self._raw = raw
+        self._prefix = prefix
+
+
+    def read(self, size=-1):
+        if not self._prefix:
+            return self._raw.read(size)
+        data, self._prefix = self._prefix, b''
+        if size < 0:
+            return data + self._raw.read()
+        if len(data) < size:
+            data += self._raw.read(size - len(data))
+        return data
+
+
+class _GzipMembers(object):
+    """
+    Decompress a stream of one or more gzip members (see: ParallelGzipWriter)
+    without seeking
+    """
+    def __init__(self, raw):
+        self._raw = raw
+        self._zlib = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        self._buffer = bytearray()
+
+
+    def read(self, size=-1):
+        while size < 0 or len(self._buffer) < size:
+            if self._zlib.unused_data:
+                # -- On to the next member
+                data = self._zlib.unused_data
+                self._zlib = zlib.decompressobj(16 + zlib.MAX_WBITS)
+            else:
+                data = self._raw.read(GZIP_BLOCK_SIZE)
+                if not data:
+                    break
+            self._buffer += self._zlib.decompress(data)
+
+        if size < 0:
+            size = len(self._buffer)
+        data = bytes(self._buffer[:size])
+        del self._buffer[:size]
+        return data
+
+
+def untar_stream(stream, output, noisey=False):
+    """
+    Extract a tar archive as it's being read. The stream is never seeked
+    so this can unpack a package straight off of the network without
+    an intermediate file.
+    :param stream: file-like object with a read() method
+    :param output: Destination of our archive
+    :return: None
+    :raises tarfile.TarError: For members that would land outside of output
+    """
+    # -- tarfile's own stream reading stops after the first gzip member
+    head = stream.read(2)
+    if head == b'\x1f\x8b':
+        reader, mode = _GzipMembers(_Prefixed(stream, head)), 'r|'
+    else:
+        reader, mode = _Prefixed(stream, head), 'r|*'
+
+    with tarfile.open(fileobj=reader, mode=mode) as tar:
+        for tar_info in tar:
+            if noisey:
+                logging.info("Extract: {}".format(tar_info.name))
+            _tar_extract(tar, tar_info, output)
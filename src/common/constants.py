@@ -16,6 +16,74 @@ FLAUNCH_BUILD_DIR   = 'FLAUNCH_BUILD_DIR'
 # files as well as the source materials
 FLAUNCH_DEV_DIR     = 'FLAUNCH_DEV_DIR'
 
+# Timestamp (seconds since the epoch) given to every member of an archive
+# built with --reproducible (see: https://reproducible-builds.org)
+SOURCE_DATE_EPOCH   = 'SOURCE_DATE_EPOCH'
+
+# -- Set by the user to tune flaunch:
+
+# The number of worker threads used when fetching and
+# installing packages concurrently
+FLAUNCH_WORKERS     = 'FLAUNCH_WORKERS'
+
+# The number of pooled (keep-alive) connections we hold
+# onto per host when talking to Atom
+FLAUNCH_HTTP_POOL_SIZE = 'FLAUNCH_HTTP_POOL_SIZE'
+
+# Seconds we trust a successful heartbeat with our package
+# index before checking on it again
+FLAUNCH_HEARTBEAT_TTL = 'FLAUNCH_HEARTBEAT_TTL'
+
+# Seconds that cached package information from our package
+# index is used without checking back
+FLAUNCH_METADATA_TTL = 'FLAUNCH_METADATA_TTL'
+
+# When set, resolve packages entirely from our local caches
+# without reaching out to the package index
+FLAUNCH_OFFLINE     = 'FLAUNCH_OFFLINE'
+
+# When set, never use or store cached launch plans
+FLAUNCH_NO_PLAN_CACHE = 'FLAUNCH_NO_PLAN_CACHE'
+
+# Read-only package stores (os.pathsep separated) laid out like our own
+# app store that are checked before downloading anything
+# e.g. /mnt/flux/packages
+FLAUNCH_SHARED_CACHE = 'FLAUNCH_SHARED_CACHE'
+
+# How packages found in a shared cache are installed: "link" or "copy"
+FLAUNCH_SHARED_CACHE_MODE = 'FLAUNCH_SHARED_CACHE_MODE'
+
+# Nodes running "flaunch serve-cache" (comma separated host[:port]) to
+# get packages from before going to the package index
+FLAUNCH_PEERS       = 'FLAUNCH_PEERS'
+
+# When set, ask the LAN (multicast) for a node that can serve packages
+FLAUNCH_PEER_DISCOVERY = 'FLAUNCH_PEER_DISCOVERY'
+
+# Budget for the local package store. When exceeded, the least recently
+# launched packages are evicted after an install. e.g. 200G
+FLAUNCH_STORE_MAX_SIZE = 'FLAUNCH_STORE_MAX_SIZE'
+
+# Packages not launched for this long are evicted after an install
+# e.g. 30d (s, m, h, d or w)
+FLAUNCH_STORE_MAX_AGE = 'FLAUNCH_STORE_MAX_AGE'
+
+# When set, installs keep their own copy of every file rather than
+# sharing identical files between versions through the object store
+FLAUNCH_NO_DEDUPE   = 'FLAUNCH_NO_DEDUPE'
+
+# When set, always download the whole archive of a package rather than
+# only what changed since a version that's already installed
+FLAUNCH_NO_DELTA    = 'FLAUNCH_NO_DELTA'
+
+# Packages (comma separated package or package/version) that are never
+# evicted from the local package store. e.g. PyFlux,Helios/1.4.2
+FLAUNCH_PINNED      = 'FLAUNCH_PINNED'
+
+# When set, resolve the requirement graph even if the application
+# has a dependency closure registered with it
+FLAUNCH_NO_CLOSURE  = 'FLAUNCH_NO_CLOSURE'
+
 # --  Set by flaunch when running a command
 
 # The package string that was used when calling the command
@@ -43,3 +111,6 @@ _STARTING_PORT = 8456 # Incr from this (+1, +2, etc)
 
 # The transfer utility
 TRANSFER_PORT = _STARTING_PORT + 1
+
+# Serving installed packages to peers (http and multicast discovery)
+PEER_CACHE_PORT = _STARTING_PORT + 2
@@ -0,0 +1,138 @@
+"""
+Inter-process locking on a file. The operating system releases the lock
+when the holding process goes away, so a crashed process never leaves a
+stale lock behind.
+"""
+from __future__ import absolute_import
+
+import os
+import time
+import logging
+
+from . import utils
+
+try:
+    import fcntl
+    msvcrt = None
+except ImportError:
+    fcntl = None
+    import msvcrt
+
+
+class LockTimeout(Exception):
+    """ The lock could not be acquired in time """
+    pass
+
+
+class FileLock(object):
+    """
+    Lock held on a file for the life of a with block
+
+    .. code-block:: python
+
+        with FileLock('/path/to/thing.lock'):
+            # Only one process (or thread) at a time in here
+            ...
+
+        with FileLock('/path/to/thing.lock', shared=True):
+            # Any number of readers, but no exclusive holder
+            ...
+    """
+    def __init__(self, path, timeout=None, poll=0.1, shared=False):
+        """
+        :param path: The lock file (created if required)
+        :param timeout: Seconds to wait for the lock (None waits forever)
+        :param poll: Seconds between attempts
+        :param shared: Take a shared lock that only excludes exclusive
+        ones. Windows has no shared locks so these always succeed there.
+        """
+        self._path = path
+        self._timeout = timeout
+        self._poll = poll
+        self._shared = shared
+        self._file = None
+        self._locked = False
+
+
+    @property
+    def path(self):
+        return self._path
+
+
+    def _try_lock(self):
+        """
+        :return: bool - did we get the lock?
+        """
+        try:
+            if fcntl is not None:
+                mode = fcntl.LOCK_SH if self._shared else fcntl.LOCK_EX
+                fcntl.flock(self._file.fileno(), mode | fcntl.LOCK_NB)
+            elif self._shared:
+                return True
+            else:
+                self._file.seek(0)
+                msvcrt.locking(self._file.fileno(), msvcrt.LK_NBLCK, 1)
+                self._locked = True
+            return True
+        except (IOError, OSError):
+            return False
+
+
+    def acquire(self, blocking=True):
+        """
+        Get the lock
+        :param blocking: Wait for the lock rather than giving up right away
+        :return: bool - Do we hold the lock?
+        """
+        utils.ensure_dir(os.path.dirname(self._path))
+        self._file = open(self._path, 'a+')
+
+        if not blocking:
+            if self._try_lock():
+                return True
+            self._file.close()
+            self._file = None
+            return False
+
+        start = time.time()
+        waiting = False
+        while not self._try_lock():
+            if not waiting:
+                logging.info('Waiting on lock: {}'.format(self._path))
+                waiting = True
+
+            if self._timeout is not None and (time.time() - start) > self._timeout:
+                self._file.close()
+                self._file = None
+                raise LockTimeout('Timed out waiting on: {}'.format(self._path))
+            time.sleep(self._poll)
+        return True
+
+
+    def release(self):
+        """
+        Let go of the lock
+        :return: None
+        """
+        if self._file is None:
+            return
+
+        try:
+            if fcntl is not None:
+                fcntl.flock(self._file.fileno(), fcntl.LOCK_UN)
+            elif self._locked:
+                self._file.seek(0)
+                msvcrt.locking(self._file.fileno(), msvcrt.LK_UNLCK, 1)
+                self._locked = False
+        finally:
+            self._file.close()
+            self._file = None
+
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+
+    def __exit__(self, type, value, traceback):
+        self.release()
@@ -28,6 +28,8 @@ class LaunchJson(_AbstractFLaunchData):
 
         _AbstractFLaunchData.__init__(self, package, path, data)
 
+        self._source_path = path.replace('\\', '/')
+        self._base = None
         self._development = development
         if self._development:
             # -- Attempt to locate the developement build.yaml for additional
@@ -53,6 +55,32 @@ class LaunchJson(_AbstractFLaunchData):
                     self['env'][env_key] = env_value
 
 
+    @property
+    def source_path(self):
+        """
+        The launch.json this was loaded from. Unlike the path, this doesn't
+        change when we extend another package.
+        :return: str
+        """
+        return self._source_path
+
+
+    @property
+    def base(self):
+        """
+        :return: LaunchJson this instance extends (or None)
+        """
+        return self._base
+
+
+    @property
+    def development(self):
+        """
+        :return: bool - Is this a development package
+        """
+        return self._development
+
+
     def requires(self):
         """
         :return: list[str] of required packages
@@ -100,6 +128,7 @@ class LaunchJson(_AbstractFLaunchData):
         :param base_ljson: The LaunchJson that this instance overrides
         :return: None
         """
+        self._base = base_ljson
         self._path = base_ljson._path
         self._data = PlatformDict(
             dict(merge_dicts(base_ljson._data.to_dict(), self._data.to_dict()))
@@ -0,0 +1,289 @@
+"""
+Manifests of package archives.
+
+Archives built with a manifest carry a ``.flaunch_manifest.json`` member
+that lists every file with its size, permissions, modification time and
+sha256. The hashes are taken while the files are compressed, so building
+one costs no additional pass over the files.
+
+.. code-block:: json
+
+    {
+        "format" : 1,
+        "files" : {
+            "launch.json" : {
+                "size" : 120,
+                "mode" : 420,
+                "mtime" : 1549583179,
+                "sha256" : "..."
+            },
+            "lib/current" : { "link" : "lib.1.2" }
+        }
+    }
+
+Once extracted, an install can be checked against its manifest with a
+stat of each file, hashing only the files whose size or modification
+time don't line up.
+"""
+from __future__ import absolute_import
+
+import os
+import json
+import stat
+import zlib
+import hashlib
+
+from . import utils
+
+MANIFEST_NAME = '.flaunch_manifest.json'
+
+# Bump when the layout of a manifest changes
+MANIFEST_FORMAT = 1
+
+# Bytes read at a time while hashing
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+class Crc32(object):
+    """
+    crc32 (as zip archives record it) with the interface of a hashlib hash
+    """
+    def __init__(self):
+        self._crc = 0
+
+
+    def update(self, data):
+        self._crc = zlib.crc32(data, self._crc)
+
+
+    @property
+    def value(self):
+        """ :return: int """
+        return self._crc & 0xffffffff
+
+
+    def hexdigest(self):
+        return '{:08x}'.format(self.value)
+
+
+class HashingFile(object):
+    """
+    File-like wrapper that hashes everything read through it
+    """
+    def __init__(self, raw, digest=None):
+        """
+        :param raw: The file to read
+        :param digest: hashlib-like object to update (a new sha256 by default)
+        """
+        self._raw = raw
+        self._hash = hashlib.sha256() if digest is None else digest
+        self._size = 0
+
+
+    def read(self, size=-1):
+        data = self._raw.read(size)
+        self._hash.update(data)
+        self._size += len(data)
+        return data
+
+
+    def hexdigest(self):
+        """ :return: str - digest of the data read so far """
+        return self._hash.hexdigest()
+
+
+    @property
+    def size(self):
+        """ :return: int - bytes read so far """
+        return self._size
+
+
+def hash_file(path, digest=None):
+    """
+    :param path: The file to read
+    :param digest: hashlib-like object to update (a new sha256 by default)
+    :return: str - hex digest of the file
+    """
+    with open(path, 'rb') as f:
+        reader = HashingFile(f, digest)
+        for chunk in iter(lambda: reader.read(HASH_CHUNK_SIZE), b''):
+            pass
+    return reader.hexdigest()
+
+
+def _entry_name(arcname):
+    """
+    :return: str - archive path as it's extracted (forward slashes, relative)
+    """
+    return arcname.replace('\\', '/').lstrip('/')
+
+
+def _entry_path(root, name):
+    """
+    :return: str - Where an archive path is under root ('.' and '..'
+    dropped, a manifest never points outside of it)
+    """
+    parts = [p for p in _entry_name(name).split('/') if p not in ('', '.', '..')]
+    return os.path.join(root, *parts)
+
+
+class Manifest(object):
+    """
+    The files of an archive
+    """
+    def __init__(self, data=None):
+        self._data = data or { 'format' : MANIFEST_FORMAT, 'files' : {} }
+
+
+    @classmethod
+    def from_string(cls, contents):
+        """
+        :param contents: str|bytes of a manifest member
+        :return: Manifest|None - None when it's not one we understand
+        """
+        if isinstance(contents, bytes):
+            contents = contents.decode('utf-8')
+        try:
+            data = json.loads(contents)
+        except ValueError:
+            return None
+        if not isinstance(data, dict) or data.get('format') != MANIFEST_FORMAT:
+            return None
+        return cls(data)
+
+
+    @classmethod
+    def load(cls, root):
+        """
+        :param root: The root of an extracted archive (e.g. an install)
+        :return: Manifest|None - None when it has no manifest
+        """
+        try:
+            with open(os.path.join(root, MANIFEST_NAME), 'r') as f:
+                return cls.from_string(f.read())
+        except (IOError, OSError):
+            return None
+
+
+    def to_string(self):
+        return json.dumps(self._data, indent=1, sort_keys=True)
+
+
+    @property
+    def files(self):
+        """ :return: dict - archive path -> entry """
+        return self._data['files']
+
+
+    def add_file(self, arcname, path, sha256, mtime=None, mode=None):
+        """
+        :param arcname: The path of the file within the archive
+        :param path: The file on disk
+        :param sha256: The hex digest of its contents
+        :param mtime: The modification time the archive records (when it
+        isn't the file's own)
+        :param mode: The permissions the archive records (when they aren't
+        the file's own)
+        :return: None
+        """
+        info = os.stat(path)
+        self.files[_entry_name(arcname)] = {
+            'size' : info.st_size,
+            'mode' : stat.S_IMODE(info.st_mode) if mode is None else mode,
+            'mtime' : int(info.st_mtime) if mtime is None else int(mtime),
+            'sha256' : sha256
+        }
+
+
+    def add_link(self, arcname, path):
+        """
+        :param arcname: The path of the symlink within the archive
+        :param path: The symlink on disk
+        :return: None
+        """
+        self.files[_entry_name(arcname)] = { 'link' : os.readlink(path) }
+
+
+    def update(self, other):
+        """
+        Take on the entries of another manifest (e.g. when appending)
+        :return: None
+        """
+        self.files.update(other.files)
+
+
+    def hashes(self):
+        """
+        :return: dict - archive path -> sha256 of every regular file
+        """
+        return dict(
+            (name, entry['sha256']) for name, entry in utils._iter(self.files)
+            if 'sha256' in entry
+        )
+
+
+    def apply_times(self, root):
+        """
+        Set the modification times of freshly extracted files to the ones
+        recorded, so later checks can get by on a stat. Files with other
+        links (e.g. shared with other installs through the object store)
+        are left alone.
+        :param root: The root of the extraction
+        :return: None
+        """
+        for name, entry in utils._iter(self.files):
+            if 'mtime' not in entry:
+                continue
+            path = _entry_path(root, name)
+            try:
+                if os.lstat(path).st_nlink == 1:
+                    os.utime(path, (entry['mtime'], entry['mtime']))
+            except OSError:
+                pass
+
+
+    def verify(self, root, full=False, hashes=None):
+        """
+        Check an extracted archive against the manifest. Files are only
+        hashed when their size or modification time are off.
+        :param root: The root of the extraction
+        :param full: Hash every file, no matter what stat says
+        :param hashes: dict - archive path -> sha256 of files we already
+        know the hash of (e.g. taken while extracting them). Files hashed
+        here are added to it.
+        :return: list[tuple(str, str)] - (archive path, problem) of each
+        file that doesn't match
+        """
+        problems = []
+        known = {} if hashes is None else hashes
+
+        def _check(item):
+            name, entry = item
+            path = _entry_path(root, name)
+            try:
+                info = os.lstat(path)
+            except OSError:
+                return name, 'missing'
+
+            if 'link' in entry:
+                if not os.path.islink(path):
+                    return name, 'not a link'
+                if os.readlink(path).replace('\\', '/') != entry['link'].replace('\\', '/'):
+                    return name, 'link changed'
+                return None
+
+            if not stat.S_ISREG(info.st_mode):
+                return name, 'not a file'
+            if info.st_size != entry['size']:
+                return name, 'size changed'
+            if full or int(info.st_mtime) != entry['mtime']:
+                if name not in known:
+                    known[name] = hash_file(path)
+                if known[name] != entry['sha256']:
+                    return name, 'contents changed'
+            return None
+
+        for result in utils.thread_map(_check, sorted(utils._iter(self.files))):
+            if result is not None:
+                problems.append(result)
+        return problems
@@ -0,0 +1,146 @@
+"""
+On-disk cache of the package information we get from Atom. This lives
+next to the local app store so we can skip the round trip for packages
+we've asked about recently (or all of them when running offline).
+"""
+from __future__ import absolute_import
+
+import os
+import re
+import json
+import time
+import logging
+
+from . import utils
+from .constants import FLAUNCH_OFFLINE, FLAUNCH_METADATA_TTL
+
+# Default seconds that cached package information is valid for
+DEFAULT_TTL = 600
+
+_MAX_AGE_REGEX = re.compile(r'max-age=(\d+)')
+
+
+def is_offline():
+    """
+    :return: bool - Are we resolving packages without Atom?
+    """
+    return os.environ.get(FLAUNCH_OFFLINE, '').lower() not in (
+        '', '0', 'off', 'none', 'no', 'false'
+    )
+
+
+def default_ttl():
+    """
+    :return: float - seconds that cached information is valid for
+    """
+    try:
+        return float(os.environ.get(FLAUNCH_METADATA_TTL, DEFAULT_TTL))
+    except ValueError:
+        return DEFAULT_TTL
+
+
+def max_age(headers):
+    """
+    Pull the max-age from a Cache-Control header if Atom gave us one
+    :param headers: dict-like of response headers
+    :return: float|None
+    """
+    match = _MAX_AGE_REGEX.search(headers.get('Cache-Control', '') or '')
+    if match:
+        return float(match.group(1))
+    return None
+
+
+class PackageInfoCache(object):
+    """
+    Each (package, version) gets its own json file with the response data,
+    the ETag it came with and when it expires.
+
+    .. code-block:: text
+
+        <root>/<facility>/<package>/<version|_highest>.json
+    """
+    HIGHEST = '_highest'
+
+    def __init__(self, facility, root=None):
+        if root is None:
+            root = os.path.join(
+                os.path.dirname(utils.local_path(None, None, base_only=True)),
+                'metadata'
+            )
+        self._root = os.path.join(root, facility)
+
+
+    @property
+    def root(self):
+        return self._root
+
+
+    def _path(self, package, version):
+        """
+        :return: str - path to the cache file of a package
+        """
+        version = (version or self.HIGHEST).replace('/', '_').replace('\\', '_')
+        return os.path.join(self._root, package.lower(), version + '.json')
+
+
+    def get(self, package, version=None):
+        """
+        Get the cache entry for a package
+        :param package: The name of the package
+        :param version: The version requested (None for highest)
+        :return: dict|None with keys: data, etag, fetched, expires
+        """
+        path = self._path(package, version)
+        if not os.path.isfile(path):
+            return None
+
+        try:
+            with open(path, 'r') as f:
+                entry = json.load(f)
+        except Exception as e:
+            logging.debug('Bad metadata cache entry: {} - {}'.format(path, str(e)))
+            return None
+
+        if not isinstance(entry, dict) or 'data' not in entry:
+            return None
+        return entry
+
+
+    def is_fresh(self, entry):
+        """
+        :param entry: dict from get()
+        :return: bool - Can we use this entry without asking Atom?
+        """
+        return entry is not None and time.time() < entry.get('expires', 0)
+
+
+    def put(self, package, version, data, etag=None, ttl=None):
+        """
+        Store the information for a package
+        :param package: The name of the package
+        :param version: The version requested (None for highest)
+        :param data: dict of the package information
+        :param etag: The ETag Atom supplied with the data
+        :param ttl: Seconds this information is valid for (None for default)
+        :return: dict - the new entry
+        """
+        now = time.time()
+        entry = {
+            'data' : data,
+            'etag' : etag,
+            'fetched' : now,
+            'expires' : now + (default_ttl() if ttl is None else ttl)
+        }
+
+        path = self._path(package, version)
+        try:
+            utils.ensure_dir(os.path.dirname(path))
+            with utils.atomic_write(path) as f:
+                json.dump(entry, f)
+        except (IOError, OSError) as e:
+            # -- The cache is never worth failing over
+            logging.debug('Could not write metadata cache: {} - {}'.format(
+                path, str(e)
+            ))
+        return entry
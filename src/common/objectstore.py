@@ -0,0 +1,164 @@
+"""
+Content addressed storage for the files of installed packages.
+
+Consecutive versions of a package share most of their files. Once an
+install is extracted, each of its files is hashed and swapped for a hard
+link to a blob in ``flux_launch/objects``, so a file that's the same in
+every version is only ever on disk once.
+
+.. code-block:: text
+
+    objects/<aa>/<sha256>-<mode>
+
+Blobs are keyed by content and permissions (hard links share both). A
+blob with a single link left is only referenced by the object store and
+can be pruned.
+
+Installs are shared between versions this way, so packages must never
+modify their own files in place.
+"""
+from __future__ import absolute_import
+
+import os
+import stat
+import errno
+import logging
+import threading
+
+from . import utils
+from .manifest import hash_file
+from .constants import FLAUNCH_NO_DEDUPE
+
+# Attempts at linking a blob that's being pruned at the same time
+_LINK_ATTEMPTS = 3
+
+
+def root():
+    """
+    :return: str - The directory that holds the blobs
+    """
+    path = os.path.join(
+        os.path.dirname(utils.local_path(None, None, base_only=True)),
+        'objects'
+    )
+    utils.ensure_dir(path)
+    return path
+
+
+def is_enabled():
+    """
+    :return: bool - Are installs deduplicated?
+    """
+    return hasattr(os, 'link') and not os.environ.get(FLAUNCH_NO_DEDUPE)
+
+
+def _replace_with_link(blob, path):
+    """
+    Swap a file for a hard link to a blob
+    :return: None
+    """
+    temp_path = '{}.{}.{}.lnk'.format(
+        path, os.getpid(), threading.current_thread().ident
+    )
+    os.link(blob, temp_path)
+    try:
+        if utils.PY3:
+            os.replace(temp_path, path)
+        else:
+            if utils.SYSTEM == 'Windows':
+                os.unlink(path)
+            os.rename(temp_path, path)
+    finally:
+        if os.path.lexists(temp_path):
+            os.unlink(temp_path)
+
+
+def _store(objects, path, digest=None):
+    """
+    Move a file into the object store
+    :param objects: The object store root
+    :param path: The file
+    :param digest: The sha256 of the file when it's already known
+    :return: int - bytes saved (the blob was already there)
+    """
+    info = os.lstat(path)
+    if not stat.S_ISREG(info.st_mode) or info.st_size == 0:
+        return 0
+    if info.st_nlink > 1:
+        return 0 # Already shared (e.g. linked from a previous version)
+
+    key = '{}-{:o}'.format(digest or hash_file(path), stat.S_IMODE(info.st_mode))
+    blob = os.path.join(utils.ensure_dir(os.path.join(objects, key[:2])), key)
+
+    for attempt in range(_LINK_ATTEMPTS):
+        try:
+            os.link(path, blob)
+            return 0 # The first of its kind
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+
+        if os.path.samefile(path, blob):
+            return 0
+
+        try:
+            _replace_with_link(blob, path)
+            return info.st_size
+        except OSError as e:
+            if e.errno != errno.ENOENT:
+                raise
+            # -- Pruned out from under us, try again
+
+    return 0
+
+
+def dedupe(path, hashes=None):
+    """
+    Swap the files of an install for links into the object store
+    :param path: The install (or staging) directory
+    :param hashes: dict - relative path -> sha256 of files we don't
+    need to hash again (e.g. from the package manifest)
+    :return: int - bytes saved
+    """
+    if not is_enabled() or os.path.islink(path):
+        return 0
+
+    hashes = hashes or {}
+    objects = root()
+    files = []
+    for directory, dirs, names in os.walk(path):
+        files.extend(os.path.join(directory, name) for name in names)
+
+    def _dedupe(file_path):
+        relative = os.path.relpath(file_path, path).replace('\\', '/')
+        try:
+            return _store(objects, file_path, hashes.get(relative))
+        except (IOError, OSError) as e:
+            # -- The file stays as it is, we just don't share it
+            logging.debug('Could not dedupe: {} - {}'.format(file_path, str(e)))
+            return 0
+
+    saved = sum(utils.thread_map(_dedupe, files))
+    if saved:
+        logging.debug('Deduplicated: {} ({})'.format(path, utils.human_size(saved)))
+    return saved
+
+
+def prune():
+    """
+    Remove blobs that no install links to anymore
+    :return: int - bytes freed
+    """
+    objects = root()
+    freed = 0
+    for directory, dirs, names in os.walk(objects):
+        for name in names:
+            blob = os.path.join(directory, name)
+            try:
+                info = os.lstat(blob)
+                if info.st_nlink == 1:
+                    os.unlink(blob)
+                    freed += info.st_size
+            except OSError:
+                pass
+    return freed
@@ -0,0 +1,214 @@
+"""
+Share the packages installed on this node with other nodes on the LAN.
+
+When a new release lands, every node on the farm asks Atom for the same
+packages at the same time. Nodes running ``flaunch serve-cache`` hand out
+what they've already installed so the rest can get it from a neighbour.
+
+Peers are found through a static list (FLAUNCH_PEERS) and/or by asking
+the LAN over multicast (FLAUNCH_PEER_DISCOVERY).
+
+.. code-block:: text
+
+    GET /flaunch/cache/<package>/<version> -> tar stream of the install
+"""
+from __future__ import absolute_import
+
+import os
+import json
+import time
+import socket
+import struct
+import logging
+import tarfile
+import threading
+
+from . import utils
+from .communicate import http_session
+from .service import _HandlerBase, new_server
+from .constants import FLAUNCH_PEERS, FLAUNCH_PEER_DISCOVERY, PEER_CACHE_PORT
+
+ENDPOINT = 'flaunch/cache'
+
+# Discovery queries go to this group (on PEER_CACHE_PORT)
+MULTICAST_GROUP = '239.255.84.58'
+
+# Seconds to wait on peers before going to Atom instead
+PEER_TIMEOUT = 1.0
+
+# Last member of every stream. Without it, the transfer was cut short
+COMPLETE_MARKER = '.flaunch_peer_complete'
+
+
+def _installed(package, version):
+    """
+    Find a complete install that we can serve
+    :param package: The name of the package
+    :param version: The version of the package
+    :return: str|None
+    """
+    for part in (package, version):
+        if not part or part.startswith('.') or '/' in part or '\\' in part:
+            return None
+
+    path = utils.local_path(package, version)
+    if os.path.isfile(os.path.join(path, 'launch.json')):
+        return os.path.realpath(path)
+    return None
+
+
+class PeerCacheHandler(_HandlerBase):
+    """
+    Serve installed packages as tar streams
+    """
+    endpoint = ENDPOINT
+
+    def _install_path(self):
+        """
+        :return: str|None - The install this request is after
+        """
+        parts = self.path.strip('/').split('/')
+        prefix = self.endpoint.split('/')
+        if len(parts) != len(prefix) + 2 or parts[:len(prefix)] != prefix:
+            return None
+        return _installed(*parts[len(prefix):])
+
+
+    def do_HEAD(self):
+        self.send_response(200 if self._install_path() else 404)
+        self.end_headers()
+
+
+    def do_GET(self):
+        path = self._install_path()
+        if path is None:
+            self.send_response(404)
+            self.end_headers()
+            return
+
+        self.send_response(200)
+        self.send_header('Content-type', 'application/x-tar')
+        self.end_headers()
+
+        logging.info('Serving: {}'.format(path))
+        with tarfile.open(fileobj=self.wfile, mode='w|') as tar:
+            tar.add(path, arcname='.')
+
+            marker = tarfile.TarInfo(COMPLETE_MARKER)
+            marker.mtime = time.time()
+            tar.addfile(marker)
+
+
+    def log_message(self, format, *args):
+        logging.debug(format % args)
+
+
+def _announcer(port):
+    """
+    Answer multicast queries for packages that we have installed
+    :param port: The port our http server is on
+    :return: None
+    """
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind(('', PEER_CACHE_PORT))
+    sock.setsockopt(
+        socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP,
+        struct.pack('4sl', socket.inet_aton(MULTICAST_GROUP), socket.INADDR_ANY)
+    )
+
+    while True:
+        data, address = sock.recvfrom(4096)
+        try:
+            query = json.loads(data.decode('utf-8'))
+            if _installed(query['package'], query['version']):
+                sock.sendto(json.dumps({'port' : port}).encode('utf-8'), address)
+        except (ValueError, KeyError, TypeError):
+            continue
+
+
+def serve(port=PEER_CACHE_PORT, announce=True):
+    """
+    Serve our installed packages until interrupted
+    :param port: The port to serve on
+    :param announce: Answer multicast discovery queries
+    :return: None
+    """
+    server = new_server(PeerCacheHandler, port=port, threaded=True)
+
+    if announce:
+        announcer = threading.Thread(target=_announcer, args=(port,))
+        announcer.daemon = True
+        announcer.start()
+
+    logging.info('Serving packages at: {}'.format(server.http_address))
+    with server:
+        try:
+            while True:
+                time.sleep(1)
+        except KeyboardInterrupt:
+            logging.info('Shutting down')
+
+
+def _static_peers():
+    """
+    :return: list[str] - base urls of our known peers
+    """
+    peers = []
+    for peer in os.environ.get(FLAUNCH_PEERS, '').split(','):
+        peer = peer.strip()
+        if not peer:
+            continue
+        if ':' not in peer:
+            peer = '{}:{}'.format(peer, PEER_CACHE_PORT)
+        peers.append('http://' + peer)
+    return peers
+
+
+def _discover(package, version):
+    """
+    Ask the LAN for a node that has a package installed
+    :return: str|None - base url of the first node to answer
+    """
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
+    try:
+        sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, 1)
+        sock.settimeout(PEER_TIMEOUT)
+        sock.sendto(
+            json.dumps({'package' : package, 'version' : version}).encode('utf-8'),
+            (MULTICAST_GROUP, PEER_CACHE_PORT)
+        )
+        data, address = sock.recvfrom(4096)
+        return 'http://{}:{}'.format(address[0], json.loads(data.decode('utf-8'))['port'])
+    except (socket.error, ValueError, KeyError):
+        return None
+    finally:
+        sock.close()
+
+
+def find_peer(package, version):
+    """
+    Find a peer that can serve a package
+    :param package: The name of the package
+    :param version: The version of the package
+    :return: str|None - url to stream the package from
+    """
+    path = '/{}/{}/{}'.format(ENDPOINT, package, version)
+
+    def _has(peer):
+        try:
+            return http_session().head(peer + path, timeout=PEER_TIMEOUT).status_code == 200
+        except Exception:
+            return False
+
+    peers = _static_peers()
+    for peer, has in zip(peers, utils.thread_map(_has, peers)):
+        if has:
+            return peer + path
+
+    if os.environ.get(FLAUNCH_PEER_DISCOVERY):
+        peer = _discover(package, version)
+        if peer:
+            return peer + path
+
+    return None
@@ -13,8 +13,10 @@ from common import utils
 # for this but 
 if utils.PY3:
     import http.server as http
+    import socketserver
 else:
     import BaseHTTPServer as http
+    import SocketServer as socketserver
 
 """
 TODO:
@@ -125,13 +127,21 @@ class ServerThread(threading.Thread):
                 self._server.shutdown()
 
 
-def new_server(handler_class, port=8456):
+class _ThreadedHTTPServer(socketserver.ThreadingMixIn, http.HTTPServer):
+    """
+    HTTPServer that handles each request on its own thread
+    """
+    daemon_threads = True
+
+
+def new_server(handler_class, port=8456, threaded=False):
     """
     Starts the server_class on a new thread to recieve requests
     while we stay available for other tasks.
     :param handler_class: Subclass of the _HandlerBase that implements
     do_<REST_METHOD>(self)
     :param port: The port to supply this thread.
+    :param threaded: Handle each request on its own thread
 
     :return: ServerThread with additional attributes:
         - http_address: The local address of the endpoint we can ship elsewhere
@@ -142,7 +152,8 @@ def new_server(handler_class, port=8456):
     assert (issubclass(handler_class, _HandlerBase)), \
            "Handler must be _HandlerBase subclass"
 
-    server = http.HTTPServer(('', port), handler_class)
+    server_class = _ThreadedHTTPServer if threaded else http.HTTPServer
+    server = server_class(('', port), handler_class)
     server_thread = ServerThread(server=server)
 
     address = get_lan_node_ip() + ":{}/{}".format(port, handler_class.endpoint)
@@ -0,0 +1,276 @@
+"""
+Index of the installs in the local package store.
+
+Home directories often live on network storage where every listdir and
+stat is a round trip. Rather than probe the store for what's installed,
+we keep a small SQLite database next to it that installs, launches and
+clears keep up to date.
+
+The store itself is still the truth. An install the index doesn't know
+about is picked up the first time it's looked for on disk, and the whole
+index is built from the store when the database is first created.
+"""
+from __future__ import absolute_import
+
+import os
+import time
+import sqlite3
+import logging
+import contextlib
+
+from . import utils
+
+# Bump when the schema changes (the index is rebuilt from the store)
+INDEX_FORMAT = 2
+
+# Seconds to wait on other processes writing to the index
+INDEX_TIMEOUT = 30.0
+
+_SCHEMA = (
+    'CREATE TABLE IF NOT EXISTS installs ('
+    '    path TEXT PRIMARY KEY,'
+    '    package TEXT NOT NULL COLLATE NOCASE,'
+    '    version TEXT NOT NULL,'
+    '    size INTEGER NOT NULL,'
+    '    installed REAL NOT NULL,'
+    '    used REAL NOT NULL,'
+    '    digest TEXT'
+    ')',
+    'CREATE INDEX IF NOT EXISTS installs_package ON installs (package, version)',
+    'CREATE INDEX IF NOT EXISTS installs_used ON installs (used)'
+)
+
+_COLUMNS = ('path', 'package', 'version', 'size', 'installed', 'used', 'digest')
+
+# Raised when the index can't be read or written (locked, corrupt, etc.)
+StoreIndexError = sqlite3.Error
+
+
+def dir_size(path):
+    """
+    :return: int - bytes used by everything under path (links aren't
+    followed). Files shared with other installs through the object store
+    only count for their share.
+    """
+    if os.path.islink(path):
+        return 0 # Lives in a shared cache
+    total = 0
+    for root, dirs, files in os.walk(path):
+        for name in files:
+            try:
+                info = os.lstat(os.path.join(root, name))
+            except OSError:
+                continue
+            # -- One of the links belongs to the object store
+            total += info.st_size // max(1, info.st_nlink - 1)
+    return total
+
+
+class StoreIndex(object):
+    """
+    SQLite index of the package store, one row per install
+    """
+    def __init__(self, path=None, store=None):
+        """
+        :param path: The database (next to the package store by default)
+        :param store: The root of the package store
+        """
+        if store is None:
+            store = utils.local_path(None, None, base_only=True)
+        if path is None:
+            path = os.path.join(os.path.dirname(store), 'index.db')
+        self._store = store
+        self._path = path
+
+
+    @property
+    def path(self):
+        return self._path
+
+
+    @contextlib.contextmanager
+    def _connect(self):
+        """
+        Open the database, building it from the store when required.
+        Every connection is its own, so threads don't share one.
+        """
+        conn = sqlite3.connect(self._path, timeout=INDEX_TIMEOUT, isolation_level=None)
+        try:
+            if conn.execute('PRAGMA user_version').fetchone()[0] != INDEX_FORMAT:
+                # -- Walking the store can take a while, others can keep
+                # reading (or building) while we do
+                installs = self._scan()
+                with self._transaction(conn):
+                    # -- Check again, another process may have beaten us to it
+                    if conn.execute('PRAGMA user_version').fetchone()[0] != INDEX_FORMAT:
+                        self._build(conn, installs)
+            yield conn
+        finally:
+            conn.close()
+
+
+    @contextlib.contextmanager
+    def _transaction(self, conn):
+        """
+        Write transaction, taking the database lock up front
+        """
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            yield conn
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        conn.execute('COMMIT')
+
+
+    def _scan(self):
+        """
+        Find the installs in the store
+        :return: list[tuple] - (package, version, path, installed, size)
+        """
+        logging.debug('Indexing package store: {}'.format(self._store))
+        installs = []
+        for package in os.listdir(self._store):
+            package_path = os.path.join(self._store, package)
+            if not os.path.isdir(package_path):
+                continue
+            for version in os.listdir(package_path):
+                path = os.path.join(package_path, version).replace('\\', '/')
+                if version.endswith('.tmp'):
+                    continue
+                if not os.path.isfile(os.path.join(path, 'launch.json')):
+                    continue
+                installs.append(
+                    (package, version, path, os.lstat(path).st_mtime, dir_size(path))
+                )
+        return installs
+
+
+    def _build(self, conn, installs):
+        """
+        (Re)create the index
+        :param installs: list[tuple] from _scan()
+        :return: None
+        """
+        conn.execute('DROP TABLE IF EXISTS installs')
+        for statement in _SCHEMA:
+            conn.execute(statement)
+
+        for package, version, path, installed, size in installs:
+            self._insert(conn, package, version, path, installed, size=size)
+
+        conn.execute('PRAGMA user_version = {}'.format(INDEX_FORMAT))
+
+
+    def _insert(self, conn, package, version, path, installed, digest=None, replace=True,
+                size=None):
+        conn.execute(
+            'INSERT OR {} INTO installs VALUES (?, ?, ?, ?, ?, ?, ?)'.format(
+                'REPLACE' if replace else 'IGNORE'
+            ),
+            (path, package, version, dir_size(path) if size is None else size,
+             installed, installed, digest)
+        )
+
+
+    def _rows(self, cursor):
+        return [dict(zip(_COLUMNS, row)) for row in cursor.fetchall()]
+
+
+    def add(self, package, version, path, digest=None, replace=True):
+        """
+        Record an install
+        :param package: The name of the package
+        :param version: The version of the package
+        :param path: The install location
+        :param digest: sha256 of the archive it was installed from
+        :param replace: Replace what the index already has for this install
+        :return: None
+        """
+        size = dir_size(path)
+        with self._connect() as conn, self._transaction(conn):
+            self._insert(conn, package, version, path, time.time(), digest, replace, size)
+
+
+    def lookup(self, package, version):
+        """
+        :param package: The name of the package
+        :param version: The version of the package
+        :return: dict|None - The install
+        """
+        with self._connect() as conn:
+            rows = self._rows(conn.execute(
+                'SELECT * FROM installs WHERE package = ? AND version = ?',
+                (package, version)
+            ))
+        return rows[0] if rows else None
+
+
+    def versions(self, package):
+        """
+        :param package: The name of the package
+        :return: list[dict] - Installs of the package
+        """
+        with self._connect() as conn:
+            return self._rows(conn.execute(
+                'SELECT * FROM installs WHERE package = ? ORDER BY version',
+                (package,)
+            ))
+
+
+    def installs(self):
+        """
+        :return: list[dict] - Every install, least recently used first
+        """
+        with self._connect() as conn:
+            return self._rows(conn.execute('SELECT * FROM installs ORDER BY used'))
+
+
+    def touch(self, paths, when=None):
+        """
+        Note that installs were just used
+        :param paths: list[str] of install locations
+        :param when: float - The time of use (now by default)
+        :return: None
+        """
+        when = time.time() if when is None else when
+        with self._connect() as conn, self._transaction(conn):
+            conn.executemany(
+                'UPDATE installs SET used = ? WHERE path = ?',
+                [(when, p) for p in paths]
+            )
+
+
+    @contextlib.contextmanager
+    def removing(self, path):
+        """
+        Drop an install from the index. This is only committed once the
+        with block, that takes it out of the store, succeeds.
+        :param path: The install location
+        """
+        with self._connect() as conn, self._transaction(conn):
+            conn.execute('DELETE FROM installs WHERE path = ?', (path,))
+            yield
+
+
+    def remove_package(self, package=None):
+        """
+        Drop every install of a package from the index
+        :param package: The name of the package (None for everything)
+        :return: None
+        """
+        with self._connect() as conn, self._transaction(conn):
+            if package is None:
+                conn.execute('DELETE FROM installs')
+            else:
+                conn.execute('DELETE FROM installs WHERE package = ?', (package,))
+
+
+    def rebuild(self):
+        """
+        Throw away the index and build it from the store again
+        :return: None
+        """
+        installs = self._scan()
+        with self._connect() as conn, self._transaction(conn):
+            self._build(conn, installs)
@@ -24,12 +24,11 @@ import time
 import sys
 import copy
 import logging
-import requests
 import platform
 import threading
 
 from . import log
-from .communicate import FLUX_FACILITY, get_facilities, default_headers
+from .communicate import FLUX_FACILITY, get_facilities, default_headers, http_session
 from .service import _HandlerBase, new_server
 from .constants import TRANSFER_PORT
 
@@ -157,7 +156,7 @@ def transfer_package(
 
             logging.info('Initialize Transfer: {} -> {}'.format(source, facility))
             print("Transfer info", transfer_info)
-            result = requests.post(
+            result = http_session().post(
                 TRANSFER_ENDPOINT,
                 json=transfer_info,
                 headers=default_headers(),
@@ -12,15 +12,21 @@ import shutil
 import logging
 import tempfile
 import platform
+import threading
 import subprocess
 
 from contextlib import contextmanager
+from multiprocessing.pool import ThreadPool
 
 from . import log
+from .constants import FLAUNCH_WORKERS
 
 PY3 = sys.version_info[0] == 3
 SYSTEM = platform.system()
 
+# Default number of threads for concurrent package work
+DEFAULT_WORKERS = 8
+
 if PY3:
     def _iter(it):
         return it.items()
@@ -75,6 +81,23 @@ def run_(command_and_args, custom_env = {}, verbose = False, build_file = None):
         )
 
 
+def ensure_dir(path):
+    """
+    Make sure a directory exists. Safe to call when other threads or
+    processes may be creating the same directory.
+    :param path: The directory to create
+    :return: str - the path
+    """
+    if not os.path.isdir(path):
+        try:
+            os.makedirs(path)
+        except OSError:
+            # Another thread/process may have beaten us to it
+            if not os.path.isdir(path):
+                raise
+    return path
+
+
 def local_path(package, version=None, base_only=False):
     """
     Based on the package and the local version, build a
@@ -96,8 +119,7 @@ def local_path(package, version=None, base_only=False):
             'apps'
         )
 
-    if not os.path.isdir(base):
-        os.makedirs(base)
+    ensure_dir(base)
 
     if base_only:
         return base
@@ -108,6 +130,75 @@ def local_path(package, version=None, base_only=False):
     return os.path.join(base, package, version).replace('\\', '/')
 
 
+def worker_count():
+    """
+    The number of threads to use when working on packages concurrently.
+    Controlled with the FLAUNCH_WORKERS environment variable.
+    :return: int
+    """
+    try:
+        return max(1, int(os.environ.get(FLAUNCH_WORKERS, DEFAULT_WORKERS)))
+    except ValueError:
+        logging.warning('Invalid {} value, using: {}'.format(
+            FLAUNCH_WORKERS, DEFAULT_WORKERS
+        ))
+        return DEFAULT_WORKERS
+
+
+def human_size(size):
+    """
+    :param size: int number of bytes
+    :return: str - e.g. 12.3 MB
+    """
+    for unit in ('B', 'KB', 'MB', 'GB'):
+        if abs(size) < 1024.0:
+            return '{:.1f} {}'.format(size, unit)
+        size /= 1024.0
+    return '{:.1f} TB'.format(size)
+
+
+class _Raised(object):
+    """
+    An exception raised by a thread_map() worker
+    """
+    def __init__(self, error):
+        self.error = error
+
+
+def thread_map(func, items, workers=None):
+    """
+    Map a function over items using a pool of threads
+    :param func: callable taking a single item
+    :param items: iterable of items to work on
+    :param workers: int number of threads (default worker_count())
+    :return: list of the results in the same order as items
+    :raises: The first exception raised by func, once every item is done
+    """
+    items = list(items)
+    if not items:
+        return []
+
+    def _call(item):
+        try:
+            return func(item)
+        except BaseException as e:
+            # -- The pool only hands back an Exception. Anything else
+            # (e.g. SystemExit) takes the worker down and map() never returns
+            return _Raised(e)
+
+    pool = ThreadPool(min(workers or worker_count(), len(items)))
+    try:
+        results = pool.map(_call, items)
+    finally:
+        pool.close()
+        pool.join()
+
+    for result in results:
+        if isinstance(result, _Raised):
+            raise result.error
+    return results
+
+
 def add_metaclass(metaclass):
     """
     Taken from the six module. Python 2 and 3 compatible.
@@ -233,6 +324,32 @@ def cd(new_directory, cleanup=lambda: True):
         cleanup()
 
 
+@contextmanager
+def atomic_write(path, mode='w'):
+    """
+    Write a file by way of a temporary file that replaces the original
+    once we're done. Other processes never see a half written file.
+    :param path: The file we're writing
+    :param mode: The mode to open the file with ('w' or 'wb')
+    :return: The open file object
+    """
+    temp_path = '{}.{}.{}.tmp'.format(
+        path, os.getpid(), threading.current_thread().ident
+    )
+    try:
+        with open(temp_path, mode) as f:
+            yield f
+        if PY3:
+            os.replace(temp_path, path)
+        else:
+            if os.path.exists(path) and SYSTEM == 'Windows':
+                os.unlink(path)
+            os.rename(temp_path, path)
+    finally:
+        if os.path.exists(temp_path):
+            os.unlink(temp_path)
+
+
 @contextmanager
 def temp_dir(change_dir=True):
     """
@@ -0,0 +1,228 @@
+"""
+Lockfiles hold onto the exact outcome of resolving a launch. Every job
+launched from the same lockfile gets the same package versions without
+walking the requirement graph or asking Atom about it.
+
+.. code-block:: json
+
+    {
+        "format" : 1,
+        "application" : "Helios",
+        "run" : false,
+        "packages" : ["PyFlux"],
+        "entries" : [
+            {
+                "package" : "PyFlux",
+                "requested" : null,
+                "version" : "1.2.0",
+                "uri" : "http://...",
+                "sha256" : "...",
+                "info" : { ... },
+                "base" : null
+            }
+        ],
+        "package_order" : [0],
+        "launch_order" : [0, 1]
+    }
+
+The orders index into the entries as the same package may be shared
+between them. A "base" is the index of the entry that package extends.
+
+The dependency closure that fbuild registers with a released package
+uses this same format.
+"""
+from __future__ import absolute_import
+
+import json
+import logging
+import platform
+
+from common import utils
+from common import communicate
+
+# Bump when the layout of a lockfile changes
+LOCK_FORMAT = 1
+
+# What every entry has to carry for install_locked()
+ENTRY_KEYS = ('package', 'requested', 'version', 'info', 'base')
+
+
+class LockfileError(Exception):
+    """ The lockfile cannot be created or used """
+    pass
+
+
+class Lockfile(object):
+    """
+    Read/write utility for lockfiles
+    """
+    def __init__(self, data):
+        self._data = data
+
+
+    @classmethod
+    def from_resolution(cls, application, packages, run, launch_jsons, resolved_launch):
+        """
+        Build a lockfile from a resolved launch
+        :param application: The application we're launching
+        :param packages: list[str] of the root packages requested
+        :param run: bool - is the application a direct command
+        :param launch_jsons: list[LaunchJson] of the resolved packages
+        :param resolved_launch: list[LaunchJson] of the resolved application
+        :return: Lockfile
+        """
+        entries = []
+        indices = {}
+
+        def _index(lj):
+            if id(lj) in indices:
+                return indices[id(lj)]
+
+            if lj.development:
+                raise LockfileError(
+                    'Cannot lock development package: {}'.format(lj.package)
+                )
+
+            base = _index(lj.base) if lj.base is not None else None
+
+            info = lj.package_info
+            indices[id(lj)] = len(entries)
+            entries.append({
+                'package' : lj.requested_package,
+                'requested' : lj.requested_version,
+                'version' : lj.version_number,
+                'uri' : info.get('uri'),
+                'sha256' : info.get('sha256'),
+                'info' : info,
+                'base' : base
+            })
+            return indices[id(lj)]
+
+        package_order = [_index(lj) for lj in launch_jsons]
+        launch_order = [_index(lj) for lj in resolved_launch]
+
+        return cls({
+            'format' : LOCK_FORMAT,
+            'application' : application,
+            'run' : bool(run),
+            'packages' : list(packages),
+            'facility' : communicate.FLUX_FACILITY,
+            'platform' : platform.system(),
+            'entries' : entries,
+            'package_order' : package_order,
+            'launch_order' : launch_order
+        })
+
+
+    @classmethod
+    def load(cls, path):
+        """
+        Read a lockfile
+        :param path: The path to the lockfile
+        :return: Lockfile
+        """
+        try:
+            with open(path, 'r') as f:
+                data = json.load(f)
+        except (IOError, OSError, ValueError) as e:
+            raise LockfileError('Cannot read lockfile: {} - {}'.format(path, str(e)))
+
+        return cls.from_data(data, path)
+
+
+    @classmethod
+    def from_data(cls, data, source):
+        """
+        Validate lockfile data from somewhere other than our own resolve
+        :param data: dict in the lockfile format
+        :param source: str describing where the data came from
+        :return: Lockfile
+        """
+        if not isinstance(data, dict) or data.get('format') != LOCK_FORMAT:
+            raise LockfileError('Unsupported lockfile: {}'.format(source))
+
+        for key in ('application', 'run', 'packages', 'entries', 'package_order', 'launch_order'):
+            if key not in data:
+                raise LockfileError('Lockfile {} is missing: {}'.format(source, key))
+
+        entries = data['entries']
+        if not isinstance(entries, list):
+            raise LockfileError('Lockfile {} has bad entries'.format(source))
+
+        def _check_index(index, what):
+            if not isinstance(index, int) or isinstance(index, bool) \
+                    or not 0 <= index < len(entries):
+                raise LockfileError('Lockfile {} has a bad {}: {}'.format(source, what, index))
+
+        for entry in entries:
+            if not isinstance(entry, dict):
+                raise LockfileError('Lockfile {} has a bad entry: {}'.format(source, entry))
+            missing = [k for k in ENTRY_KEYS if k not in entry]
+            if missing:
+                raise LockfileError('Lockfile {} entry is missing: {}'.format(
+                    source, ', '.join(missing)
+                ))
+            if entry['base'] is not None:
+                _check_index(entry['base'], 'base')
+
+        for key in ('package_order', 'launch_order'):
+            if not isinstance(data[key], list):
+                raise LockfileError('Lockfile {} has a bad {}'.format(source, key))
+            for index in data[key]:
+                _check_index(index, key)
+
+        if data.get('platform') != platform.system():
+            logging.warning('Lockfile was created on: {}'.format(data.get('platform')))
+
+        return cls(data)
+
+
+    def save(self, path):
+        """
+        Write the lockfile
+        :param path: The path to write to
+        :return: None
+        """
+        with utils.atomic_write(path) as f:
+            json.dump(self._data, f, indent=4, sort_keys=True)
+
+
+    @property
+    def data(self):
+        return self._data
+
+
+    @property
+    def application(self):
+        """ :return: str """
+        return self._data['application']
+
+
+    @property
+    def run(self):
+        """ :return: bool """
+        return self._data['run']
+
+
+    @property
+    def packages(self):
+        """ :return: list[str] of the root packages """
+        return list(self._data['packages'])
+
+
+    @property
+    def entries(self):
+        """ :return: list[dict] """
+        return self._data['entries']
+
+
+    @property
+    def package_order(self):
+        """ :return: list[int] """
+        return list(self._data['package_order'])
+
+
+    @property
+    def launch_order(self):
+        """ :return: list[int] """
+        return list(self._data['launch_order'])
@@ -7,14 +7,26 @@ from __future__ import absolute_import
 import os
 import sys
 import json
+import time
 import shutil
+import platform
 import logging
+import tarfile
+import threading
 import zipfile
 
 from common import log
 from common import utils
 from common import ljson
+from common import storeindex
+from common import filelock
+from common import manifest
+from common import metacache
+from common import objectstore
+from common import peercache
 from common import communicate
+from common.abstract import FLaunchDataError
+from common.constants import FLAUNCH_SHARED_CACHE, FLAUNCH_SHARED_CACHE_MODE, FLAUNCH_NO_DELTA
 
 if utils.PY3:
     import urllib.parse
@@ -23,48 +35,639 @@ else:
     import urllib
     unquote = urllib.unquote
 
-def _download(info, dest, filename):
+# Download the whole archive when more than this share of it changed
+# since the previous version (a delta is many small requests)
+DELTA_MAX_RATIO = 0.5
+
+def _file_source(info):
+    """
+    Locate the archive of a package that's served from a file system
+    :param info: The package information
+    :return: str
+    """
+    path = unquote(info['uri']).replace('file:///', '', 1)
+
+    if path.startswith('file://'):
+        # Probably a UNC path - should probably move to regex
+        path = path.replace('file://', '//', 1)
+
+    if not os.path.exists(path):
+        attempt = '/' + path
+        if not os.path.exists(attempt):
+            logging.critical(
+                ('Cannot download {} - Possible unknown '
+                 'version or missing files!').format(path)
+            )
+            sys.exit(1)
+        path = attempt
+    return path
+
+
+def _previous_install(package, version):
     """
-    Download a package and install it to dest
+    Find the most recently installed version of a package, other than
+    the version given, to base a delta update on
+    :return: str|None - The install location
     """
-    if not os.path.exists(dest):
-        os.makedirs(dest)
-    arch_path = os.path.join(dest, filename)
+    try:
+        installs = storeindex.StoreIndex().versions(package)
+    except storeindex.StoreIndexError:
+        return None
+
+    installs = [i for i in installs if i['version'] != version]
+    if not installs:
+        return None
+    return max(installs, key=lambda i: i['installed'])['path']
+
+
+def _unpack_delta(info, dest, previous, hashes=None):
+    """
+    Install a zip package by taking the files that haven't changed since
+    a previous version from that install, and pulling only the changed
+    members out of the archive with ranged reads. There's no archive to
+    check the sha256 of, so packages with one have to carry a manifest
+    that every file is hashed against instead.
+    :param info: The package information
+    :param dest: The install location
+    :param previous: The install of a previous version
+    :param hashes: dict to add the sha256 of the installed files to
+    :return: int|None - bytes transferred, None if a delta isn't worth it
+    (or possible) and the whole archive should be downloaded instead
+    """
+    if hashes is None:
+        hashes = {}
+    from common import compression
+    try:
+        remote = communicate.RemoteFile(info['uri'])
+        with zipfile.ZipFile(remote) as zfile:
+            has_manifest = manifest.MANIFEST_NAME in zfile.namelist()
+            if info.get('sha256') and not has_manifest:
+                logging.debug('No manifest to check a delta with: {}'.format(info['uri']))
+                return None
+
+            unchanged = compression.unchanged_entries(zfile, previous)
+
+            changed = sum(
+                i.compress_size for i in zfile.infolist() if i.filename not in unchanged
+            )
+            if changed > remote.size * DELTA_MAX_RATIO:
+                logging.debug('Too much changed for a delta: {}'.format(info['uri']))
+                return None
+
+            logging.info('Delta: {} ({} of {} unchanged since: {})'.format(
+                info['uri'], len(unchanged), len(zfile.infolist()), previous
+            ))
+            compression.unzip_delta(zfile, previous, unchanged, dest, hashes)
+
+        if has_manifest:
+            file_manifest = manifest.Manifest.load(dest)
+            if file_manifest is None:
+                raise IOError('Unreadable manifest: {}'.format(info['uri']))
+            problems = file_manifest.verify(dest, full=True, hashes=hashes)
+            if problems:
+                for name, problem in problems:
+                    logging.debug('{}: {}'.format(name, problem))
+                raise IOError('Delta does not match the manifest: {}'.format(info['uri']))
+        return remote.transferred
+
+    except (IOError, OSError, zipfile.BadZipfile) as e:
+        logging.info('Delta failed, downloading everything: {}'.format(str(e)))
+        hashes.clear()
+        shutil.rmtree(dest, ignore_errors=True)
+        utils.ensure_dir(dest)
+        return None
+
+
+def _unpack(info, dest, filename, previous=None, hashes=None):
+    """
+    Get the archive of a package and extract it into dest. Whenever we can,
+    the archive is read where it is - tar archives straight off of the http
+    stream and file archives from their source - rather than writing (and
+    reading back) a copy of it first.
+    :param info: The package information
+    :param dest: The install location
+    :param filename: The name of the archive
+    :param previous: The install of a previous version that zip archives
+    can be delta updated from
+    :param hashes: dict to add the sha256 of the files to, for those that
+    are hashed as they're extracted (zip archives)
+    :return: tuple(int, str|None) - bytes transferred and the sha256 of
+    the archive (when it was downloaded)
+    """
+    from common import compression
+    utils.ensure_dir(dest)
 
     if info['type'] == 'server':
-        communicate.download_file(info['uri'], arch_path)
+        if metacache.is_offline():
+            logging.critical(
+                'Cannot download {} while offline!'.format(info['uri'])
+            )
+            sys.exit(1)
+
+        try:
+            if compression.is_tar(filename):
+                # -- Extracted as it arrives, so a bad archive is only caught
+                # after the fact (and the install removed)
+                with communicate.open_stream(info['uri']) as stream:
+                    compression.untar_stream(stream, dest)
+                    digest = stream.hexdigest()
+                    size = stream.size
+                _verify(info, digest)
+            else:
+                if previous and not os.environ.get(FLAUNCH_NO_DELTA):
+                    size = _unpack_delta(info, dest, previous, hashes)
+                    if size is not None:
+                        # -- Every file was hashed against the manifest
+                        # instead of the archive (see: _unpack_delta())
+                        return size, None
+
+                # -- Zip archives keep their index at the end. These are
+                # downloaded apart from the install so an interrupted
+                # download can resume
+                arch_path = os.path.join(_downloads_dir(), filename)
+                digest = communicate.download_file(
+                    info['uri'], arch_path, sha256=info.get('sha256')
+                )
+                size = os.path.getsize(arch_path)
+                compression.unzip_files(arch_path, output=dest, hashes=hashes)
+                os.unlink(arch_path)
+        except (communicate.DownloadError, tarfile.TarError) as e:
+            logging.critical(str(e))
+            sys.exit(1)
+
+        logging.debug('Downloaded: {} (sha256: {})'.format(filename, digest))
+        return size, digest
+
     elif info['type'] == 'file':
+        path = _file_source(info)
+        logging.debug("Extract: " + path)
+        logging.debug("To: " + dest)
+
+        if compression.is_tar(path):
+            compression.untar_files(path, output=dest)
+        else:
+            compression.unzip_files(path, output=dest, hashes=hashes)
+        return os.path.getsize(path), info.get('sha256')
 
-        path = unquote(info['uri']).replace('file:///', '', 1)
+    return 0, None
 
-        if path.startswith('file://'):
-            # Probably a UNC path - should probably move to regex
-            path = path.replace('file://', '//', 1)
 
-        if not os.path.exists(path):
-            attempt = '/' + path
-            if not os.path.exists(attempt):
-                logging.critical(
-                    ('Cannot download {} - Possible unknown '
-                     'version or missing files!').format(path)
-                )
-                sys.exit(1)
-            path = attempt
+def _downloads_dir():
+    """
+    :return: str - The directory that package archives download into
+    """
+    path = os.path.join(
+        os.path.dirname(utils.local_path(None, None, base_only=True)),
+        'downloads'
+    )
+    utils.ensure_dir(path)
+    return path
+
+
+def _verify(info, digest):
+    """
+    Check a downloaded archive against the checksum Atom has for it
+    :param info: The package information
+    :param digest: str - sha256 hex digest of what we downloaded
+    :return: None
+    """
+    expected = info.get('sha256')
+    if expected and digest != expected.lower():
+        raise communicate.DownloadError(
+            'Checksum mismatch: {} (expected: {}, got: {})'.format(
+                info['uri'], expected, digest
+            )
+        )
+
+
+def _shared_install(package, version):
+    """
+    Look for a package in the shared caches
+    :param package: The name of the package
+    :param version: The version of the package
+    :return: str|None - The install within a shared cache
+    """
+    for root in os.environ.get(FLAUNCH_SHARED_CACHE, '').split(os.pathsep):
+        if not root:
+            continue
+        candidate = os.path.join(root, package, version)
+        if os.path.isfile(os.path.join(candidate, 'launch.json')):
+            return candidate
+    return None
+
+
+def _link_shared(shared, staging):
+    """
+    Bring a package from a shared cache into our local store
+    :param shared: The install within a shared cache
+    :param staging: Where to place it
+    :return: None
+    """
+    mode = os.environ.get(FLAUNCH_SHARED_CACHE_MODE)
+    if not mode:
+        # Links require additional privileges on Windows
+        mode = 'copy' if platform.system() == 'Windows' else 'link'
+
+    if mode == 'link':
+        logging.debug('Link: {}'.format(shared))
+        os.symlink(shared, staging)
+    else:
+        logging.debug('Copy: {}'.format(shared))
+        shutil.copytree(shared, staging, symlinks=True)
+
+
+def _archive_manifest(info):
+    """
+    Read the manifest of a package archive on Atom without downloading it
+    (only the index of the zip and the manifest come over the network)
+    :param info: The package information
+    :return: manifest.Manifest|None - None when the archive has no manifest
+    or can't be read in place
+    """
+    from common import compression
+    if info.get('type') != 'server' or info.get('launch_data') or metacache.is_offline():
+        return None
+    if compression.is_tar(info['uri'].split('/')[-1]):
+        return None # No reading a tar archive in place
+
+    try:
+        with zipfile.ZipFile(communicate.RemoteFile(info['uri'])) as zfile:
+            return manifest.Manifest.from_string(zfile.read(manifest.MANIFEST_NAME))
+    except (KeyError, IOError, OSError, zipfile.BadZipfile) as e:
+        logging.debug('No manifest for: {} - {}'.format(info['uri'], str(e)))
+        return None
+
+
+def _unlisted(file_manifest, path):
+    """
+    :return: list[str] - Files (and links) under path that the manifest
+    doesn't have
+    """
+    unlisted = []
+    for directory, dirs, names in os.walk(path):
+        for name in names + [d for d in dirs if os.path.islink(os.path.join(directory, d))]:
+            relative = os.path.relpath(os.path.join(directory, name), path).replace('\\', '/')
+            if relative != manifest.MANIFEST_NAME and relative not in file_manifest.files:
+                unlisted.append(relative)
+    return unlisted
+
+
+def _from_peer(package, info, staging, hashes=None):
+    """
+    Try to get a package from a node on the LAN rather than Atom. Anyone
+    on the LAN can answer, so every file a peer sends is hashed and checked
+    against the manifest of the archive on Atom. Packages without one are
+    never taken from a peer.
+    :param package: The name of the package
+    :param info: The package information
+    :param staging: Where to place it
+    :param hashes: dict to add the sha256 of the files to
+    :return: int|None - bytes transferred, None if no peer provided it
+    """
+    if hashes is None:
+        hashes = {}
+
+    url = peercache.find_peer(package, info['version'])
+    if url is None:
+        return None
+
+    # -- Only worth asking Atom once someone has it
+    trusted = _archive_manifest(info)
+    if trusted is None:
+        return None
+
+    from common import compression
+    try:
+        with communicate.open_stream(url) as stream:
+            compression.untar_stream(stream, staging)
+
+        marker = os.path.join(staging, peercache.COMPLETE_MARKER)
+        if not os.path.isfile(marker):
+            raise communicate.DownloadError('Incomplete transfer: {}'.format(url))
+        os.remove(marker)
+
+        problems = trusted.verify(staging, full=True, hashes=hashes)
+        for name in _unlisted(trusted, staging):
+            problems.append((name, 'not in the package'))
+        if problems:
+            for name, problem in problems:
+                logging.debug('{}: {}'.format(name, problem))
+            raise communicate.DownloadError('Does not match the package: {}'.format(url))
+
+        # -- The manifest is Atom's from here on, not the peer's
+        with open(os.path.join(staging, manifest.MANIFEST_NAME), 'w') as f:
+            f.write(trusted.to_string())
+        return stream.size
+
+    except (IOError, OSError, tarfile.TarError) as e:
+        logging.warning('Could not get {} from peer: {}'.format(package, str(e)))
+        hashes.clear()
+        shutil.rmtree(staging, ignore_errors=True)
+        return None
+
+
+_INSTALLS_LOCK = threading.Lock()
+_INSTALLS = []
+
+def _record_install(package, version, source, size, seconds):
+    """
+    Keep track of what we've installed (see: pop_installs())
+    """
+    logging.debug('Installed: {}/{} from {} ({} in {:.2f}s)'.format(
+        package, version, source, utils.human_size(size), seconds
+    ))
+    with _INSTALLS_LOCK:
+        _INSTALLS.append({
+            'package' : package,
+            'version' : version,
+            'source' : source,
+            'bytes' : size,
+            'seconds' : seconds
+        })
+
+
+def pop_installs():
+    """
+    Get the packages installed since the last time this was called
+    :return: list[dict] with keys: package, version, source, bytes, seconds
+    """
+    with _INSTALLS_LOCK:
+        installs = list(_INSTALLS)
+        del _INSTALLS[:]
+    return installs
+
+
+def _index_install(package, version, path, digest=None, replace=True):
+    """
+    Add an install to the store index. The index catches up on its own
+    (see: _is_installed()) so failing to do so isn't the end of the world.
+    :return: None
+    """
+    try:
+        storeindex.StoreIndex().add(package, version, path, digest, replace)
+    except storeindex.StoreIndexError as e:
+        logging.warning('Could not index install: {} - {}'.format(path, str(e)))
+
+
+def _is_installed(package, version, path):
+    """
+    Check if a package is installed. The store index is trusted when it
+    has the install, the store is only looked at when it doesn't (see
+    _load_launch_json() for installs removed behind its back).
+    :param package: The name of the package
+    :param version: The version of the package
+    :param path: The install location
+    :return: bool
+    """
+    try:
+        install = storeindex.StoreIndex().lookup(package, version)
+        if install is not None and install['path'] == path:
+            return True
+    except storeindex.StoreIndexError as e:
+        logging.debug('Store index unavailable: {}'.format(str(e)))
+        install = None
+
+    installed = os.path.isfile(os.path.join(path, 'launch.json'))
+    if installed and install is None:
+        # -- Installed without the index knowing about it (yet)
+        _index_install(package, version, path, replace=False)
+    return installed
+
+
+def _forget_install(path):
+    """
+    Drop an install that's gone from the store index
+    :return: None
+    """
+    logging.debug('Install missing: {}'.format(path))
+    try:
+        with storeindex.StoreIndex().removing(path):
+            pass
+    except storeindex.StoreIndexError as e:
+        logging.debug('Store index unavailable: {}'.format(str(e)))
+
+
+def _validate(package, path, hashes=None):
+    """
+    Check a freshly unpacked package. Packages built with a manifest have
+    every file hashed and checked against it (the modification times are
+    the manifest's from here on). A shared cache that's linked to is only
+    checked with a stat of each file.
+    :param package: The name of the package
+    :param path: The unpacked package
+    :param hashes: dict - relative path -> sha256 of the files that were
+    hashed as they were extracted (they aren't read again)
+    :return: dict|None - relative path -> sha256 of the files (checked
+    against what's on disk)
+    """
+    if not os.path.isfile(os.path.join(path, 'launch.json')):
+        logging.critical(
+            'Launch file not found! Invalid package: "{}"'.format(package)
+        )
+        sys.exit(1)
+
+    linked = os.path.islink(path)
+    file_manifest = manifest.Manifest.load(path)
+    if file_manifest is None:
+        return None if linked else hashes
+
+    if not linked:
+        file_manifest.apply_times(path) # Never touch a shared cache
+
+    problems = file_manifest.verify(path, full=not linked, hashes=hashes)
+    if problems:
+        for name, problem in problems:
+            logging.error('{}: {}'.format(name, problem))
+        logging.critical(
+            'Files do not match the manifest! Invalid package: "{}"'.format(package)
+        )
+        sys.exit(1)
+
+    return None if linked else file_manifest.hashes()
+
+
+def verify_package(package, full=False):
+    """
+    Check the installs of a package against their manifests
+    :param package: The name of the package (with an optional /version)
+    :param full: Hash every file rather than only those that look changed
+    :return: bool - True when every install checks out
+    """
+    package, version = _get_package_and_version(package)
+    installs = storeindex.StoreIndex().versions(package)
+    if version:
+        installs = [i for i in installs if i['version'] == version]
+    if not installs:
+        logging.error('Not installed: {}'.format(package))
+        return False
+
+    ok = True
+    for install in installs:
+        file_manifest = manifest.Manifest.load(install['path'])
+        if file_manifest is None:
+            print ('{}/{}: no manifest'.format(package, install['version']))
+            continue
 
-        logging.debug("Copy: " + path)
-        logging.debug("To: " + arch_path)
-        shutil.copy2(path, arch_path)
+        problems = file_manifest.verify(install['path'], full=full)
+        for name, problem in problems:
+            print ('{}/{}: {} ({})'.format(package, install['version'], name, problem))
+        if problems:
+            ok = False
+        else:
+            print ('{}/{}: OK'.format(package, install['version']))
+    return ok
 
 
-def _extract(zipfile_path):
+def _install(package, info, path):
     """
-    Unzip a file
-    :param zipfile_path: The path to a .zip file that we're unloading
+    Install a package into path. Only one process (or thread) installs a
+    given version at a time, the others wait on the lock and then use what
+    it installed. Everything is unpacked into a staging directory and then
+    renamed into place so path only ever holds a complete install.
+    :param package: The name of the package
+    :param info: The package information
+    :param path: The install location
     :return: None
     """
+    launch_json = os.path.join(path, 'launch.json')
+
+    with filelock.FileLock(path + '.lock'):
+        if os.path.isfile(launch_json):
+            logging.debug('Installed by another process: {}'.format(path))
+            return
+
+        staging = '{}.{}.{}.tmp'.format(
+            path, os.getpid(), threading.current_thread().ident
+        )
+        start = time.time()
+        size = 0
+        digest = info.get('sha256')
+        hashes = {}
+        try:
+            shared = _shared_install(package, info['version'])
+
+            if shared:
+                source = 'shared'
+                _link_shared(shared, staging)
+
+            # -- Do one additional check to see if this is a composed package
+            # that we simply place into our local_path by building the launch
+            # json to match
+            elif info.get('launch_data'):
+                source = 'composed'
+                utils.ensure_dir(staging)
+                with open(os.path.join(staging, 'launch.json'), 'w') as f:
+                    json.dump(info['launch_data'], f)
+
+            else:
+                source = 'peer'
+                size = _from_peer(package, info, staging, hashes)
+                if size is None:
+                    source = 'atom' if info['type'] == 'server' else info['type']
+                    filename = info['uri'].split('/')[-1]
+                    size, digest = _unpack(
+                        info, staging, filename,
+                        previous=_previous_install(package, info['version']),
+                        hashes=hashes
+                    )
+
+            # -- Archives are checked as they're extracted (crc32 or sha256)
+            # and the files hashed against the manifest, when there is one
+            objectstore.dedupe(staging, _validate(package, staging, hashes))
+
+            # -- Left over from an install that never completed
+            if os.path.islink(path):
+                os.unlink(path)
+            elif os.path.isdir(path):
+                shutil.rmtree(path)
+            os.rename(staging, path)
+            _index_install(package, info['version'], path, digest)
+
+            _record_install(
+                package, info['version'], source, size, time.time() - start
+            )
+
+        except BaseException:
+            # -- Never leave a partial install behind
+            if os.path.islink(staging):
+                os.unlink(staging)
+            else:
+                shutil.rmtree(staging, ignore_errors=True)
+            raise
+
+
+def _read_launch_json(package, info, root):
+    """
+    Get the launch.json of a package without installing it (e.g. to
+    resolve a dependency closure on a machine that never runs it). Zip
+    archives are read in place, only the index and launch.json come over
+    the network.
+    :param package: The name of the package
+    :param info: The package information
+    :param root: Directory to write the launch.json under
+    :return: str - The launch.json
+    """
     from common import compression
-    compression.unzip_files(zipfile_path, output=os.path.dirname(zipfile_path))
 
+    shared = _shared_install(package, info['version'])
+    if shared:
+        return os.path.join(shared, 'launch.json')
+
+    dest = utils.ensure_dir(os.path.join(root, package, info['version']))
+    launch_json = os.path.join(dest, 'launch.json')
+
+    if info.get('launch_data'):
+        with open(launch_json, 'w') as f:
+            json.dump(info['launch_data'], f)
+        return launch_json
+
+    filename = info['uri'].split('/')[-1]
+    try:
+        if info['type'] == 'file':
+            path = _file_source(info)
+            if compression.is_tar(path):
+                compression.untar_files(path, output=dest)
+            else:
+                compression.unzip_files(path, files=['launch.json'], output=dest)
+
+        elif metacache.is_offline():
+            logging.critical('Cannot download {} while offline!'.format(info['uri']))
+            sys.exit(1)
+
+        elif compression.is_tar(filename):
+            # -- Only read from the start, so there's no skipping ahead
+            with communicate.open_stream(info['uri']) as stream:
+                compression.untar_stream(stream, dest)
+
+        else:
+            try:
+                archive = communicate.RemoteFile(info['uri'])
+            except communicate.DownloadError:
+                archive = os.path.join(dest, filename)
+                communicate.download_file(info['uri'], archive, sha256=info.get('sha256'))
+            with zipfile.ZipFile(archive) as zfile:
+                with open(launch_json, 'wb') as f:
+                    f.write(zfile.read('launch.json'))
+
+    except (KeyError, IOError, OSError, zipfile.BadZipfile,
+            tarfile.TarError, communicate.DownloadError) as e:
+        logging.critical('Cannot read the launch.json of: {}/{} - {}'.format(
+            package, info['version'], str(e)
+        ))
+        sys.exit(1)
+
+    if not os.path.isfile(launch_json):
+        logging.critical('No launch.json in: {}/{}'.format(package, info['version']))
+        sys.exit(1)
+    return launch_json
+
+
+def _is_dev(version):
+    """
+    :param version: The version of a package (None for highest)
+    :return: bool - is this a development package
+    """
+    return bool(os.environ.get('FLAUNCH_ALL_DEV', version == 'dev'))
 
 
 def _get_package_and_version(package):
@@ -86,19 +689,23 @@ def _get_package_and_version(package):
     return (package, version)
 
 
-def _get_package(package, version=None, info=None, builds=[], force=False):
+def _install_package(package, version=None, info=None, builds=[], force=False,
+                     metadata=None):
     """
-    Get a particular package
+    Make sure a particular package is available locally, downloading it
+    if required
     :param package: The name of the package as atom knows it (case insenitive)
     :param version: The version of the package that we're looking for (None for highest)
     :param info: The information block that we use intead of the one coming from atom
     :param builds: locations to search for development builds
     :param force: Boolean - should we redownload pacakges that we already have installed?
-    :return ljson.LaunchJson() instance
+    :param metadata: Directory to read the launch.json of a package that
+    isn't installed into, rather than installing it
+    :return: tuple(str, dict, bool) -> (launch.json path, info, is development)
     """
     logging.debug("Package version: " + (version if version else '<highest>'))
 
-    is_dev = bool(os.environ.get('FLAUNCH_ALL_DEV', version == 'dev'))
+    is_dev = _is_dev(version)
 
     if is_dev:
         info = {
@@ -167,45 +774,203 @@ def _get_package(package, version=None, info=None, builds=[], force=False):
         launch_json = os.path.join(path, 'launch.json')
 
     if not is_dev:
-        if not os.path.isfile(launch_json):
-
-            # -- Do one additional check to see if this is a composed package
-            # that we simply place into our local_path by building the launch
-            # json to match
-            if info.get('launch_data'):
-                if not os.path.isdir(os.path.dirname(launch_json)):
-                    os.makedirs(os.path.dirname(launch_json))
-
-                with open(launch_json, 'w') as f:
-                    json.dump(info['launch_data'], f)
-
+        if not _is_installed(package, info['version'], path):
+            if metadata is not None:
+                launch_json = _read_launch_json(package, info, metadata)
             else:
-                filename = info['uri'].split('/')[-1]
+                _install(package, info, path)
 
-                # -- Get the package
-                _download(info, path, filename)
+    return launch_json, info, is_dev
 
-                # -- Unzip it, cleaning up as we go
-                arch = os.path.join(path, filename)
-                _extract(arch)
-                os.unlink(arch)
 
-            # -- Basic validation
-            if not os.path.isfile(launch_json):
-                logging.critical(
-                    'Launch file not found! Invalid package: "{}"'\
-                    .format(package)
-                )
+def _load_launch_json(package, launch_json, info, is_dev, requested=None, metadata=None):
+    """
+    Build the LaunchJson for an installed package. An install the store
+    index had but that's gone from disk is installed again.
+    :param requested: The version that was asked for (None for highest)
+    :param metadata: See _install_package()
+    :return: ljson.LaunchJson() instance
+    """
+    try:
+        lj = ljson.LaunchJson(package, launch_json, development=is_dev)
+    except FLaunchDataError:
+        if is_dev or os.path.isfile(launch_json):
+            raise
+
+        path = os.path.dirname(launch_json)
+        _forget_install(path)
+        if metadata is not None:
+            launch_json = _read_launch_json(package, info, metadata)
+        else:
+            _install(package, info, path)
+        lj = ljson.LaunchJson(package, launch_json, development=is_dev)
 
-    lj = ljson.LaunchJson(package, launch_json, development=is_dev)
     lj.version_number = info['version']
+    lj.requested_package = package
+    lj.requested_version = requested
+    lj.package_info = info
     return lj
 
 
-def resolve_packages(package_list, retrieved, builds=[], all_ljsons=None, launching=False):
+def _get_package(package, version=None, info=None, builds=[], force=False, metadata=None):
+    """
+    Get a particular package
+    :param package: The name of the package as atom knows it (case insenitive)
+    :param version: The version of the package that we're looking for (None for highest)
+    :param info: The information block that we use intead of the one coming from atom
+    :param builds: locations to search for development builds
+    :param force: Boolean - should we redownload pacakges that we already have installed?
+    :param metadata: See _install_package()
+    :return ljson.LaunchJson() instance
+    """
+    launch_json, info, is_dev = _install_package(
+        package, version, info=info, builds=builds, force=force, metadata=metadata
+    )
+    return _load_launch_json(package, launch_json, info, is_dev, version, metadata)
+
+
+class PackagePrefetcher(object):
+    """
+    Walk the requirement graph of a set of packages breadth-first, fetching
+    and installing each level with a pool of workers.
+
+    This does not decide the package order. resolve_packages() still walks
+    the graph depth-first to keep the env expansion order intact, but pulls
+    from what we've already installed rather than doing a round trip per
+    package.
+    """
+    def __init__(self, builds=[], workers=None, metadata=None):
+        """
+        :param builds: locations to search for development builds
+        :param workers: int number of threads (default worker_count())
+        :param metadata: Only read the launch.json of packages that aren't
+        installed, into this directory (see: _install_package())
+        """
+        self._builds = builds
+        self._workers = workers or utils.worker_count()
+        self._metadata = metadata
+
+        # (package, version) -> (launch.json, info, is_dev) | Exception
+        self._installed = {}
+
+
+    def _fetch(self, task):
+        """
+        Install a single package and report what it needs
+        :param task: tuple(str, str, bool, dict) -> (package, version,
+        launching, info)
+        :return: list[str] of package strings this package requires
+        """
+        package, version, launching, info = task
+        try:
+            if info is None and not _is_dev(version):
+                # -- Atom doesn't know about this package (already reported)
+                sys.exit(1)
+
+            installed = _install_package(
+                package, version, info=info, builds=self._builds,
+                metadata=self._metadata
+            )
+            self._installed[(package, version)] = installed
+            current_launch = _load_launch_json(
+                package, *installed, requested=version, metadata=self._metadata
+            )
+        except BaseException as e:
+            # Raised again when resolve_packages() asks for this package
+            self._installed[(package, version)] = e
+            return []
+
+        if launching:
+            requirements = list(current_launch.standalone_requires())
+        else:
+            requirements = list(current_launch.requires())
+
+        if current_launch.extends():
+            requirements.append(current_launch.extends())
+        return requirements
+
+
+    def prefetch(self, package_list, retrieved, launching=False):
+        """
+        Install the full requirement graph of the packages, one level
+        at a time.
+        :param package_list: list[str] of root package strings
+        :param retrieved: set of packages that are already resolved
+        :param launching: Are the root packages being launched?
+        :return: None
+        """
+        resolved = set(_get_package_and_version(p)[0] for p in retrieved)
+        seen = set()
+
+        def _level(packages, launching):
+            # -- Which version of a package wins is up to the depth-first
+            # walk of resolve_packages(), a level by level walk can't tell.
+            # Every version asked for is fetched so the winner is always
+            # among them.
+            tasks = []
+            for package in packages:
+                package, version = _get_package_and_version(package)
+                if package in resolved or (package, version) in seen:
+                    continue
+                seen.add((package, version))
+                tasks.append((package, version, launching))
+            return tasks
+
+        def _with_info(tasks):
+            # -- One request to Atom for the whole level
+            lookups = [(p, v) for p, v, _ in tasks if not _is_dev(v)]
+            infos = dict(zip(lookups, communicate.get_packages_info(lookups)))
+            return [(p, v, l, infos.get((p, v))) for p, v, l in tasks]
+
+        tasks = _level(package_list, launching)
+        while tasks:
+            logging.debug('Prefetch: {}'.format(
+                ', '.join(t[0] for t in tasks)
+            ))
+            results = utils.thread_map(
+                self._fetch, _with_info(tasks), workers=self._workers
+            )
+
+            requirements = []
+            for result in results:
+                requirements.extend(result)
+            tasks = _level(requirements, False)
+
+
+    def get_package(self, package, version=None):
+        """
+        Obtain the LaunchJson of a package, installing it now if it wasn't
+        part of the prefetch
+        :return: ljson.LaunchJson() instance
+        """
+        installed = self._installed.get((package, version))
+        if installed is None:
+            return _get_package(
+                package, version, builds=self._builds, metadata=self._metadata
+            )
+
+        if isinstance(installed, BaseException):
+            raise installed
+
+        return _load_launch_json(
+            package, *installed, requested=version, metadata=self._metadata
+        )
+
+
+
+def resolve_packages(package_list, retrieved, builds=[], all_ljsons=None,
+                     launching=False, prefetcher=None, metadata=None):
     """
     Given a set of packages, unwrap the requirements
+    :param prefetcher: PackagePrefetcher that has already installed the
+    requirement graph (one is created for the top level call)
+    :param metadata: Resolve without installing anything, reading the
+    launch.json of packages into this directory instead
     """
+    if prefetcher is None:
+        prefetcher = PackagePrefetcher(builds, metadata=metadata)
+        prefetcher.prefetch(package_list, retrieved, launching=launching)
+
     package_order = []
 
     if all_ljsons is None:
@@ -239,7 +1004,7 @@ def resolve_packages(package_list, retrieved, builds=[], all_ljsons=None, launch
 
             continue
 
-        current_launch = _get_package(package, version, builds=builds)
+        current_launch = prefetcher.get_package(package, version)
         if main_package is None:
             main_package = current_launch
 
@@ -287,7 +1052,8 @@ def resolve_packages(package_list, retrieved, builds=[], all_ljsons=None, launch
             else:
                 # This will resolve the packages we need
                 base_and_required = resolve_packages(
-                    [extends], retrieved, builds=builds, all_ljsons=all_ljsons
+                    [extends], retrieved, builds=builds, all_ljsons=all_ljsons,
+                    prefetcher=prefetcher
                 )
                 base = base_and_required[-1]
                 current_launch.set_base(base)
@@ -297,7 +1063,8 @@ def resolve_packages(package_list, retrieved, builds=[], all_ljsons=None, launch
 
                 additional_resolved = base_and_required[:-1]
 
-        order = resolve_packages(to_retrieve, retrieved, builds=builds, all_ljsons=all_ljsons)
+        order = resolve_packages(to_retrieve, retrieved, builds=builds,
+                                 all_ljsons=all_ljsons, prefetcher=prefetcher)
         order.extend(additional_resolved)
 
         # -- Important! Make sure we sort the packages by "I need to load
@@ -310,6 +1077,111 @@ def resolve_packages(package_list, retrieved, builds=[], all_ljsons=None, launch
     return package_order
 
 
+def resolve_application(application, packages, builds=[], all_ljsons=None, metadata=None):
+    """
+    Resolve a launchable package, taking care of any dependencies that
+    it swaps out for others
+    :param application: The package string of the application
+    :param packages: set of packages that are already resolved
+    :param builds: locations to search for development builds
+    :param all_ljsons: list[LaunchJson] of the packages already resolved
+    :param metadata: See resolve_packages()
+    :return: list[ljson.LaunchJson] - the application is always last
+    """
+    if all_ljsons is None:
+        all_ljsons = []
+
+    resolved_launch = resolve_packages(
+        [application], packages,
+        builds=builds,
+        all_ljsons=all_ljsons,
+        launching=True,
+        metadata=metadata
+    )
+
+    # -- Swappable dependency management
+    this_app = resolved_launch[-1]
+    for swap_from, swap_to in this_app.swap():
+        all_packages = [lj.package for lj in resolved_launch]
+
+        index = -1
+        if swap_from in all_packages:
+            index = all_packages.index(swap_from)
+            resolved_launch.pop(index)
+
+        if swap_to in all_packages:
+            continue
+        else:
+            packages = resolve_packages(
+                [swap_to], packages,
+                builds=builds,
+                all_ljsons=all_ljsons,
+                metadata=metadata
+            )
+            for lj in packages:
+                if lj.package not in all_packages:
+                    resolved_launch.insert(index, lj)
+                    index += 1
+
+    return resolved_launch
+
+
+def closure_is_current(entries):
+    """
+    A closure holds the versions that were highest when it was created.
+    Check that the packages without a specific version still resolve to
+    the same thing (one request to Atom, if any).
+    :param entries: list[dict] of closure entries
+    :return: bool
+    """
+    floating = [e for e in entries if not e['requested']]
+    infos = communicate.get_packages_info([(e['package'], None) for e in floating])
+    for entry, info in zip(floating, infos):
+        if info is None or info.get('version') != entry['version']:
+            logging.debug('Closure out of date: {} ({})'.format(
+                entry['package'], entry['version']
+            ))
+            return False
+    return True
+
+
+def install_locked(entries, builds=[]):
+    """
+    Install the packages of a lockfile concurrently, skipping resolution
+    entirely
+    :param entries: list[dict] of lockfile entries
+    :param builds: locations to search for development builds
+    :return: list[ljson.LaunchJson] matching the entries
+    """
+    def _install(entry):
+        try:
+            return _install_package(
+                entry['package'], entry['version'],
+                info=entry['info'], builds=builds
+            )
+        except BaseException as e:
+            return e
+
+    installed = utils.thread_map(_install, entries)
+    for result in installed:
+        if isinstance(result, BaseException):
+            raise result
+
+    launch_jsons = [None] * len(entries)
+    def _build(index):
+        if launch_jsons[index] is None:
+            entry = entries[index]
+            lj = _load_launch_json(
+                entry['package'], *installed[index], requested=entry['requested']
+            )
+            if entry['base'] is not None:
+                lj.set_base(_build(entry['base']))
+            launch_jsons[index] = lj
+        return launch_jsons[index]
+
+    return [_build(i) for i in range(len(entries))]
+
+
 def resolve_exec(ljson, env, arguments):
     """
     With a LaunchJson instance, we resolve the executable path
@@ -391,15 +1263,13 @@ def print_path(package, show_all_versions=False):
     """
     package, version = _get_package_and_version(package)
 
-    root_pkg_path = utils.local_path(package)
-    if not os.path.isdir(root_pkg_path):
+    if show_all_versions:
+        for install in storeindex.StoreIndex().versions(package):
+            print (install['path'])
         return
 
-    if show_all_versions:
-        for ver in os.listdir(root_pkg_path):
-            if os.path.exists(os.path.join(root_pkg_path, ver, 'launch.json')):
-                print (os.path.join(root_pkg_path, ver).replace('\\','/'))
-    else:
+    root_pkg_path = utils.local_path(package)
+    if os.path.isdir(root_pkg_path):
         print (root_pkg_path)
 
 
@@ -412,8 +1282,19 @@ def clear_package(package):
     if package == 'ALL_PACKAGES':
         logging.debug('Cleaning: {} - Reset Repository'.format(package))
         root_pkg_path = utils.local_path(package, None, base_only=True)
+        package = None
     else:
         logging.debug('Cleaning: {}'.format(package))
         root_pkg_path = utils.local_path(package)
-    if os.path.exists(root_pkg_path):
-        shutil.rmtree(root_pkg_path)
+
+    try:
+        if os.path.exists(root_pkg_path):
+            shutil.rmtree(root_pkg_path)
+    finally:
+        # -- Even a partial clear leaves nothing we could launch
+        try:
+            storeindex.StoreIndex().remove_package(package)
+        except storeindex.StoreIndexError as e:
+            # -- Installs it still has are dropped once they're missed
+            logging.warning('Could not update the store index: {}'.format(str(e)))
+        objectstore.prune()
@@ -0,0 +1,294 @@
+"""
+Cache of resolved launches. Relaunching the same tool with the same
+packages ends in the same command and environment, so we hold onto
+the result and skip resolving the package graph when nothing it was
+built from has changed.
+"""
+from __future__ import absolute_import
+
+import os
+import json
+import hashlib
+import logging
+import platform
+
+from common import utils
+from common import communicate
+from common.abstract import _AbstractFLaunchData
+
+# Bump when the layout of a plan changes
+PLAN_FORMAT = 2
+
+
+def _hash(value):
+    """
+    :return: str - hex digest of a string
+    """
+    return hashlib.sha1(value.encode('utf-8')).hexdigest()
+
+
+def plan_key(args, build_locations):
+    """
+    Build the cache key for a launch request
+    :param args: The launch arguments
+    :param build_locations: list[str] of development build locations
+    :return: str
+    """
+    return _hash(json.dumps({
+        'format' : PLAN_FORMAT,
+        'packages' : args.package or [],
+        'application' : args.application,
+        'run' : bool(args.run),
+        'arguments' : args.app_args or [],
+        'builds' : build_locations or [],
+        'facility' : communicate.FLUX_FACILITY,
+        'platform' : platform.system()
+    }, sort_keys=True))
+
+
+def _strings(data):
+    """
+    Every string within a json-like structure (keys included)
+    """
+    if isinstance(data, dict):
+        for key, value in utils._iter(data):
+            for s in _strings(key):
+                yield s
+            for s in _strings(value):
+                yield s
+    elif isinstance(data, (list, tuple)):
+        for value in data:
+            for s in _strings(value):
+                yield s
+    elif isinstance(data, utils.string_types):
+        yield data
+
+
+def referenced_variables(launch_jsons):
+    """
+    Find the variables that a set of launch.json files may expand
+    :param launch_jsons: list[LaunchJson]
+    :return: set(str)
+    """
+    found = set()
+    for lj in launch_jsons:
+        for value in _strings(lj._data.to_dict()):
+            for match in _AbstractFLaunchData.SEARCH_REGEX.findall(value):
+                variable = match.strip('{}').split('|')[0].split(':')[0]
+                if variable.endswith('...'):
+                    variable = variable[:-3]
+                found.add(variable)
+                found.add(variable.upper())
+    return found
+
+
+def _all_launch_jsons(launch_jsons):
+    """
+    Every LaunchJson involved, including the packages others extend
+    :return: list[LaunchJson]
+    """
+    output = []
+    seen = set()
+    for lj in launch_jsons:
+        while lj is not None and id(lj) not in seen:
+            seen.add(id(lj))
+            output.append(lj)
+            lj = lj.base
+    return output
+
+
+class LaunchPlan(object):
+    """
+    The outcome of resolving a launch: the command(s) to run, the changes
+    made to the environment, and what we need to verify before trusting
+    it again.
+    """
+    def __init__(self, data):
+        self._data = data
+
+
+    @classmethod
+    def build(cls, launch_jsons, base_env, env, command, bootstrap):
+        """
+        Construct a plan from a launch we've just resolved
+        :param launch_jsons: list[LaunchJson] of all packages in play
+        :param base_env: dict of the environment before we started
+        :param env: dict of the environment we're launching with
+        :param command: list[str] of the full command
+        :param bootstrap: list[str] of bootstrap commands
+        :return: LaunchPlan|None - None when this launch can't be cached
+        """
+        all_ljsons = _all_launch_jsons(launch_jsons)
+        if any(lj.development for lj in all_ljsons):
+            return None # Development packages change under us
+
+        packages = []
+        for lj in all_ljsons:
+            stat = os.stat(lj.source_path)
+            packages.append({
+                'package' : lj.package,
+                'requested' : getattr(lj, 'requested_version', None),
+                'version' : getattr(lj, 'version_number', None),
+                'path' : lj.source_path,
+                'mtime' : stat.st_mtime,
+                'size' : stat.st_size
+            })
+
+        delta = dict((k, v) for k, v in utils._iter(env) if base_env.get(k) != v)
+        unset = sorted(k for k in base_env if k not in env)
+
+        inputs = {}
+        for variable in referenced_variables(all_ljsons) | set(delta) | set(unset):
+            value = base_env.get(variable)
+            inputs[variable] = None if value is None else _hash(value)
+
+        return cls({
+            'format' : PLAN_FORMAT,
+            'packages' : packages,
+            'inputs' : inputs,
+            'env' : delta,
+            'unset' : unset,
+            'command' : command,
+            'bootstrap' : bootstrap
+        })
+
+
+    @property
+    def data(self):
+        return self._data
+
+
+    @property
+    def command(self):
+        """ :return: list[str] """
+        return list(self._data['command'])
+
+
+    @property
+    def bootstrap(self):
+        """ :return: list[str] """
+        return list(self._data['bootstrap'])
+
+
+    @property
+    def install_paths(self):
+        """ :return: list[str] of the installs this plan launches from """
+        return sorted(set(
+            os.path.dirname(p['path']).replace('\\', '/') for p in self._data['packages']
+        ))
+
+
+    def environment(self, base_env):
+        """
+        :param base_env: dict of the current environment
+        :return: dict - The environment to launch with
+        """
+        env = dict(base_env)
+        env.update(self._data['env'])
+        for variable in self._data['unset']:
+            env.pop(variable, None)
+        return env
+
+
+    def is_valid(self, base_env):
+        """
+        Check that everything this plan was built from is unchanged
+        :param base_env: dict of the current environment
+        :return: bool
+        """
+        if self._data.get('format') != PLAN_FORMAT:
+            return False
+
+        for variable, value_hash in utils._iter(self._data['inputs']):
+            value = base_env.get(variable)
+            if (None if value is None else _hash(value)) != value_hash:
+                logging.debug('Plan input changed: {}'.format(variable))
+                return False
+
+        for package in self._data['packages']:
+            try:
+                stat = os.stat(package['path'])
+            except OSError:
+                logging.debug('Plan package missing: {}'.format(package['path']))
+                return False
+            if stat.st_mtime != package['mtime'] or stat.st_size != package['size']:
+                logging.debug('Plan package changed: {}'.format(package['path']))
+                return False
+
+        # -- Packages without a specific version may have a newer one by
+        # now. This is answered by the metadata cache when it's fresh.
+        floating = [p for p in self._data['packages'] if not p['requested']]
+        infos = communicate.get_packages_info(
+            [(p['package'], None) for p in floating]
+        )
+        for package, info in zip(floating, infos):
+            if info is None or info.get('version') != package['version']:
+                logging.debug('Plan package version changed: {}'.format(
+                    package['package']
+                ))
+                return False
+
+        return True
+
+
+class PlanCache(object):
+    """
+    Launch plans on disk, one json file per key
+    """
+    def __init__(self, root=None):
+        if root is None:
+            root = os.path.join(
+                os.path.dirname(utils.local_path(None, None, base_only=True)),
+                'plans'
+            )
+        self._root = root
+
+
+    def _path(self, key):
+        return os.path.join(self._root, key + '.json')
+
+
+    def get(self, key, base_env):
+        """
+        Get a plan that's still valid for this environment
+        :param key: str from plan_key()
+        :param base_env: dict of the current environment
+        :return: LaunchPlan|None
+        """
+        path = self._path(key)
+        if not os.path.isfile(path):
+            return None
+
+        try:
+            with open(path, 'r') as f:
+                plan = LaunchPlan(json.load(f))
+        except Exception as e:
+            logging.debug('Bad launch plan: {} - {}'.format(path, str(e)))
+            return None
+
+        try:
+            if not plan.is_valid(base_env):
+                return None
+        except (KeyError, TypeError) as e:
+            logging.debug('Bad launch plan: {} - {}'.format(path, str(e)))
+            return None
+
+        return plan
+
+
+    def put(self, key, plan):
+        """
+        Store a plan
+        :param key: str from plan_key()
+        :param plan: LaunchPlan
+        :return: None
+        """
+        path = self._path(key)
+        try:
+            utils.ensure_dir(self._root)
+            with utils.atomic_write(path) as f:
+                json.dump(plan.data, f)
+        except (IOError, OSError) as e:
+            logging.debug('Could not write launch plan: {} - {}'.format(
+                path, str(e)
+            ))
@@ -7,6 +7,7 @@ __version__ = "1.0.0"
 
 import os
 import sys
+import time
 import platform
 import logging
 import argparse
@@ -16,10 +17,15 @@ sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 from common import log
 from common import utils
+from common import appstore
 from common import communicate
+from common import peercache
+from common import storeindex
 from common.constants import *
 
 import pkgrep
+import lockfile
+import plancache
 
 PACKAGE_SPLIT = ':'
 
@@ -84,13 +90,7 @@ def _prep_launch_jsons(args, env=None):
         for pkglist in args.package:
             root_packages.extend(pkglist.split(PACKAGE_SPLIT))
 
-    #
-    # Possible locations that development builds might be located
-    #
-    build_locations = os.environ.get(FLAUNCH_BUILD_DIR, [])
-    if build_locations:
-        build_locations = build_locations.split(os.pathsep)
-    build_locations += (args.dev_repo or [])
+    build_locations = _build_locations(args)
 
     #
     # Ask for all required packages via atom now so we can unpack everything at
@@ -123,61 +123,153 @@ def clear_applications(args):
     return 0
 
 
-def launch_application(args):
+def verify_applications(args):
     """
-    Launch an application that contains a launch.json
-
-    This differs from the run command in that the launch.json tells flaunch what to actually
-    call and, because it's a package, the app can contain all the same abilities that our
-    environment building tools do. In essence, it's a env package that can also be called.
+    Check installed packages against the manifests they were built with
     :param args: Arguments that we're going to be working with.
     :return: int
     """
-    logging.debug('Launch Command...')
-    launch_jsons = _prep_launch_jsons(args)
-    exec_name = 'launch' if not args.run else 'run'
-    env = _prep_env_for_launch(args, args.application, exec_name, args.app_args)
-    packages = set(getattr(args, 'packages', []))
+    results = [pkgrep.verify_package(p, full=args.full) for p in args.applications]
+    return 0 if all(results) else 1
+
 
+def _build_locations(args):
+    """
+    Possible locations that development builds might be located
+    :param args: Arguments that we're going to be working with.
+    :return: list[str]
+    """
     build_locations = os.environ.get(FLAUNCH_BUILD_DIR, [])
     if build_locations:
         build_locations = build_locations.split(os.pathsep)
-    build_locations += (args.dev_repo or [])
+    return build_locations + (args.dev_repo or [])
+
+
+def _closure_launch(application):
+    """
+    Install an application from the dependency closure registered with it
+    :param application: The package string of the application
+    :return: list[LaunchJson]|None - None when no usable closure exists
+    """
+    package, _, version = application.partition('/')
+    version = version or None
+    if version == 'dev':
+        return None
+
+    closure = communicate.get_package_closure(package, version)
+    if not closure:
+        return None
+
+    try:
+        closure = lockfile.Lockfile.from_data(closure, 'closure of ' + application)
+        entries = closure.entries
+        launch_order = closure.launch_order
+        entries[launch_order[-1]]['requested'] = version
+    except (lockfile.LockfileError, KeyError, IndexError) as e:
+        logging.debug(str(e))
+        return None
+
+    if not pkgrep.closure_is_current(entries):
+        return None
+
+    logging.debug('Using dependency closure of: {}'.format(application))
+    launch_jsons = pkgrep.install_locked(entries)
+    return [launch_jsons[i] for i in launch_order]
+
+
+def _use_closure(args):
+    """
+    :return: bool - Can this command use a registered dependency closure?
+    """
+    if _build_locations(args) or getattr(args, 'no_closure', False):
+        return False
+    return not (os.environ.get(FLAUNCH_NO_CLOSURE) or os.environ.get('FLAUNCH_ALL_DEV'))
+
+
+def _resolve_closure(args):
+    """
+    Use the dependency closure registered with our application rather than
+    walking the requirement graph one level at a time
+    :param args: Arguments that we're going to be working with.
+    :return: tuple(list[LaunchJson], list[LaunchJson])|None - None when no
+    usable closure exists
+    """
+    if args.run or args.package or not _use_closure(args):
+        return None # The closure only covers the application alone
+
+    resolved_launch = _closure_launch(args.application)
+    if resolved_launch is None:
+        return None
+
+    args.env = os.environ.copy()
+    args.packages = []
+    return [], resolved_launch
+
+
+def _resolve_launch(args):
+    """
+    Resolve every package required to launch our application
+    :param args: Arguments that we're going to be working with.
+    :return: tuple(list[LaunchJson], list[LaunchJson]) -> (packages, launch)
+    """
+    closure = _resolve_closure(args)
+    if closure is not None:
+        return closure
+
+    launch_jsons = _prep_launch_jsons(args)
+    packages = set(getattr(args, 'packages', []))
 
     #
     # Because this is a proper package, we also prep our launchable package!
     #
     resolved_launch = []
     if not args.run:
-        resolved_launch = pkgrep.resolve_packages(
-            [args.application], packages,
-            builds=build_locations,
-            all_ljsons=launch_jsons,
-            launching=True
+        resolved_launch = pkgrep.resolve_application(
+            args.application, packages,
+            builds=_build_locations(args),
+            all_ljsons=launch_jsons
         )
 
-        # -- Swappable dependency management
-        this_app = resolved_launch[-1]
-        for swap_from, swap_to in this_app.swap():
-            all_packages = [lj.package for lj in resolved_launch]
+    return launch_jsons, resolved_launch
 
-            index = -1
-            if swap_from in all_packages:
-                index = all_packages.index(swap_from)
-                resolved_launch.pop(index)
 
-            if swap_to in all_packages:
-                continue
-            else:
-                packages = pkgrep.resolve_packages(
-                    [swap_to], packages,
-                    builds=build_locations,
-                    all_ljsons=launch_jsons
-                )
-                for lj in packages:
-                    if lj.package not in all_packages:
-                        resolved_launch.insert(index, lj)
-                        index += 1
+def _resolve_locked(args):
+    """
+    Install the packages recorded in a lockfile rather than resolving them
+    :param args: Arguments that we're going to be working with.
+    :return: tuple(list[LaunchJson], list[LaunchJson]) -> (packages, launch)
+    """
+    lock = lockfile.Lockfile.load(args.locked)
+    if lock.application != args.application or lock.run != bool(args.run):
+        raise lockfile.LockfileError('Lockfile {} is for: {}'.format(
+            args.locked, lock.application
+        ))
+
+    if args.package:
+        logging.warning('Using the packages from the lockfile: {}'.format(
+            ', '.join(lock.packages)
+        ))
+
+    launch_jsons = pkgrep.install_locked(lock.entries, _build_locations(args))
+
+    args.env = os.environ.copy()
+    args.packages = lock.packages
+    return (
+        [launch_jsons[i] for i in lock.package_order],
+        [launch_jsons[i] for i in lock.launch_order]
+    )
+
+
+def _build_launch(args, launch_jsons, resolved_launch):
+    """
+    Build the environment and commands to launch with
+    :param args: Arguments that we're going to be working with.
+    :param launch_jsons: list[LaunchJson] of our packages
+    :param resolved_launch: list[LaunchJson] of the application packages
+    :return: tuple(list[str], list[str], dict) -> (command, bootstrap, env)
+    """
+    exec_name = 'launch' if not args.run else 'run'
+    env = _prep_env_for_launch(args, args.application, exec_name, args.app_args)
 
     prepped = set()
     for launch_json in resolved_launch + list(launch_jsons):
@@ -191,6 +283,7 @@ def launch_application(args):
 
     arguments = args.app_args
     args_consumed = False
+    bootstrap_commands = []
 
     if args.run:
         #
@@ -224,20 +317,265 @@ def launch_application(args):
             this_app, resolve_env, arguments
         )
 
-        # Fire any bootstrapping this application requires
+        # Any bootstrapping this application requires
         bootstrap_commands = pkgrep.resolve_bootstrap(this_app, env, arguments)
-        if bootstrap_commands:
-            for command in bootstrap_commands:
-                bs_split = shlex.split(command.replace('\\', '/'))
-                code = utils.run_(bs_split, env, args.verbose)
-                if code != 0:
-                    sys.exit(code) # ??
 
     full_command = shlex.split(executable.replace('\\', '/'))
     if not args_consumed:
         full_command = full_command + arguments
 
-    utils.run_(full_command, env, args.verbose)
+    return full_command, bootstrap_commands, env
+
+
+def _use_plan_cache(args):
+    """
+    :return: bool - Can this launch use the launch plan cache?
+    """
+    if args.no_plan_cache or os.environ.get(FLAUNCH_NO_PLAN_CACHE):
+        return False
+    if args.locked:
+        return False # Lockfiles already skip resolving
+    if args.force:
+        return False # We're asked to download everything again
+    return not os.environ.get('FLAUNCH_ALL_DEV')
+
+
+def _install_paths(launch_jsons):
+    """
+    The installs in the package store that a set of packages live in
+    :param launch_jsons: list[LaunchJson]
+    :return: list[str]
+    """
+    paths = set()
+    for lj in launch_jsons:
+        while lj is not None:
+            if not lj.development:
+                paths.add(os.path.dirname(lj.source_path))
+            lj = lj.base
+    return sorted(paths)
+
+
+def launch_application(args):
+    """
+    Launch an application that contains a launch.json
+
+    This differs from the run command in that the launch.json tells flaunch what to actually
+    call and, because it's a package, the app can contain all the same abilities that our
+    environment building tools do. In essence, it's a env package that can also be called.
+    :param args: Arguments that we're going to be working with.
+    :return: int
+    """
+    logging.debug('Launch Command...')
+    base_env = os.environ.copy()
+
+    plans = None
+    plan = None
+    if _use_plan_cache(args):
+        plans = plancache.PlanCache()
+        key = plancache.plan_key(args, _build_locations(args))
+        plan = plans.get(key, base_env)
+
+    if plan is not None:
+        logging.debug('Using cached launch plan: {}'.format(key))
+        full_command = plan.command
+        bootstrap_commands = plan.bootstrap
+        env = plan.environment(base_env)
+        install_paths = plan.install_paths
+
+    else:
+        if args.locked:
+            try:
+                launch_jsons, resolved_launch = _resolve_locked(args)
+            except lockfile.LockfileError as e:
+                logging.critical(str(e))
+                sys.exit(1)
+        else:
+            launch_jsons, resolved_launch = _resolve_launch(args)
+
+        full_command, bootstrap_commands, env = _build_launch(
+            args, launch_jsons, resolved_launch
+        )
+        install_paths = _install_paths(resolved_launch + list(launch_jsons))
+
+        if plans is not None:
+            plan = plancache.LaunchPlan.build(
+                resolved_launch + list(launch_jsons),
+                base_env, env, full_command, bootstrap_commands
+            )
+            if plan is not None:
+                plans.put(key, plan)
+
+    # -- Hold onto our installs until the application exits so the
+    # garbage collector leaves them be
+    with appstore.in_use(install_paths):
+        appstore.collect_if_over_budget()
+
+        # Fire any bootstrapping this application requires
+        for command in bootstrap_commands:
+            bs_split = shlex.split(command.replace('\\', '/'))
+            code = utils.run_(bs_split, env, args.verbose)
+            if code != 0:
+                sys.exit(code) # ??
+
+        utils.run_(full_command, env, args.verbose)
+    return 0
+
+
+def lock_application(args):
+    """
+    Resolve an application launch and write the outcome to a lockfile
+    that `launch --locked` can use without resolving anything
+    :param args: Arguments that we're going to be working with.
+    :return: int
+    """
+    logging.debug('Lock Command...')
+    launch_jsons, resolved_launch = _resolve_launch(args)
+
+    try:
+        lock = lockfile.Lockfile.from_resolution(
+            args.application, args.packages, args.run,
+            launch_jsons, resolved_launch
+        )
+        lock.save(args.output)
+    except (lockfile.LockfileError, IOError, OSError) as e:
+        logging.critical(str(e))
+        return 1
+
+    logging.info('Wrote lockfile: {}'.format(args.output))
+    return 0
+
+
+def fetch_packages(args):
+    """
+    Install everything that packages, applications or a lockfile need
+    without launching anything. Useful for warming up the package store
+    of the farm ahead of a big submission.
+    :param args: Arguments that we're going to be working with.
+    :return: int
+    """
+    start = time.time()
+    build_locations = _build_locations(args)
+
+    jobs = []
+    if args.locked:
+        jobs.append(('lock', args.locked))
+    for pkglist in (args.package or []):
+        jobs.extend(('package', p) for p in pkglist.split(PACKAGE_SPLIT))
+    jobs.extend(('application', a) for a in args.applications)
+
+    if not jobs:
+        logging.error('Nothing to fetch! (-h for help)')
+        return 1
+
+    def _fetch(job):
+        kind, spec = job
+        if kind == 'lock':
+            lock = lockfile.Lockfile.load(spec)
+            return pkgrep.install_locked(lock.entries, build_locations)
+        elif kind == 'package':
+            return pkgrep.resolve_packages([spec], set(), build_locations)
+
+        resolved = None
+        if _use_closure(args):
+            resolved = _closure_launch(spec)
+        if resolved is None:
+            resolved = pkgrep.resolve_application(spec, set(), builds=build_locations)
+        return resolved
+
+    try:
+        results = utils.thread_map(_fetch, jobs)
+    except lockfile.LockfileError as e:
+        logging.critical(str(e))
+        return 1
+
+    installs = dict(
+        ((i['package'].lower(), i['version']), i) for i in pkgrep.pop_installs()
+    )
+
+    # -- What we fetched is about to be used, never evict it for room
+    fetched = _install_paths([lj for launch_jsons in results for lj in launch_jsons])
+    with appstore.in_use(fetched):
+        appstore.collect_if_over_budget()
+
+    packages = []
+    names = {}
+    for launch_jsons in results:
+        for lj in launch_jsons:
+            while lj is not None:
+                key = (lj.package.lower(), lj.version_number)
+                if key not in names:
+                    packages.append(key)
+                    names[key] = lj.package
+                lj = lj.base
+
+    row = '{:<32} {:<16} {:<10} {:>10} {:>8}'
+    print (row.format('Package', 'Version', 'Source', 'Size', 'Time'))
+    total = 0
+    for key in packages:
+        install = installs.get(key)
+        if install is None:
+            print (row.format(names[key], key[1], 'installed', '-', '-'))
+            continue
+        total += install['bytes']
+        print (row.format(
+            install['package'], install['version'], install['source'],
+            utils.human_size(install['bytes']), '{:.2f}s'.format(install['seconds'])
+        ))
+
+    print ('Fetched {} of {} packages ({}) in {:.2f}s'.format(
+        len(installs), len(packages), utils.human_size(total), time.time() - start
+    ))
+    return 0
+
+
+def serve_cache(args):
+    """
+    Serve the packages installed on this node to peers until interrupted
+    :param args: Arguments that we're going to be working with.
+    :return: int
+    """
+    peercache.serve(args.port, announce=not args.no_announce)
+    return 0
+
+
+def collect_garbage(args):
+    """
+    Evict the least recently launched packages from the package store
+    :param args: Arguments that we're going to be working with.
+    :return: int
+    """
+    try:
+        max_size, max_age = appstore.budget()
+        if args.max_size:
+            max_size = appstore.parse_size(args.max_size)
+        if args.max_age:
+            max_age = appstore.parse_age(args.max_age)
+    except ValueError as e:
+        logging.error(str(e))
+        return 1
+
+    if args.reindex:
+        storeindex.StoreIndex().rebuild()
+        if max_size is None and max_age is None:
+            return 0
+
+    if max_size is None and max_age is None:
+        logging.error('Provide --max-size and/or --max-age (-h for help)')
+        return 1
+
+    pinned = appstore.pinned_packages() + (args.pin or [])
+    evicted = appstore.collect(max_size, max_age, pinned=pinned, dry_run=args.dry_run)
+
+    for install in evicted:
+        print ('{}{}/{} ({})'.format(
+            'Would evict: ' if args.dry_run else 'Evicted: ',
+            install['package'], install['version'], utils.human_size(install['size'])
+        ))
+
+    print ('{} {} packages ({})'.format(
+        'Would free' if args.dry_run else 'Freed',
+        len(evicted), utils.human_size(sum(i['size'] for i in evicted))
+    ))
     return 0
 
 
@@ -254,6 +592,8 @@ def build_parser():
         parser.add_argument('-l', '--log', help="Push logging information to a file")
         parser.add_argument('-f', '--force', help="Force redownload any packages that this command uses")
         parser.add_argument('-i', '--index', help="Use this package index URL to locate packages")
+        parser.add_argument('--offline', action='store_true',
+                            help="Resolve packages from the local caches only (no package index)")
 
         # -- Environment tools
         parser.add_argument('-p', '--package', action='append', help='The package(s) to use with this command')
@@ -269,10 +609,25 @@ def build_parser():
     launch_parser.add_argument('-t', '--detach', action='store_true', help="When launching, detach from this process")
     launch_parser.add_argument('-r', '--run', action='store_true',
                                help="Marks the command as a direct executable rather than a package")
+    launch_parser.add_argument('--no-plan-cache', action='store_true',
+                               help="Resolve everything again rather than reuse a cached launch")
+    launch_parser.add_argument('--no-closure', action='store_true',
+                               help="Ignore the dependency closure registered with the application")
+    launch_parser.add_argument('--locked', metavar='LOCKFILE',
+                               help="Launch with the exact packages of a lockfile (see: flaunch lock)")
     launch_parser.add_argument('application', help="Application name to launch")
     launch_parser.add_argument('app_args', nargs=argparse.REMAINDER, help="Arguments that we pass to our application")
     launch_parser.set_defaults(func=launch_application)
 
+    # -- lock
+    lock_parser = subparsers.add_parser('lock', help="Resolve an application and write a lockfile")
+    _fill_parser_with_defaults(lock_parser)
+    lock_parser.add_argument('-r', '--run', action='store_true',
+                             help="Marks the command as a direct executable rather than a package")
+    lock_parser.add_argument('-o', '--output', default='flaunch.lock', help="Lockfile to write (default: flaunch.lock)")
+    lock_parser.add_argument('application', help="Application name to lock")
+    lock_parser.set_defaults(func=lock_application)
+
     # -- path
     path_parser = subparsers.add_parser('path', help="Get the install locations of downloaded applications")
     _fill_parser_with_defaults(path_parser)
@@ -286,6 +641,45 @@ def build_parser():
     clear_parser.add_argument('applications', nargs=argparse.REMAINDER, help="Applications that we're clearing out")
     clear_parser.set_defaults(func=clear_applications)
 
+    # -- verify
+    verify_parser = subparsers.add_parser('verify', help="Check installed packages against their manifests")
+    _fill_parser_with_defaults(verify_parser)
+    verify_parser.add_argument('--full', action='store_true',
+                               help="Hash every file rather than only those that look changed")
+    verify_parser.add_argument('applications', nargs='+', metavar='PACKAGE[/VERSION]',
+                               help="Packages to verify")
+    verify_parser.set_defaults(func=verify_applications)
+
+    # -- fetch
+    fetch_parser = subparsers.add_parser('fetch', help="Install packages ahead of time without launching anything")
+    _fill_parser_with_defaults(fetch_parser)
+    fetch_parser.add_argument('--locked', metavar='LOCKFILE', help="Install the packages of a lockfile")
+    fetch_parser.add_argument('--no-closure', action='store_true',
+                              help="Ignore the dependency closures registered with applications")
+    fetch_parser.add_argument('applications', nargs='*', help="Applications (or composed launchers) to fetch")
+    fetch_parser.set_defaults(func=fetch_packages)
+
+    # -- serve-cache
+    serve_parser = subparsers.add_parser('serve-cache', help="Serve installed packages to other nodes on the LAN")
+    _fill_parser_with_defaults(serve_parser)
+    serve_parser.add_argument('--port', type=int, default=PEER_CACHE_PORT, help="Port to serve on")
+    serve_parser.add_argument('--no-announce', action='store_true',
+                              help="Only serve peers that list us, ignore multicast discovery")
+    serve_parser.set_defaults(func=serve_cache)
+
+    # -- gc
+    gc_parser = subparsers.add_parser('gc', help="Evict the least recently launched packages")
+    _fill_parser_with_defaults(gc_parser)
+    gc_parser.add_argument('--max-size', help="Size the package store may use (e.g. 200G)")
+    gc_parser.add_argument('--max-age', help="Evict packages not launched for this long (e.g. 30d)")
+    gc_parser.add_argument('--pin', action='append', metavar='PACKAGE[/VERSION]',
+                           help="Never evict this package (adds to FLAUNCH_PINNED)")
+    gc_parser.add_argument('-n', '--dry-run', action='store_true',
+                           help="Report what would be evicted without removing anything")
+    gc_parser.add_argument('--reindex', action='store_true',
+                           help="Rebuild the index of installed packages from the package store")
+    gc_parser.set_defaults(func=collect_garbage)
+
     return parser
 
 
@@ -311,7 +705,7 @@ def main():
             if len(sys.argv) <= 2:
                 return 0
 
-        if sys.argv[1] in ('launch', 'path', 'clear', 'update'):
+        if sys.argv[1] in ('launch', 'lock', 'fetch', 'path', 'clear', 'verify', 'serve-cache', 'gc', 'update'):
             return 1
 
         parser.error = original_error
@@ -327,6 +721,9 @@ def main():
     if args.index:
         os.environ["FLAUNCH_CUSTOM_INDEX"] = args.index
 
+    if args.offline:
+        os.environ[FLAUNCH_OFFLINE] = '1'
+
     if not hasattr(args, 'func'):
         logging.critical('Unknown command!')
         parser.print_help()
@@ -0,0 +1,131 @@
+import os
+import time
+import shutil
+import sqlite3
+import tempfile
+import unittest
+
+from common import utils
+from common import filelock
+from common import appstore
+from common import storeindex
+from common.storeindex import StoreIndex
+
+
+class TestAppStore(unittest.TestCase):
+    """
+    Collection evicts the least recently used installs first
+    """
+
+    def setUp(self):
+        self._home = os.environ.get('HOME')
+        self._root = tempfile.mkdtemp()
+        os.environ['HOME'] = self._root
+
+
+    def tearDown(self):
+        if self._home is None:
+            del os.environ['HOME']
+        else:
+            os.environ['HOME'] = self._home
+        shutil.rmtree(self._root)
+
+
+    def _install(self, package, age_days):
+        path = utils.local_path(package, '1.0')
+        os.makedirs(path)
+        with open(os.path.join(path, 'launch.json'), 'w') as f:
+            f.write('x' * 99)
+
+        index = StoreIndex()
+        index.add(package, '1.0', path)
+        index.touch([path], when=time.time() - age_days * 24 * 60 * 60)
+        return path
+
+
+    def test_parse(self):
+        self.assertEqual(appstore.parse_size('200G'), 200 * 1024 ** 3)
+        self.assertEqual(appstore.parse_size('512mb'), 512 * 1024 ** 2)
+        self.assertEqual(appstore.parse_size('10'), 10)
+        self.assertEqual(appstore.parse_age('30d'), 30 * 24 * 60 * 60)
+        self.assertEqual(appstore.parse_age('2'), 2 * 24 * 60 * 60)
+        self.assertRaises(ValueError, appstore.parse_age, '3x')
+
+
+    def test_least_recently_used(self):
+        self._install('Old', 10)
+        self._install('Pinned', 9)
+        newer = self._install('Newer', 5)
+        self._install('Newest', 1)
+
+        evicted = appstore.collect(max_size=200, pinned=['pinned'])
+        self.assertEqual([i['package'] for i in evicted], ['Old', 'Newer'])
+
+        self.assertFalse(os.path.isdir(newer))
+        self.assertTrue(os.path.isdir(utils.local_path('Newest', '1.0')))
+
+
+    def test_max_age(self):
+        self._install('Old', 40)
+        self._install('New', 1)
+
+        evicted = appstore.collect(max_age=appstore.parse_age('30d'), dry_run=True)
+        self.assertEqual([i['package'] for i in evicted], ['Old'])
+        self.assertTrue(os.path.isdir(utils.local_path('Old', '1.0')))
+
+
+    def test_in_use(self):
+        """
+        Installs that are in use are never evicted, and can still be
+        reinstalled
+        """
+        path = self._install('Running', 10)
+        with appstore.in_use([path]):
+            lock = filelock.FileLock(path + '.lock')
+            self.assertTrue(lock.acquire(blocking=False))
+            lock.release()
+
+            self.assertEqual(appstore.collect(max_size=0), [])
+        self.assertEqual(len(appstore.collect(max_size=0)), 1)
+
+
+    def test_over_budget(self):
+        """
+        Launches only collect for installs that can go, and not every time
+        """
+        os.environ['FLAUNCH_STORE_MAX_AGE'] = '30d'
+        os.environ['FLAUNCH_PINNED'] = 'Pinned'
+        try:
+            pinned = self._install('Pinned', 40)
+            appstore.collect_if_over_budget()
+            self.assertTrue(os.path.isdir(pinned))
+            stamp = os.path.join(utils.local_path(None, None, base_only=True), '.gc.stamp')
+            self.assertFalse(os.path.exists(stamp))
+
+            old = self._install('Old', 40)
+            appstore.collect_if_over_budget()
+            self.assertFalse(os.path.isdir(old))
+
+            older = self._install('Older', 50)
+            appstore.collect_if_over_budget()
+            self.assertTrue(os.path.isdir(older))
+
+            # -- Nor does a locked index get in the way of launching
+            os.remove(stamp)
+            index = StoreIndex()
+            storeindex.INDEX_TIMEOUT, timeout = 0.1, storeindex.INDEX_TIMEOUT
+            conn = sqlite3.connect(index.path, isolation_level=None)
+            try:
+                conn.execute('BEGIN EXCLUSIVE')
+                appstore.collect_if_over_budget()
+                self.assertTrue(os.path.isdir(older))
+            finally:
+                conn.close()
+                storeindex.INDEX_TIMEOUT = timeout
+        finally:
+            del os.environ['FLAUNCH_STORE_MAX_AGE']
+            del os.environ['FLAUNCH_PINNED']
+
+
+if __name__ == '__main__':
+    unittest.main()
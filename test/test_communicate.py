@@ -0,0 +1,438 @@
+import os
+import json
+import time
+import hashlib
+import socket
+import shutil
+import tempfile
+import threading
+import unittest
+
+try:
+    from http.server import HTTPServer, BaseHTTPRequestHandler
+except ImportError:
+    from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+
+from common import utils
+from common import communicate
+
+
+class _Atom(BaseHTTPRequestHandler):
+    """
+    Just enough of Atom. Package lookups answer from `packages` and
+    record what they were asked for in `requests`.
+    """
+    packages = {}
+    requests = []
+    max_age = None
+    batch = True
+    heartbeats = []
+    # path -> (etag, bytes), for downloads. `cut` drops the next one after
+    # that many bytes
+    files = {}
+    cut = None
+
+    def log_message(self, format, *args):
+        pass
+
+
+    def _send_json(self, data, status=200, headers=None):
+        body = json.dumps(data).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        if self.max_age is not None:
+            self.send_header('Cache-Control', 'max-age={}'.format(self.max_age))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+
+    def do_HEAD(self):
+        self.heartbeats.append(self.path)
+        self.send_response(200 if self.path.endswith('/core/heartbeat') else 404)
+        self.end_headers()
+
+
+    def do_GET(self):
+        self.requests.append(('GET', self.path, dict(self.headers)))
+        if self.path.startswith('/stall'):
+            # -- A server that went quiet, before or after the headers
+            if self.path == '/stall/body':
+                self.send_response(200)
+                self.send_header('Content-Length', '10')
+                self.end_headers()
+                self.wfile.flush()
+            time.sleep(1)
+            return
+
+        if self.path in self.files:
+            self._send_file(*self.files[self.path])
+            return
+
+        package = self.path.split('?')[0].split('/')[-2]
+        info = self.packages.get(package)
+        if info is None:
+            self._send_json({'error' : 'Not found'})
+        elif self.headers.get('If-None-Match') == info['etag']:
+            self.send_response(304)
+            self.end_headers()
+        else:
+            self._send_json(info['data'], headers={'ETag' : info['etag']})
+
+
+    def _send_file(self, etag, data):
+        start = 0
+        ranged = self.headers.get('Range')
+        if ranged and self.headers.get('If-Range') in (None, etag):
+            start = int(ranged.split('=')[1].split('-')[0])
+            self.send_response(206)
+            self.send_header('Content-Range', 'bytes {}-{}/{}'.format(
+                start, len(data) - 1, len(data)
+            ))
+        else:
+            self.send_response(200)
+        self.send_header('ETag', etag)
+        self.send_header('Content-Length', str(len(data) - start))
+        self.end_headers()
+
+        data = data[start:]
+        if self.cut is not None:
+            data, _Atom.cut = data[:self.cut], None
+        self.wfile.write(data)
+
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers['Content-Length'])).decode('utf-8'))
+        self.requests.append(('POST', self.path, body))
+        if not self.batch:
+            # -- An Atom from before the batch endpoint
+            self.send_response(404)
+            self.end_headers()
+            return
+
+        answers = []
+        for item in body['packages']:
+            info = self.packages.get(item['package'])
+            if info is None:
+                answers.append({'error' : 'Not found'})
+            elif item.get('etag') == info['etag']:
+                answers.append({'not_modified' : True})
+            else:
+                answers.append(dict(info['data'], etag=info['etag']))
+        self._send_json(answers)
+
+
+class _KeepAlive(_Atom):
+    """
+    Keeps connections open, `connections` has the client of each one
+    """
+    protocol_version = 'HTTP/1.1'
+    connections = []
+
+    def handle(self):
+        self.connections.append(self.client_address)
+        _Atom.handle(self)
+
+
+class AtomTestCase(unittest.TestCase):
+    """
+    Runs a fake Atom that communicate connects to, with a store of our own
+    """
+    handler = _Atom
+
+    def setUp(self):
+        self._environ = dict(os.environ)
+        self._root = tempfile.mkdtemp()
+        os.environ['HOME'] = self._root
+
+        _Atom.packages = {}
+        _Atom.requests = []
+        _Atom.max_age = None
+        _Atom.batch = True
+        _Atom.heartbeats = []
+        _Atom.files = {}
+        _Atom.cut = None
+        self._atom = HTTPServer(('127.0.0.1', 0), self.handler)
+        thread = threading.Thread(target=self._atom.serve_forever)
+        thread.daemon = True
+        thread.start()
+        self._url = 'http://127.0.0.1:{}'.format(self._atom.server_port)
+        os.environ['FLAUNCH_CUSTOM_INDEX'] = self._url
+        self._reset()
+
+
+    def tearDown(self):
+        self._atom.shutdown()
+        self._atom.server_close()
+        self._reset()
+        os.environ.clear()
+        os.environ.update(self._environ)
+        shutil.rmtree(self._root)
+
+
+    def _reset(self):
+        # -- Connections and the metadata cache are per process
+        if hasattr(communicate.ConnectionManager, '_instance'):
+            del communicate.ConnectionManager._instance
+        communicate._INFO_CACHE = None
+
+
+class TestPackagesInfo(AtomTestCase):
+    """
+    Looking up many packages at once still revalidates what we have cached
+    """
+
+    def setUp(self):
+        AtomTestCase.setUp(self)
+        _Atom.packages = {
+            'PyFlux' : {'etag' : '"1"', 'data' : {'version' : '1.0'}},
+            'Helios' : {'etag' : '"2"', 'data' : {'version' : '2.0'}}
+        }
+
+
+    def test_batch(self):
+        """
+        One request for all of them, then none until they're stale
+        """
+        _Atom.max_age = 60
+        infos = communicate.get_packages_info([('PyFlux', None), ('Helios', '2.0')])
+        self.assertEqual([i['version'] for i in infos], ['1.0', '2.0'])
+        self.assertEqual(len(_Atom.requests), 1)
+
+        communicate.get_packages_info([('PyFlux', None), ('Helios', '2.0')])
+        self.assertEqual(len(_Atom.requests), 1)
+
+        entry = communicate.info_cache().get('Helios', '2.0')
+        self.assertEqual(entry['etag'], '"2"')
+        self.assertAlmostEqual(entry['expires'], time.time() + 60, delta=5)
+
+
+    def test_revalidate(self):
+        """
+        Stale entries send their ETag and keep their data when it matches
+        """
+        cache = communicate.info_cache()
+        cache.put('PyFlux', None, {'version' : '1.0'}, etag='"1"', ttl=-1)
+        cache.put('Helios', '2.0', {'version' : '1.9'}, etag='"old"', ttl=-1)
+
+        _Atom.max_age = 120
+        infos = communicate.get_packages_info([('PyFlux', None), ('Helios', '2.0')])
+        self.assertEqual([i['version'] for i in infos], ['1.0', '2.0'])
+
+        method, path, body = _Atom.requests[0]
+        self.assertEqual([i.get('etag') for i in body['packages']], ['"1"', '"old"'])
+        self.assertTrue(cache.is_fresh(cache.get('PyFlux')))
+        self.assertAlmostEqual(cache.get('PyFlux')['expires'], time.time() + 120, delta=5)
+
+
+    def test_fallback(self):
+        """
+        Without the batch endpoint every package is asked for on its own,
+        and the batch endpoint isn't tried again
+        """
+        _Atom.batch = False
+        infos = communicate.get_packages_info([('PyFlux', None), ('Helios', '2.0')])
+        self.assertEqual([i['version'] for i in infos], ['1.0', '2.0'])
+
+        methods = [r[0] for r in _Atom.requests]
+        self.assertEqual(methods.count('POST'), 1)
+        self.assertEqual(methods.count('GET'), 2)
+
+        del _Atom.requests[:]
+        infos = communicate.get_packages_info([('Helios', None)])
+        self.assertEqual(infos[0]['version'], '2.0')
+        self.assertEqual([r[0] for r in _Atom.requests], ['GET'])
+
+
+class TestSession(AtomTestCase):
+    """
+    All traffic shares one pooled session
+    """
+    handler = _KeepAlive
+
+    def setUp(self):
+        AtomTestCase.setUp(self)
+        _Atom.packages = {'PyFlux' : {'etag' : '"1"', 'data' : {'version' : '1.0'}}}
+        _KeepAlive.connections = []
+
+
+    def tearDown(self):
+        communicate.ConnectionManager._session = None
+        AtomTestCase.tearDown(self)
+
+
+    def test_shared(self):
+        """
+        Atom and everyone else get the same session, which reuses its
+        connection
+        """
+        session = communicate.http_session()
+        self.assertIs(communicate.ConnectionManager().session, session)
+        self.assertIs(communicate.http_session(), session)
+
+        for _ in range(3):
+            result = session.get(self._url + '/PyFlux/info')
+            self.assertEqual(result.json(), {'version' : '1.0'})
+        self.assertEqual(len(_KeepAlive.connections), 1)
+
+
+    def test_pool_size(self):
+        """
+        The pool is sized from the environment, and never below the worker
+        count
+        """
+        communicate.ConnectionManager._session = None
+        os.environ['FLAUNCH_HTTP_POOL_SIZE'] = '100'
+        adapter = communicate.http_session().get_adapter(self._url)
+        self.assertEqual(adapter._pool_maxsize, 100)
+
+        communicate.ConnectionManager._session = None
+        os.environ['FLAUNCH_HTTP_POOL_SIZE'] = 'lots'
+        adapter = communicate.http_session().get_adapter(self._url)
+        self.assertEqual(
+            adapter._pool_maxsize,
+            max(communicate.DEFAULT_POOL_SIZE, utils.worker_count())
+        )
+
+
+class TestConnection(AtomTestCase):
+    """
+    Finding Atom costs as little waiting as we can get away with
+    """
+
+    def test_heartbeat_ttl(self):
+        """
+        A recent heartbeat is trusted by the next process, until it's too old
+        """
+        communicate.ConnectionManager()
+        self.assertEqual(len(_Atom.heartbeats), 1)
+
+        self._reset()
+        communicate.ConnectionManager()
+        self.assertEqual(len(_Atom.heartbeats), 1)
+
+        self._reset()
+        os.environ['FLAUNCH_HEARTBEAT_TTL'] = '0'
+        communicate.ConnectionManager()
+        self.assertEqual(len(_Atom.heartbeats), 2)
+
+
+    def test_race(self):
+        """
+        The live endpoint wins without waiting on the dead or silent ones
+        """
+        closed = socket.socket()
+        closed.bind(('127.0.0.1', 0))
+        silent = socket.socket()
+        silent.bind(('127.0.0.1', 0))
+        silent.listen(1)
+        try:
+            manager = communicate.ConnectionManager()
+            start = time.time()
+            endpoint = manager._race_endpoints([
+                'http://127.0.0.1:{}\n'.format(closed.getsockname()[1]),
+                'http://127.0.0.1:{}\n'.format(silent.getsockname()[1]),
+                self._url + '\n'
+            ])
+            self.assertEqual(endpoint, self._url)
+            self.assertLess(time.time() - start, 1.5)
+
+            self.assertIsNone(manager._race_endpoints([
+                'http://127.0.0.1:{}'.format(closed.getsockname()[1])
+            ]))
+        finally:
+            closed.close()
+            silent.close()
+
+
+class TestDownload(AtomTestCase):
+    """
+    Interrupted downloads pick up where they left off, when they still can
+    """
+
+    def setUp(self):
+        AtomTestCase.setUp(self)
+        self._data = os.urandom(communicate.DOWNLOAD_CHUNK_SIZE * 3)
+        _Atom.files = {'/files/Pkg.zip' : ('"1"', self._data)}
+        self._dest = os.path.join(self._root, 'Pkg.zip')
+
+
+    def _ranges(self):
+        return [
+            (r[2].get('Range'), r[2].get('If-Range'))
+            for r in _Atom.requests if r[1] == '/files/Pkg.zip'
+        ]
+
+
+    def test_resume(self):
+        """
+        A dropped connection continues from the partial file with If-Range
+        (less the chunk it was in the middle of)
+        """
+        chunk = communicate.DOWNLOAD_CHUNK_SIZE
+        _Atom.cut = chunk * 2 + chunk // 2
+        digest = communicate.download_file(self._url + '/files/Pkg.zip', self._dest)
+        self.assertEqual(digest, hashlib.sha256(self._data).hexdigest())
+        with open(self._dest, 'rb') as f:
+            self.assertEqual(f.read(), self._data)
+
+        self.assertEqual(self._ranges(), [
+            (None, None), ('bytes={}-'.format(chunk * 2), '"1"')
+        ])
+        self.assertFalse(os.path.exists(self._dest + '.partial'))
+        self.assertFalse(os.path.exists(self._dest + '.partial.validator'))
+
+
+    def test_changed(self):
+        """
+        A partial download of a file that changed since starts over
+        """
+        with open(self._dest + '.partial', 'wb') as f:
+            f.write(b'x' * 1000)
+        with open(self._dest + '.partial.validator', 'w') as f:
+            f.write('"0"')
+
+        communicate.download_file(self._url + '/files/Pkg.zip', self._dest)
+        with open(self._dest, 'rb') as f:
+            self.assertEqual(f.read(), self._data)
+        self.assertEqual(self._ranges(), [('bytes=1000-', '"0"')])
+
+
+    def test_checksum(self):
+        """
+        Data that doesn't match the checksum is thrown away
+        """
+        with self.assertRaises(communicate.DownloadError):
+            communicate.download_file(
+                self._url + '/files/Pkg.zip', self._dest, sha256='0' * 64
+            )
+        self.assertFalse(os.path.exists(self._dest))
+        self.assertFalse(os.path.exists(self._dest + '.partial'))
+
+
+class TestStream(AtomTestCase):
+    """
+    Streams give up on a server that stops answering
+    """
+
+    def test_stalled(self):
+        """
+        Nothing coming in for a while is a failed download, not a hang
+        """
+        communicate.DOWNLOAD_TIMEOUT, timeout = (1, 0.2), communicate.DOWNLOAD_TIMEOUT
+        try:
+            with self.assertRaises(communicate.DownloadError):
+                with communicate.open_stream(self._url + '/stall/headers'):
+                    pass
+
+            with self.assertRaises(communicate.DownloadError):
+                with communicate.open_stream(self._url + '/stall/body') as stream:
+                    stream.read()
+        finally:
+            communicate.DOWNLOAD_TIMEOUT = timeout
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,475 @@
+import os
+import sys
+import io
+import shutil
+import tarfile
+import zipfile
+import warnings
+import tempfile
+import unittest
+
+from common import compression
+import common.manifest
+from common.manifest import Manifest
+
+
+class TestZipDelta(unittest.TestCase):
+    """
+    Delta extraction takes what didn't change from the previous version
+    """
+
+    def setUp(self):
+        self._root = tempfile.mkdtemp()
+
+
+    def tearDown(self):
+        shutil.rmtree(self._root)
+
+
+    def _archive(self, version, files):
+        path = os.path.join(self._root, version + '.zip')
+        with zipfile.ZipFile(path, 'w') as zfile:
+            for name, data in files.items():
+                zfile.writestr(name, data)
+        return path
+
+
+    def test_delta(self):
+        previous = os.path.join(self._root, 'previous')
+        compression.unzip_files(
+            self._archive('1.0', { 'same.txt' : 'same', 'lib/changed.txt' : 'a' }),
+            output=previous
+        )
+
+        archive = self._archive('1.1', {
+            'same.txt' : 'same', 'lib/changed.txt' : 'b', 'new.txt' : 'new'
+        })
+        output = os.path.join(self._root, 'output')
+        with zipfile.ZipFile(archive) as zfile:
+            unchanged = compression.unchanged_entries(zfile, previous)
+            self.assertEqual(unchanged, set(['same.txt']))
+            compression.unzip_delta(zfile, previous, unchanged, output)
+
+        for name, data in (('same.txt', 'same'), ('lib/changed.txt', 'b'), ('new.txt', 'new')):
+            with open(os.path.join(output, name)) as f:
+                self.assertEqual(f.read(), data)
+
+
+    def test_outside(self):
+        """
+        Names reaching out of the install are kept inside of it, on both
+        sides of the delta
+        """
+        previous = os.path.join(self._root, 'previous')
+        os.makedirs(previous)
+        for path in (os.path.join(self._root, 'secret.txt'), os.path.join(previous, 'evil.txt')):
+            with open(path, 'w') as f:
+                f.write('secret')
+
+        archive = self._archive('1.1', { '../secret.txt' : 'secret', '../evil.txt' : 'secret' })
+        output = os.path.join(self._root, 'output')
+        with zipfile.ZipFile(archive) as zfile:
+            self.assertEqual(compression.unchanged_entries(zfile, previous), set(['../evil.txt']))
+            compression.unzip_delta(zfile, previous, set(['../evil.txt']), output)
+
+        self.assertEqual(sorted(os.listdir(output)), ['evil.txt', 'secret.txt'])
+        self.assertEqual(sorted(os.listdir(self._root)), ['1.1.zip', 'output', 'previous', 'secret.txt'])
+        self.assertEqual(os.stat(os.path.join(self._root, 'secret.txt')).st_nlink, 1)
+
+
+class TestZipJobs(unittest.TestCase):
+    """
+    Compressing across threads makes the same archive as doing it in turn
+    """
+
+    def setUp(self):
+        self._root = tempfile.mkdtemp()
+        self._source = os.path.join(self._root, 'source')
+        for i in range(20):
+            path = os.path.join(self._source, 'dir{}'.format(i % 3), 'file{}.txt'.format(i))
+            if not os.path.isdir(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            with open(path, 'w') as f:
+                f.write('data {}\n'.format(i) * i * 100)
+        os.makedirs(os.path.join(self._source, 'empty'))
+
+
+    def tearDown(self):
+        shutil.rmtree(self._root)
+
+
+    def _zip(self, name, jobs):
+        path = os.path.join(self._root, name)
+        compression.zip_files(path, [self._source], root=self._source, manifest=True, jobs=jobs)
+        with zipfile.ZipFile(path) as zfile:
+            self.assertIsNone(zfile.testzip())
+            return [(i.filename, i.CRC, i.file_size) for i in zfile.infolist()]
+
+
+    def test_jobs(self):
+        serial = self._zip('serial.zip', 1)
+        parallel = self._zip('parallel.zip', 4)
+        self.assertEqual(
+            [e for e in serial if not e[0].endswith('.json')],
+            [e for e in parallel if not e[0].endswith('.json')]
+        )
+        self.assertIn('empty/', [e[0] for e in parallel])
+
+        output = os.path.join(self._root, 'output')
+        compression.unzip_files(os.path.join(self._root, 'parallel.zip'), output=output)
+        with open(os.path.join(output, 'dir1', 'file7.txt')) as f:
+            self.assertEqual(f.read(), 'data 7\n' * 700)
+
+
+    def test_append_compressed(self):
+        # -- --jobs and --base write entries through ZipFile's internals,
+        # this breaks first when a python changes them
+        path = os.path.join(self._root, 'appended.zip')
+        source = os.path.join(self._source, 'dir1', 'file7.txt')
+        for mode, name in (('w', 'first.txt'), ('a', 'second.txt')):
+            with compression.ZFile(path, mode) as zfile:
+                zfile.writestr('plain_' + name, 'plain')
+                zinfo, data, digest = compression._deflate(source, name, True)
+                with data:
+                    compression._append_compressed(zfile, zinfo, data)
+                zfile.writestr('after_' + name, 'after')
+
+        with zipfile.ZipFile(path) as zfile:
+            self.assertIsNone(zfile.testzip())
+            self.assertEqual(zfile.read('second.txt'), b'data 7\n' * 700)
+            self.assertEqual(
+                zfile.namelist(), [
+                    'plain_first.txt', 'first.txt', 'after_first.txt',
+                    'plain_second.txt', 'second.txt', 'after_second.txt'
+                ]
+            )
+
+
+    def test_single_pass(self):
+        """
+        Files are hashed for the manifest as they're compressed, not read
+        again for it
+        """
+        def _hash_file(*args):
+            raise AssertionError('Read twice')
+
+        common.manifest.hash_file, hash_file = _hash_file, common.manifest.hash_file
+        try:
+            self._zip('serial.zip', 1)
+        finally:
+            common.manifest.hash_file = hash_file
+
+
+    def test_serial_level(self):
+        """
+        Levels apply without --jobs, and files are streamed in (never read
+        whole with writestr())
+        """
+        writestr = zipfile.ZipFile.writestr
+        def _writestr(zfile, zinfo, data, *args, **kwargs):
+            self.assertLess(len(data), 100)
+            return writestr(zfile, zinfo, data, *args, **kwargs)
+
+        sizes = []
+        zipfile.ZipFile.writestr = _writestr
+        try:
+            for level in (1, 9):
+                path = os.path.join(self._root, 'level{}.zip'.format(level))
+                compression.zip_files(
+                    path, [self._source], root=self._source,
+                    policy=compression.CompressionPolicy(level=level, reproducible=True)
+                )
+                with zipfile.ZipFile(path) as zfile:
+                    self.assertIsNone(zfile.testzip())
+                    sizes.append(sum(i.compress_size for i in zfile.infolist()))
+        finally:
+            zipfile.ZipFile.writestr = writestr
+
+        if sys.version_info >= (3, 7):
+            self.assertGreater(sizes[0], sizes[1])
+
+
+    def test_duplicates(self):
+        # -- An appended archive names a file twice, the last one is kept
+        path = os.path.join(self._root, 'appended.zip')
+        with zipfile.ZipFile(path, 'w') as zfile:
+            zfile.writestr('same.txt', 'old ' * 10000)
+            zfile.writestr('other.txt', 'other')
+        with warnings.catch_warnings(), zipfile.ZipFile(path, 'a') as zfile:
+            warnings.simplefilter('ignore')
+            zfile.writestr('same.txt', 'new')
+
+        hashes = {}
+        output = os.path.join(self._root, 'output')
+        compression.unzip_files(path, output=output, workers=4, hashes=hashes)
+        with open(os.path.join(output, 'same.txt')) as f:
+            self.assertEqual(f.read(), 'new')
+        self.assertEqual(sorted(hashes), ['other.txt', 'same.txt'])
+
+
+class TestCompressionPolicy(unittest.TestCase):
+    """
+    Files that wouldn't shrink are stored rather than deflated
+    """
+
+    def setUp(self):
+        self._root = tempfile.mkdtemp()
+        self._source = os.path.join(self._root, 'source')
+        os.makedirs(self._source)
+        for name, data in (
+                ('text.txt', b'text ' * 10000),
+                ('noise.bin', os.urandom(100000)),
+                ('image.png', b'not really ' * 10000),
+                ('data.raw', b'raw ' * 10000)):
+            with open(os.path.join(self._source, name), 'wb') as f:
+                f.write(data)
+
+
+    def tearDown(self):
+        shutil.rmtree(self._root)
+
+
+    def _stored(self, policy):
+        path = os.path.join(self._root, 'archive.zip')
+        compression.zip_files(path, [self._source], root=self._source, policy=policy)
+        with zipfile.ZipFile(path) as zfile:
+            self.assertIsNone(zfile.testzip())
+            return sorted(
+                i.filename for i in zfile.infolist()
+                if i.compress_type == zipfile.ZIP_STORED
+            )
+
+
+    def test_policy(self):
+        self.assertEqual(self._stored(None), [])
+        self.assertEqual(
+            self._stored(compression.CompressionPolicy(auto=True)),
+            ['image.png', 'noise.bin']
+        )
+        self.assertEqual(
+            self._stored(compression.CompressionPolicy(level=1, store=['*.raw'])),
+            ['data.raw']
+        )
+        self.assertEqual(len(self._stored(compression.CompressionPolicy(level=0))), 4)
+
+
+class TestTarCompression(unittest.TestCase):
+    """
+    Tars gzipped across threads (and xz ones) read back like any other
+    """
+
+    def setUp(self):
+        self._root = tempfile.mkdtemp()
+        self._source = os.path.join(self._root, 'source')
+        os.makedirs(self._source)
+        with open(os.path.join(self._source, 'data.txt'), 'w') as f:
+            f.write('data\n' * 100000)
+
+
+    def tearDown(self):
+        shutil.rmtree(self._root)
+
+
+    def _round_trip(self, name, jobs=1):
+        path = os.path.join(self._root, name)
+        compression.tar_files(path, [self._source], root=self._source, jobs=jobs)
+        self.assertTrue(compression.is_tar(path))
+
+        for i, extract in enumerate((compression.untar_files, compression.untar_stream)):
+            output = os.path.join(self._root, 'output{}'.format(i))
+            if extract is compression.untar_files:
+                extract(path, output=output)
+            else:
+                with open(path, 'rb') as f:
+                    extract(f, output)
+            with open(os.path.join(output, 'data.txt')) as f:
+                self.assertEqual(f.read(), 'data\n' * 100000)
+            shutil.rmtree(output)
+
+
+    def test_parallel_gzip(self):
+        compression.GZIP_BLOCK_SIZE, block_size = 64 * 1024, compression.GZIP_BLOCK_SIZE
+        try:
+            self._round_trip('archive.tar.gz', jobs=4)
+        finally:
+            compression.GZIP_BLOCK_SIZE = block_size
+
+
+    def test_xz(self):
+        self._round_trip('archive.tar.xz')
+
+
+    def test_upper_case(self):
+        self._round_trip('ARCHIVE.TAR.GZ')
+        with open(os.path.join(self._root, 'ARCHIVE.TAR.GZ'), 'rb') as f:
+            self.assertEqual(f.read(2), b'\x1f\x8b')
+
+
+    def test_outside(self):
+        """
+        Members can't be extracted outside of the output (e.g. from a
+        package served by a peer)
+        """
+        def _member(tar, name, link=None):
+            info = tarfile.TarInfo(name)
+            if link is None:
+                info.size = 4
+                tar.addfile(info, io.BytesIO(b'evil'))
+            else:
+                info.type, info.linkname = tarfile.SYMTYPE, link
+                tar.addfile(info)
+
+        evil = os.path.join(self._root, 'evil.txt')
+        for members in ((('../evil.txt',),), ((evil,),),
+                        (('link', '..'), ('link/evil.txt',))):
+            path = os.path.join(self._root, 'evil.tar')
+            with tarfile.open(path, 'w') as tar:
+                for member in members:
+                    _member(tar, *member)
+
+            output = os.path.join(self._root, 'output')
+            with open(path, 'rb') as f:
+                try:
+                    compression.untar_stream(f, output)
+                except tarfile.TarError:
+                    pass # Refused, or the name was made relative
+            self.assertFalse(os.path.exists(evil))
+
+            # -- Without the extraction filter of newer pythons
+            with tarfile.open(path) as tar:
+                self.assertRaises(
+                    tarfile.TarError, compression._tar_check, tar.getmembers()[0], output
+                )
+            shutil.rmtree(output, ignore_errors=True)
+
+
+class TestReproducible(unittest.TestCase):
+    """
+    The same files make the same archive, whenever they were written
+    """
+
+    def setUp(self):
+        self._root = tempfile.mkdtemp()
+
+
+    def tearDown(self):
+        shutil.rmtree(self._root)
+
+
+    def _tree(self, name, names, mtime, mode):
+        source = os.path.join(self._root, name)
+        for file_name in names:
+            path = os.path.join(source, file_name)
+            if not os.path.isdir(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            with open(path, 'w') as f:
+                f.write(file_name * 100)
+            os.chmod(path, mode)
+            os.utime(path, (mtime, mtime))
+        return source
+
+
+    def _archives(self, name, archive):
+        contents = []
+        for i, (names, mtime, mode) in enumerate((
+                (['b.txt', 'a/c.txt', 'a/b.txt'], 1500000000, 0o664),
+                (['a/b.txt', 'b.txt', 'a/c.txt'], 1600000000, 0o644))):
+            source = self._tree('source{}'.format(i), names, mtime, mode)
+            path = os.path.join(self._root, '{}{}'.format(i, name))
+            archive(path, source)
+            with open(path, 'rb') as f:
+                contents.append(f.read())
+        return contents
+
+
+    def test_zip(self):
+        first, second = self._archives('.zip', lambda path, source: compression.zip_files(
+            path, [source], root=source, manifest=True, jobs=2,
+            policy=compression.CompressionPolicy(reproducible=True)
+        ))
+        self.assertEqual(first, second)
+
+
+    def test_tar(self):
+        first, second = self._archives('.tar.gz', lambda path, source: compression.tar_files(
+            path, [source], root=source, manifest=True, reproducible=True
+        ))
+        self.assertEqual(first, second)
+
+
+class TestZipBase(unittest.TestCase):
+    """
+    Updating an archive only compresses the files that changed
+    """
+
+    def setUp(self):
+        self._root = tempfile.mkdtemp()
+        self._source = os.path.join(self._root, 'source')
+        os.makedirs(os.path.join(self._source, 'lib'))
+        for name in ('launch.json', 'lib/same.txt', 'lib/changed.txt', 'lib/deleted.txt'):
+            with open(os.path.join(self._source, name), 'w') as f:
+                f.write(name * 1000)
+
+
+    def tearDown(self):
+        shutil.rmtree(self._root)
+
+
+    def _update(self, jobs):
+        path = os.path.join(self._root, 'package.zip')
+        compression.zip_files(path, [self._source], root=self._source, manifest=True)
+        with zipfile.ZipFile(path) as zfile:
+            before = zfile.getinfo('lib/same.txt')
+
+        with open(os.path.join(self._source, 'lib', 'changed.txt'), 'w') as f:
+            f.write('changed' * 1000)
+        with open(os.path.join(self._source, 'lib', 'added.txt'), 'w') as f:
+            f.write('added')
+        os.remove(os.path.join(self._source, 'lib', 'deleted.txt'))
+
+        compression.zip_files(
+            path, [self._source], root=self._source, manifest=True, jobs=jobs, base=path
+        )
+        with zipfile.ZipFile(path) as zfile:
+            self.assertIsNone(zfile.testzip())
+            self.assertNotIn('lib/deleted.txt', zfile.namelist())
+            self.assertEqual(zfile.read('lib/changed.txt'), b'changed' * 1000)
+            self.assertEqual(zfile.read('lib/added.txt'), b'added')
+            after = zfile.getinfo('lib/same.txt')
+            self.assertEqual((after.CRC, after.compress_size), (before.CRC, before.compress_size))
+
+        output = os.path.join(self._root, 'output')
+        compression.unzip_files(path, output=output)
+        manifest = Manifest.load(output)
+        self.assertNotIn('lib/deleted.txt', manifest.files)
+        self.assertEqual(manifest.verify(output, full=True), [])
+
+
+    def test_update(self):
+        self._update(1)
+
+
+    def test_update_jobs(self):
+        self._update(2)
+
+
+    def test_same_size_edit(self):
+        # -- Edited within the two seconds a zip time covers, same size
+        path = os.path.join(self._root, 'package.zip')
+        changed = os.path.join(self._source, 'lib', 'changed.txt')
+        compression.zip_files(path, [self._source], root=self._source, manifest=True)
+        info = os.stat(changed)
+        with open(changed, 'w') as f:
+            f.write('lib/CHANGED.txt' * 1000)
+        os.utime(changed, (info.st_atime, info.st_mtime))
+
+        compression.zip_files(path, [self._source], root=self._source, manifest=True, base=path)
+        output = os.path.join(self._root, 'output')
+        compression.unzip_files(path, output=output)
+        with open(os.path.join(output, 'lib', 'changed.txt')) as f:
+            self.assertEqual(f.read(), 'lib/CHANGED.txt' * 1000)
+        self.assertEqual(Manifest.load(output).verify(output, full=True), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,94 @@
+import os
+import json
+import shutil
+import tempfile
+import unittest
+
+from common.ljson import LaunchJson
+from launch.lockfile import Lockfile, LockfileError
+
+
+class TestLockfile(unittest.TestCase):
+    """
+    Lockfiles must keep the shape of a resolved launch
+    """
+
+    def setUp(self):
+        self._root = tempfile.mkdtemp()
+
+
+    def tearDown(self):
+        shutil.rmtree(self._root)
+
+
+    def _ljson(self, package, version, development=False):
+        path = os.path.join(self._root, package + '.json')
+        with open(path, 'w') as f:
+            json.dump({}, f)
+
+        lj = LaunchJson(package, path, development=development)
+        lj.version_number = version
+        lj.requested_package = package
+        lj.requested_version = None
+        lj.package_info = { 'package' : package, 'version' : version, 'uri' : 'x' }
+        return lj
+
+
+    def test_shared_packages(self):
+        """ Packages shared between the orders are only stored once """
+        base = self._ljson('Base', '1.0.0')
+        pkg = self._ljson('Pkg', '2.0.0')
+        app = self._ljson('App', '3.0.0')
+        app.set_base(base)
+
+        lock = Lockfile.from_resolution('App', ['Pkg'], False, [pkg], [pkg, app])
+        path = os.path.join(self._root, 'app.lock')
+        lock.save(path)
+
+        loaded = Lockfile.load(path)
+        self.assertEqual(len(loaded.entries), 3)
+        self.assertEqual(loaded.package_order, [0])
+        self.assertEqual(loaded.launch_order, [0, 2])
+
+        app_entry = loaded.entries[2]
+        self.assertEqual(app_entry['version'], '3.0.0')
+        self.assertEqual(loaded.entries[app_entry['base']]['package'], 'Base')
+
+
+    def test_development_packages(self):
+        """ Development packages can't be locked """
+        dev = self._ljson('Pkg', 'dev', development=True)
+        with self.assertRaises(LockfileError):
+            Lockfile.from_resolution('App', ['Pkg'], True, [dev], [])
+
+
+    def test_bad_lockfile(self):
+        """ An unknown format is refused """
+        path = os.path.join(self._root, 'bad.lock')
+        with open(path, 'w') as f:
+            json.dump({ 'format' : -1 }, f)
+
+        with self.assertRaises(LockfileError):
+            Lockfile.load(path)
+
+
+    def test_malformed_entries(self):
+        """ Bad indices and missing keys are refused when loading """
+        pkg = self._ljson('Pkg', '2.0.0')
+        data = Lockfile.from_resolution('App', ['Pkg'], False, [pkg], [pkg]).data
+        path = os.path.join(self._root, 'bad.lock')
+
+        def _broken(change):
+            broken = json.loads(json.dumps(data))
+            change(broken)
+            with open(path, 'w') as f:
+                json.dump(broken, f)
+            with self.assertRaises(LockfileError):
+                Lockfile.load(path)
+
+        _broken(lambda d: d['launch_order'].append(1))
+        _broken(lambda d: d['package_order'].append(-1))
+        _broken(lambda d: d['entries'][0].update(base=4))
+        _broken(lambda d: d['entries'][0].pop('info'))
+        _broken(lambda d: d.pop('launch_order'))
+        _broken(lambda d: d['entries'].append('Pkg'))
@@ -0,0 +1,100 @@
+import os
+import time
+import shutil
+import tempfile
+import unittest
+
+from common import compression
+from common.manifest import Manifest, MANIFEST_NAME
+
+
+class TestManifest(unittest.TestCase):
+    """
+    Archives carry a manifest that extractions are verified against
+    """
+
+    def setUp(self):
+        self._root = tempfile.mkdtemp()
+        self._source = os.path.join(self._root, 'source')
+        os.makedirs(os.path.join(self._source, 'lib'))
+        for name, data in (('launch.json', '{}'), ('lib/data.txt', 'data')):
+            with open(os.path.join(self._source, name), 'w') as f:
+                f.write(data)
+
+
+    def tearDown(self):
+        shutil.rmtree(self._root)
+
+
+    def _round_trip(self, name, archive, extract):
+        path = os.path.join(self._root, name)
+        archive(path, [self._source], root=self._source, manifest=True)
+
+        output = os.path.join(self._root, 'output')
+        extract(path, output=output)
+        manifest = Manifest.load(output)
+        self.assertEqual(sorted(manifest.files), ['launch.json', 'lib/data.txt'])
+        manifest.apply_times(output)
+        return manifest, output
+
+
+    def test_zip(self):
+        manifest, output = self._round_trip(
+            'package.zip', compression.zip_files, compression.unzip_files
+        )
+        self.assertTrue(os.path.isfile(os.path.join(output, MANIFEST_NAME)))
+        self.assertEqual(manifest.verify(output), [])
+
+        # -- Same size and modification time, only a full check sees it
+        changed = os.path.join(output, 'lib', 'data.txt')
+        mtime = os.path.getmtime(changed)
+        with open(changed, 'w') as f:
+            f.write('DATA')
+        os.utime(changed, (mtime, mtime))
+        self.assertEqual(manifest.verify(output), [])
+        self.assertEqual(manifest.verify(output, full=True), [('lib/data.txt', 'contents changed')])
+
+        os.utime(changed, (time.time() + 10, time.time() + 10))
+        self.assertEqual(manifest.verify(output), [('lib/data.txt', 'contents changed')])
+
+        os.remove(os.path.join(output, 'launch.json'))
+        self.assertEqual(manifest.verify(output)[0], ('launch.json', 'missing'))
+
+
+    def test_tar(self):
+        manifest, output = self._round_trip(
+            'package.tar.gz', compression.tar_files, compression.untar_files
+        )
+        self.assertEqual(manifest.verify(output, full=True), [])
+
+
+    def test_known_hashes(self):
+        """
+        Hashes taken while extracting aren't taken again, and the ones
+        verify takes are handed back
+        """
+        manifest, output = self._round_trip(
+            'package.zip', compression.zip_files, compression.unzip_files
+        )
+        hashes = {'launch.json' : 'f' * 64}
+        self.assertEqual(manifest.verify(output, full=True, hashes=hashes),
+                         [('launch.json', 'contents changed')])
+        self.assertEqual(hashes['lib/data.txt'], manifest.files['lib/data.txt']['sha256'])
+
+
+    def test_shared_times(self):
+        """
+        Files linked from elsewhere (e.g. the object store) keep their time
+        """
+        manifest, output = self._round_trip(
+            'package.zip', compression.zip_files, compression.unzip_files
+        )
+        path = os.path.join(output, 'lib', 'data.txt')
+        os.link(path, os.path.join(self._root, 'blob'))
+        os.utime(path, (1000, 1000))
+        manifest.apply_times(output)
+        self.assertEqual(os.path.getmtime(path), 1000)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,87 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from common import metacache
+from common.metacache import PackageInfoCache
+
+
+class TestPackageInfoCache(unittest.TestCase):
+    """
+    The metadata cache is what lets a warm launch skip Atom entirely
+    """
+
+    def setUp(self):
+        self._root = tempfile.mkdtemp()
+        self._cache = PackageInfoCache('TestFacility', root=self._root)
+
+
+    def tearDown(self):
+        shutil.rmtree(self._root)
+
+
+    def test_put_and_get(self):
+        """
+        Store information and get it back, case insensitive on the package
+        """
+        self.assertIsNone(self._cache.get('PyFlux'))
+
+        self._cache.put('PyFlux', None, {'version' : '1.2.0'}, etag='"abc"')
+        entry = self._cache.get('pyflux')
+
+        self.assertEqual(entry['data']['version'], '1.2.0')
+        self.assertEqual(entry['etag'], '"abc"')
+        self.assertTrue(self._cache.is_fresh(entry))
+
+        # Specific versions are their own entry
+        self.assertIsNone(self._cache.get('PyFlux', '1.2.0'))
+
+
+    def test_expiry(self):
+        """
+        Entries past their ttl are kept but no longer fresh
+        """
+        self._cache.put('Helios', '0.9.16', {'version' : '0.9.16'}, ttl=-1)
+        entry = self._cache.get('Helios', '0.9.16')
+
+        self.assertIsNotNone(entry)
+        self.assertFalse(self._cache.is_fresh(entry))
+        self.assertFalse(self._cache.is_fresh(None))
+
+
+    def test_bad_entry(self):
+        """
+        A corrupt cache file is a miss, not an error
+        """
+        self._cache.put('Flux', None, {'version' : '1.0.0'})
+        path = self._cache._path('Flux', None)
+        with open(path, 'w') as f:
+            f.write('{ not json')
+
+        self.assertIsNone(self._cache.get('Flux'))
+
+
+    def test_max_age(self):
+        """
+        Cache-Control parsing
+        """
+        self.assertEqual(metacache.max_age({'Cache-Control' : 'max-age=30'}), 30)
+        self.assertIsNone(metacache.max_age({}))
+
+
+    def test_offline(self):
+        """
+        The offline switch
+        """
+        original = os.environ.pop('FLAUNCH_OFFLINE', None)
+        try:
+            self.assertFalse(metacache.is_offline())
+            os.environ['FLAUNCH_OFFLINE'] = '1'
+            self.assertTrue(metacache.is_offline())
+            os.environ['FLAUNCH_OFFLINE'] = 'no'
+            self.assertFalse(metacache.is_offline())
+        finally:
+            os.environ.pop('FLAUNCH_OFFLINE', None)
+            if original is not None:
+                os.environ['FLAUNCH_OFFLINE'] = original
@@ -0,0 +1,60 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from common import objectstore
+
+
+@unittest.skipUnless(hasattr(os, 'link'), 'Hard links are required')
+class TestObjectStore(unittest.TestCase):
+    """
+    Identical files of different installs end up as one blob
+    """
+
+    def setUp(self):
+        self._home = os.environ.get('HOME')
+        self._root = tempfile.mkdtemp()
+        os.environ['HOME'] = self._root
+
+
+    def tearDown(self):
+        if self._home is None:
+            del os.environ['HOME']
+        else:
+            os.environ['HOME'] = self._home
+        shutil.rmtree(self._root)
+
+
+    def _install(self, name, files):
+        path = os.path.join(self._root, name)
+        for file_name, data in files.items():
+            file_path = os.path.join(path, file_name)
+            if not os.path.isdir(os.path.dirname(file_path)):
+                os.makedirs(os.path.dirname(file_path))
+            with open(file_path, 'w') as f:
+                f.write(data)
+        return path
+
+
+    def test_dedupe(self):
+        a = self._install('a', { 'lib/same.txt' : 'same', 'changed.txt' : 'a' })
+        b = self._install('b', { 'lib/same.txt' : 'same', 'changed.txt' : 'b' })
+
+        self.assertEqual(objectstore.dedupe(a), 0)
+        self.assertEqual(objectstore.dedupe(b), 4)
+
+        same = os.path.join('lib', 'same.txt')
+        self.assertTrue(os.path.samefile(os.path.join(a, same), os.path.join(b, same)))
+        with open(os.path.join(b, 'changed.txt')) as f:
+            self.assertEqual(f.read(), 'b')
+
+        # -- Blobs stay as long as an install links to them
+        shutil.rmtree(a)
+        self.assertEqual(objectstore.prune(), 1)
+        shutil.rmtree(b)
+        self.assertEqual(objectstore.prune(), 5)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,173 @@
+import os
+import sys
+import time
+import shutil
+import socket
+import tempfile
+import threading
+import subprocess
+import unittest
+
+try:
+    from http.server import HTTPServer, BaseHTTPRequestHandler
+except ImportError:
+    from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+
+from common import utils
+from common import compression
+from common import peercache
+from common.communicate import http_session
+from launch import pkgrep
+
+SRC = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src')
+
+
+class _Atom(BaseHTTPRequestHandler):
+    """
+    Serves one archive, with ranges (enough for communicate.RemoteFile)
+    """
+    archive = b''
+    requests = []
+
+    def log_message(self, format, *args):
+        pass
+
+
+    def do_HEAD(self):
+        self.requests.append(self.path)
+        self.send_response(200)
+        self.send_header('Accept-Ranges', 'bytes')
+        self.send_header('Content-Length', str(len(self.archive)))
+        self.end_headers()
+
+
+    def do_GET(self):
+        self.requests.append(self.path)
+        data = self.archive
+        if self.headers.get('Range'):
+            start, end = self.headers['Range'].split('=')[1].split('-')
+            data = data[int(start):int(end) + 1]
+            self.send_response(206)
+        else:
+            self.send_response(200)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+def _free_port():
+    sock = socket.socket()
+    sock.bind(('127.0.0.1', 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return port
+
+
+class TestPeerCache(unittest.TestCase):
+    """
+    One process serves its install, another one takes it (as long as it
+    matches the archive on Atom)
+    """
+
+    def setUp(self):
+        self._environ = dict(os.environ)
+        self._root = tempfile.mkdtemp()
+
+        # -- The peer has the package installed, we build it on "Atom"
+        self._peer_home = os.path.join(self._root, 'peer')
+        os.environ['HOME'] = self._peer_home
+        self._installed = utils.local_path('Pkg', '1.0')
+        os.makedirs(os.path.join(self._installed, 'lib'))
+        with open(os.path.join(self._installed, 'launch.json'), 'w') as f:
+            f.write('{}')
+        with open(os.path.join(self._installed, 'lib', 'data.txt'), 'w') as f:
+            f.write('data' * 1000)
+
+        archive = os.path.join(self._root, 'Pkg.zip')
+        compression.zip_files(archive, [self._installed], root=self._installed, manifest=True)
+        with open(archive, 'rb') as f:
+            _Atom.archive = f.read()
+
+        self._atom = HTTPServer(('127.0.0.1', 0), _Atom)
+        atom_thread = threading.Thread(target=self._atom.serve_forever)
+        atom_thread.daemon = True
+        atom_thread.start()
+
+        port = _free_port()
+        env = dict(os.environ, PYTHONPATH=SRC)
+        with open(os.devnull, 'w') as devnull:
+            self._peer = subprocess.Popen([
+                sys.executable, '-c',
+                'import sys; from common import peercache; '
+                'peercache.serve(int(sys.argv[1]), announce=False)', str(port)
+            ], env=env, stdout=devnull, stderr=devnull)
+        self._wait(port)
+
+        os.environ['HOME'] = os.path.join(self._root, 'home')
+        os.environ['FLAUNCH_PEERS'] = '127.0.0.1:{}'.format(port)
+        self._info = {
+            'type' : 'server',
+            'version' : '1.0',
+            'uri' : 'http://127.0.0.1:{}/Pkg.zip'.format(self._atom.server_port)
+        }
+
+
+    def tearDown(self):
+        self._peer.terminate()
+        self._peer.wait()
+        self._atom.shutdown()
+        self._atom.server_close()
+        os.environ.clear()
+        os.environ.update(self._environ)
+        shutil.rmtree(self._root)
+
+
+    def _wait(self, port):
+        url = 'http://127.0.0.1:{}/'.format(port)
+        for _ in range(100):
+            try:
+                http_session().head(url, timeout=1)
+                return
+            except Exception:
+                time.sleep(0.1)
+        self.fail('Peer never came up')
+
+
+    def test_from_peer(self):
+        """
+        An install that matches the manifest on Atom is taken from the peer
+        """
+        staging = os.path.join(self._root, 'staging')
+        self.assertTrue(pkgrep._from_peer('Pkg', self._info, staging))
+        with open(os.path.join(staging, 'lib', 'data.txt')) as f:
+            self.assertEqual(f.read(), 'data' * 1000)
+        self.assertFalse(os.path.exists(os.path.join(staging, peercache.COMPLETE_MARKER)))
+
+
+    def test_mismatch(self):
+        """
+        A peer sending what Atom doesn't have is passed over for Atom
+        """
+        with open(os.path.join(self._installed, 'lib', 'data.txt'), 'w') as f:
+            f.write('DATA' * 1000)
+
+        pkgrep.pop_installs()
+        path = utils.local_path('Pkg', '1.0')
+        pkgrep._install('Pkg', self._info, path)
+        with open(os.path.join(path, 'lib', 'data.txt')) as f:
+            self.assertEqual(f.read(), 'data' * 1000)
+        self.assertEqual([i['source'] for i in pkgrep.pop_installs()], ['atom'])
+
+
+    def test_no_peer(self):
+        """
+        Nothing is asked of Atom when there's no peer to check
+        """
+        os.environ['FLAUNCH_PEERS'] = ''
+        del _Atom.requests[:]
+        self.assertIsNone(pkgrep._from_peer('Pkg', self._info, self._root))
+        self.assertEqual(_Atom.requests, [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,426 @@
+import os
+import sys
+import json
+import time
+import shutil
+import tempfile
+import threading
+import subprocess
+import unittest
+
+try:
+    from http.server import HTTPServer, BaseHTTPRequestHandler
+except ImportError:
+    from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+
+try:
+    from StringIO import StringIO
+except ImportError:
+    from io import StringIO
+
+from common import utils
+from common import filelock
+from common import compression
+from common import communicate
+from launch import pkgrep
+
+SRC = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src')
+
+
+class PackageTestCase(unittest.TestCase):
+    """
+    Packages served from zips on disk, Atom's answers come from `_packages`
+    """
+    # package -> version -> launch.json
+    _packages = {}
+
+    def setUp(self):
+        self._home = os.environ.get('HOME')
+        self._root = tempfile.mkdtemp()
+        os.environ['HOME'] = self._root
+
+        self._archives = os.path.join(self._root, 'archives')
+        for package, versions in self._packages.items():
+            for version, launch in versions.items():
+                source = os.path.join(self._root, 'source', package, version)
+                os.makedirs(source)
+                with open(os.path.join(source, 'launch.json'), 'w') as f:
+                    json.dump(launch, f)
+                compression.zip_files(
+                    os.path.join(utils.ensure_dir(os.path.join(self._archives, package)),
+                                 version + '.zip'),
+                    [source], root=source, manifest=True
+                )
+
+        self._lookups = []
+        self._get_package_info = communicate.get_package_info
+        self._get_packages_info = communicate.get_packages_info
+        communicate.get_package_info = self._info
+        communicate.get_packages_info = lambda pairs: [self._info(*p) for p in pairs]
+
+
+    def tearDown(self):
+        communicate.get_package_info = self._get_package_info
+        communicate.get_packages_info = self._get_packages_info
+        if self._home is None:
+            del os.environ['HOME']
+        else:
+            os.environ['HOME'] = self._home
+        shutil.rmtree(self._root)
+
+
+    def _info(self, package, version=None):
+        self._lookups.append((package, version))
+        versions = self._packages.get(package)
+        if not versions or (version and version not in versions):
+            return None
+        version = version or max(versions)
+        return {
+            'type' : 'file',
+            'version' : version,
+            'uri' : os.path.join(self._archives, package, version + '.zip')
+        }
+
+
+class TestResolve(PackageTestCase):
+    """
+    Prefetching the graph doesn't change what resolve_packages() picks
+    """
+    _packages = {
+        'App' : {'1.0' : {'requires' : ['A', 'B']}},
+        'A' : {'1.0' : {'requires' : ['X']}},
+        'X' : {'1.0' : {'requires' : ['C/2.0']}},
+        'B' : {'1.0' : {'requires' : ['C/1.0', 'D']}},
+        'C' : {'1.0' : {}, '2.0' : {'requires' : ['D']}},
+        'D' : {'1.0' : {}}
+    }
+
+    def _resolve(self, prefetch):
+        prefetcher = pkgrep.PackagePrefetcher()
+        if prefetch:
+            prefetcher.prefetch(['App'], set())
+        order = pkgrep.resolve_packages(['App'], set(), prefetcher=prefetcher)
+        return [(lj.package, lj.version_number) for lj in order], prefetcher
+
+
+    def test_same_as_serial(self):
+        """
+        Order and versions match a walk that installs one package at a time,
+        and the version picked depth-first was fetched up front
+        """
+        serial, _ = self._resolve(False)
+        self.assertEqual(
+            serial,
+            [('D', '1.0'), ('C', '2.0'), ('X', '1.0'), ('A', '1.0'), ('B', '1.0'), ('App', '1.0')]
+        )
+
+        pkgrep.clear_package('ALL_PACKAGES')
+        prefetched, prefetcher = self._resolve(True)
+        self.assertEqual(prefetched, serial)
+
+        del self._lookups[:]
+        for package, version in prefetched:
+            requested = version if package == 'C' else None
+            self.assertIn((package, requested), prefetcher._installed)
+        pkgrep.resolve_packages(['App'], set(), prefetcher=prefetcher)
+        self.assertEqual(self._lookups, [])
+
+
+class TestInstall(PackageTestCase):
+    """
+    Installs hold up to more than one flaunch at a time
+    """
+    _packages = {'Pkg' : {'1.0' : {'environment' : {}}}}
+
+    def test_single_flight(self):
+        """
+        Processes installing the same version wait on each other and only
+        one of them installs it
+        """
+        info = self._info('Pkg', '1.0')
+        path = utils.local_path('Pkg', '1.0')
+        script = (
+            'import sys, json; from launch import pkgrep; '
+            'pkgrep._install("Pkg", json.loads(sys.argv[1]), sys.argv[2]); '
+            'print(len(pkgrep.pop_installs()))'
+        )
+
+        # -- Hold the lock so they're both waiting on it when it frees up
+        lock = filelock.FileLock(path + '.lock')
+        lock.acquire()
+        try:
+            env = dict(os.environ, PYTHONPATH=SRC)
+            installs = [
+                subprocess.Popen(
+                    [sys.executable, '-c', script, json.dumps(info), path],
+                    env=env, stdout=subprocess.PIPE
+                )
+                for _ in range(2)
+            ]
+            time.sleep(1)
+        finally:
+            lock.release()
+
+        counts = []
+        for install in installs:
+            out, _ = install.communicate()
+            self.assertEqual(install.returncode, 0)
+            counts.append(int(out.decode('utf-8').strip()))
+        self.assertEqual(sorted(counts), [0, 1])
+
+        with open(os.path.join(path, 'launch.json')) as f:
+            self.assertEqual(json.load(f), {'environment' : {}})
+        self.assertEqual(
+            [p for p in os.listdir(os.path.dirname(path)) if p.endswith('.tmp')], []
+        )
+
+
+class TestSharedCache(PackageTestCase):
+    """
+    Packages in a shared cache are used rather than fetched
+    """
+    _packages = {'Pkg' : {'1.0' : {}, '2.0' : {}}}
+
+    def setUp(self):
+        PackageTestCase.setUp(self)
+        self._shared = os.path.join(self._root, 'shared')
+        utils.ensure_dir(os.path.join(self._shared, 'Pkg', '1.0'))
+        with open(os.path.join(self._shared, 'Pkg', '1.0', 'launch.json'), 'w') as f:
+            json.dump({'shared' : True}, f)
+
+        os.environ['FLAUNCH_SHARED_CACHE'] = os.pathsep.join([
+            os.path.join(self._root, 'nothing'), self._shared
+        ])
+        pkgrep.pop_installs()
+
+
+    def tearDown(self):
+        os.environ.pop('FLAUNCH_SHARED_CACHE', None)
+        os.environ.pop('FLAUNCH_SHARED_CACHE_MODE', None)
+        PackageTestCase.tearDown(self)
+
+
+    def _install(self, version):
+        path = utils.local_path('Pkg', version)
+        pkgrep._install('Pkg', self._info('Pkg', version), path)
+        with open(os.path.join(path, 'launch.json')) as f:
+            launch = json.load(f)
+        return path, launch, [i['source'] for i in pkgrep.pop_installs()]
+
+
+    def test_link(self):
+        """
+        A hit is linked into the store without touching the archive
+        """
+        os.remove(os.path.join(self._archives, 'Pkg', '1.0.zip'))
+        path, launch, sources = self._install('1.0')
+        self.assertEqual(launch, {'shared' : True})
+        self.assertEqual(sources, ['shared'])
+        self.assertEqual(os.path.realpath(path), os.path.realpath(
+            os.path.join(self._shared, 'Pkg', '1.0')
+        ))
+
+
+    def test_copy(self):
+        """
+        FLAUNCH_SHARED_CACHE_MODE=copy leaves us with our own install
+        """
+        os.environ['FLAUNCH_SHARED_CACHE_MODE'] = 'copy'
+        path, launch, sources = self._install('1.0')
+        self.assertEqual(launch, {'shared' : True})
+        self.assertEqual(sources, ['shared'])
+        self.assertFalse(os.path.islink(path))
+
+
+    def test_miss(self):
+        """
+        Versions the shared cache doesn't have come from the archive
+        """
+        path, launch, sources = self._install('2.0')
+        self.assertEqual(launch, {})
+        self.assertEqual(sources, ['file'])
+        self.assertFalse(os.path.islink(path))
+
+
+class TestFetch(PackageTestCase):
+    """
+    `flaunch fetch` installs everything up front and says where it came from
+    """
+    _packages = {
+        'App' : {'1.0' : {'requires' : ['A', 'B']}},
+        'Tool' : {'2.0' : {'requires' : ['B']}},
+        'A' : {'1.0' : {}},
+        'B' : {'1.0' : {}, '1.1' : {}}
+    }
+
+    def setUp(self):
+        PackageTestCase.setUp(self)
+        # -- start.py runs as a script, next to the rest of launch
+        launch = os.path.join(SRC, 'launch')
+        if launch not in sys.path:
+            sys.path.insert(0, launch)
+        import start
+        self._start = start
+
+
+    def _fetch(self, *argv):
+        args = self._start.build_parser().parse_args(['fetch'] + list(argv))
+        stdout, sys.stdout = sys.stdout, StringIO()
+        try:
+            code = args.func(args)
+            lines = sys.stdout.getvalue().splitlines()
+        finally:
+            sys.stdout = stdout
+        self.assertEqual(code, 0)
+        return dict((l.split()[0], l.split()[1:3]) for l in lines[1:-1]), lines[-1]
+
+
+    def test_fetch(self):
+        """
+        Every package is installed once and reported, then they're all
+        already there
+        """
+        rows, summary = self._fetch('-p', 'App:Tool')
+        self.assertEqual(rows, {
+            'App' : ['1.0', 'file'],
+            'Tool' : ['2.0', 'file'],
+            'A' : ['1.0', 'file'],
+            'B' : ['1.1', 'file']
+        })
+        self.assertTrue(summary.startswith('Fetched 4 of 4 packages'))
+        for package, (version, _) in rows.items():
+            self.assertTrue(os.path.isfile(
+                os.path.join(utils.local_path(package, version), 'launch.json')
+            ))
+
+        rows, summary = self._fetch('-p', 'App', '-p', 'Tool')
+        self.assertEqual(set(r[1] for r in rows.values()), set(['installed']))
+        self.assertTrue(summary.startswith('Fetched 0 of 4 packages'))
+
+
+class _Archives(BaseHTTPRequestHandler):
+    """
+    Serves the files under `root` with ranges, counting what went out
+    """
+    root = None
+    sent = 0
+
+    def log_message(self, format, *args):
+        pass
+
+
+    def _data(self):
+        with open(os.path.join(self.root, *self.path.strip('/').split('/')), 'rb') as f:
+            return f.read()
+
+
+    def do_HEAD(self):
+        self.send_response(200)
+        self.send_header('Accept-Ranges', 'bytes')
+        self.send_header('Content-Length', str(len(self._data())))
+        self.end_headers()
+
+
+    def do_GET(self):
+        data = self._data()
+        if self.headers.get('Range'):
+            start, end = self.headers['Range'].split('=')[1].split('-')
+            data = data[int(start):int(end) + 1 if end else None]
+            self.send_response(206)
+        else:
+            self.send_response(200)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+        _Archives.sent += len(data)
+
+
+class TestDelta(PackageTestCase):
+    """
+    Updating a package only pulls the files that changed from Atom
+    """
+
+    def setUp(self):
+        PackageTestCase.setUp(self)
+        self._environ = dict(os.environ)
+        os.environ['FLAUNCH_PEERS'] = ''
+
+        self._big = os.urandom(200000)
+        for version in ('1.0', '2.0'):
+            source = os.path.join(self._root, 'source', 'Pkg', version)
+            utils.ensure_dir(os.path.join(source, 'lib'))
+            with open(os.path.join(source, 'launch.json'), 'w') as f:
+                json.dump({}, f)
+            with open(os.path.join(source, 'lib', 'big.bin'), 'wb') as f:
+                f.write(self._big)
+            with open(os.path.join(source, 'lib', 'version.txt'), 'w') as f:
+                f.write(version)
+            compression.zip_files(
+                os.path.join(utils.ensure_dir(os.path.join(self._archives, 'Pkg')),
+                             version + '.zip'),
+                [source], root=source, manifest=True
+            )
+
+        _Archives.root = self._archives
+        _Archives.sent = 0
+        self._server = HTTPServer(('127.0.0.1', 0), _Archives)
+        thread = threading.Thread(target=self._server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        pkgrep.pop_installs()
+
+
+    def tearDown(self):
+        self._server.shutdown()
+        self._server.server_close()
+        os.environ.clear()
+        os.environ.update(self._environ)
+        PackageTestCase.tearDown(self)
+
+
+    def _install(self, version):
+        path = utils.local_path('Pkg', version)
+        pkgrep._install('Pkg', {
+            'type' : 'server',
+            'version' : version,
+            'uri' : 'http://127.0.0.1:{}/Pkg/{}.zip'.format(self._server.server_port, version)
+        }, path)
+        return path
+
+
+    def test_delta(self):
+        """
+        The unchanged file comes from the previous install, only the
+        changed one is downloaded
+        """
+        self._install('1.0')
+        first = _Archives.sent
+        self.assertGreater(first, len(self._big))
+
+        _Archives.sent = 0
+        path = self._install('2.0')
+        self.assertLess(_Archives.sent, len(self._big) // 2)
+
+        with open(os.path.join(path, 'lib', 'big.bin'), 'rb') as f:
+            self.assertEqual(f.read(), self._big)
+        with open(os.path.join(path, 'lib', 'version.txt')) as f:
+            self.assertEqual(f.read(), '2.0')
+
+        installs = pkgrep.pop_installs()
+        self.assertEqual([i['source'] for i in installs], ['atom', 'atom'])
+        self.assertLess(installs[1]['bytes'], len(self._big) // 2)
+
+
+    def test_no_delta(self):
+        """
+        FLAUNCH_NO_DELTA downloads the whole archive
+        """
+        self._install('1.0')
+        os.environ['FLAUNCH_NO_DELTA'] = '1'
+        _Archives.sent = 0
+        self._install('2.0')
+        self.assertGreater(_Archives.sent, len(self._big))
+
+
+if __name__ == '__main__':
+    unittest.main()
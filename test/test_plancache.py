@@ -0,0 +1,93 @@
+import os
+import json
+import shutil
+import tempfile
+import unittest
+
+from common.ljson import LaunchJson
+from launch.plancache import LaunchPlan, PlanCache, referenced_variables
+
+
+class TestPlanCache(unittest.TestCase):
+    """
+    Cached launch plans must only be used when nothing they were
+    built from has changed
+    """
+
+    def setUp(self):
+        self._root = tempfile.mkdtemp()
+        self._ljson_path = os.path.join(self._root, 'launch.json')
+        with open(self._ljson_path, 'w') as f:
+            json.dump({
+                'executable' : '{path}/bin/app',
+                'env' : { 'APP_ROOT' : '{path}', 'APP_USER' : '{STUDIO_USER|low}' }
+            }, f)
+
+        self._lj = LaunchJson('App', self._ljson_path)
+        self._lj.version_number = '1.0.0'
+        self._lj.requested_version = '1.0.0'
+
+
+    def tearDown(self):
+        shutil.rmtree(self._root)
+
+
+    def _plan(self, base_env):
+        env = dict(base_env, APP_ROOT='/apps/App', APP_USER='me')
+        return LaunchPlan.build(
+            [self._lj], base_env, env, ['/apps/App/bin/app'], []
+        )
+
+
+    def test_referenced_variables(self):
+        """
+        Variables are found in values, with expressions stripped
+        """
+        found = referenced_variables([self._lj])
+        self.assertIn('STUDIO_USER', found)
+        self.assertIn('path', found)
+
+
+    def test_plan_round_trip(self):
+        """
+        A plan is reused as long as its inputs stay put
+        """
+        base_env = { 'STUDIO_USER' : 'ME', 'HOME' : '/home/me' }
+        cache = PlanCache(os.path.join(self._root, 'plans'))
+        cache.put('key', self._plan(base_env))
+
+        plan = cache.get('key', base_env)
+        self.assertIsNotNone(plan)
+        self.assertEqual(plan.command, ['/apps/App/bin/app'])
+        self.assertEqual(plan.environment(base_env)['APP_ROOT'], '/apps/App')
+
+        # -- Unrelated variables don't matter
+        self.assertIsNotNone(cache.get('key', dict(base_env, HOME='/elsewhere')))
+
+        # -- Ones we expand do
+        self.assertIsNone(cache.get('key', dict(base_env, STUDIO_USER='YOU')))
+
+
+    def test_changed_launch_json(self):
+        """
+        Touching a launch.json invalidates the plan
+        """
+        base_env = { 'STUDIO_USER' : 'ME' }
+        plan = self._plan(base_env)
+        self.assertTrue(plan.is_valid(base_env))
+
+        with open(self._ljson_path, 'a') as f:
+            f.write('\n')
+        self.assertFalse(plan.is_valid(base_env))
+
+
+    def test_removed_variables(self):
+        """
+        Variables the launch took out of the environment stay out
+        """
+        base_env = { 'STUDIO_USER' : 'ME', 'PYTHONHOME' : '/usr' }
+        env = { 'STUDIO_USER' : 'ME', 'APP_ROOT' : '/apps/App' }
+        plan = LaunchPlan.build([self._lj], base_env, env, ['/apps/App/bin/app'], [])
+
+        self.assertEqual(plan.environment(base_env), env)
+        self.assertFalse(plan.is_valid(dict(base_env, PYTHONHOME='/opt')))
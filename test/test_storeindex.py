@@ -0,0 +1,108 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from common import utils
+from common import compression
+from common.storeindex import StoreIndex
+from launch import pkgrep
+
+
+class TestStoreIndex(unittest.TestCase):
+    """
+    The index has to agree with the package store
+    """
+
+    def setUp(self):
+        self._home = os.environ.get('HOME')
+        self._root = tempfile.mkdtemp()
+        os.environ['HOME'] = self._root
+
+
+    def tearDown(self):
+        if self._home is None:
+            del os.environ['HOME']
+        else:
+            os.environ['HOME'] = self._home
+        shutil.rmtree(self._root)
+
+
+    def _install(self, package, version):
+        path = utils.local_path(package, version)
+        os.makedirs(path)
+        with open(os.path.join(path, 'launch.json'), 'w') as f:
+            f.write('{}')
+        return path
+
+
+    def test_built_from_store(self):
+        path = self._install('Pkg', '1.0')
+        self._install('Pkg', '1.1')
+        os.makedirs(utils.local_path('Pkg', '1.2.123.456.tmp')) # In progress
+
+        index = StoreIndex()
+        self.assertEqual(index.lookup('Pkg', '1.0')['path'], path)
+        self.assertEqual(index.lookup('Pkg', '1.0')['size'], 2)
+        self.assertEqual([i['version'] for i in index.versions('Pkg')], ['1.0', '1.1'])
+        self.assertIsNone(index.lookup('Pkg', '1.2.123.456.tmp'))
+
+
+    def test_add_and_remove(self):
+        index = StoreIndex()
+        self.assertEqual(index.installs(), [])
+
+        path = self._install('Pkg', '1.0')
+        self.assertIsNone(index.lookup('Pkg', '1.0'))
+
+        index.add('Pkg', '1.0', path, digest='abc')
+        self.assertEqual(index.lookup('Pkg', '1.0')['digest'], 'abc')
+
+        # -- Failing to remove it from the store keeps it in the index
+        try:
+            with index.removing(path):
+                raise OSError('in use')
+        except OSError:
+            pass
+        self.assertIsNotNone(index.lookup('Pkg', '1.0'))
+
+        index.remove_package('Pkg')
+        self.assertEqual(index.installs(), [])
+
+
+    def test_case_insensitive(self):
+        index = StoreIndex()
+        index.add('Pkg', '1.0', self._install('Pkg', '1.0'))
+        self.assertIsNotNone(index.lookup('pkg', '1.0'))
+        self.assertEqual(len(index.versions('PKG')), 1)
+
+        index.remove_package('pkg')
+        self.assertEqual(index.installs(), [])
+
+
+    def test_removed_by_hand(self):
+        """
+        The index is trusted, an install that turns out to be gone from
+        disk is dropped from it and installed again
+        """
+        source = os.path.join(self._root, 'source')
+        os.makedirs(source)
+        with open(os.path.join(source, 'launch.json'), 'w') as f:
+            f.write('{}')
+        archive = os.path.join(self._root, 'Pkg.zip')
+        compression.zip_files(archive, [source], root=source)
+        info = { 'type' : 'file', 'uri' : archive, 'version' : '1.0' }
+
+        path = utils.local_path('Pkg', '1.0')
+        pkgrep._install('Pkg', info, path)
+        shutil.rmtree(path)
+        self.assertTrue(pkgrep._is_installed('Pkg', '1.0', path))
+
+        launch_json = os.path.join(path, 'launch.json')
+        pkgrep._load_launch_json('Pkg', launch_json, info, False)
+        self.assertTrue(os.path.isfile(launch_json))
+        self.assertEqual(StoreIndex().lookup('Pkg', '1.0')['path'], path)
+
+
+if __name__ == '__main__':
+    unittest.main()
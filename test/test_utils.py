@@ -0,0 +1,28 @@
+import sys
+import unittest
+
+from common import utils
+
+
+class TestThreadMap(unittest.TestCase):
+    """
+    Work spread across threads comes back in order, errors and all
+    """
+
+    def test_order(self):
+        self.assertEqual(utils.thread_map(lambda i: i * 2, range(20), 4), list(range(0, 40, 2)))
+
+
+    def test_exit(self):
+        # -- SystemExit isn't an Exception, the pool used to lose it and hang
+        def _exit(i):
+            if i == 1:
+                sys.exit(1)
+            return i
+
+        with self.assertRaises(SystemExit):
+            utils.thread_map(_exit, [0, 1, 2], 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -4,7 +4,6 @@
 from __future__ import absolute_import
 
 import os
-import requests
 import platform
 
 from common import utils
@@ -59,7 +58,7 @@ class JenkinsCommand(_BuildCommand):
             endpoint += '/job/{}/build'.format(proper_jobname)
 
             # -- May have to handle a client session here
-            result = requests.post(
+            result = communicate.http_session().post(
                 endpoint,
                 json=job_data,
                 headers=communicate.default_headers()